@@ -0,0 +1,1492 @@
+# ==================== FILE 23: agent_core.py ====================
+"""
+Gmail agent core
+The Gmail tools and the agent loop without any UI. Conversation state
+lives in an AgentContext passed in explicitly, so the same agent runs
+under Streamlit, the CLI, the HTTP server or a scheduled job. Heavy
+client libraries (LangChain, Gemini, Gmail discovery, OAuth flow) are
+imported on first use to keep cold starts short.
+"""
+
+import functools
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from gmail_fetch import (FULL_FIELDS, PROFILE_FIELDS, fetch_full_messages, fetch_message_metadata,
+                         iter_message_pages)
+from mailbox_cache import MailboxCache
+from listing import ListingAggregate
+from records import BODY_PREVIEW_CHARS, EmailContent, EmailList, append_part, to_llm, to_markdown
+from mime_body import extract_body
+from attachments import AttachmentStore, fetch_attachment_parts, fetch_attachments, format_size
+from summarize import content_hash, render_digest, summarize_batch
+from prefetch import PrefetchWorker
+from plan_cache import PlanCache, cacheable
+from gmail_accounts import AccountPool, TokenStore, account_file, normalize_account
+from gmail_bulk import batch_modify, label_changes, pending_selection
+from outbox import Outbox, OutboxWorker, encode_message, parse_recipients, render_merge
+from memory_cache import LRUCache
+from chat_history import SEND_CONFIRMATION_MARKER, compact_history
+from intent_router import route
+from gmail_quota import execute
+from metrics import instrument_tool, registry
+
+# ==================== ENV ====================
+load_dotenv()
+
+# ==================== LANGCHAIN TOOLS ====================
+class LazyTool:
+    """Tool function that becomes a LangChain tool on first use
+    
+    langchain_core takes longer to import than the rest of the app, so
+    it is only loaded once a tool is invoked or bound to the model.
+    """
+    
+    def __init__(self, fn):
+        functools.update_wrapper(self, fn)
+        self.name = fn.__name__
+        self._tool = None
+        self._lock = threading.Lock()
+    
+    @property
+    def tool(self):
+        with self._lock:
+            if self._tool is None:
+                from langchain_core.tools import tool
+                self._tool = tool(self.__wrapped__)
+            return self._tool
+    
+    def invoke(self, args):
+        return self.tool.invoke(args)
+
+# ==================== GMAIL SCOPES ====================
+SCOPES = [
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.send',
+    'https://www.googleapis.com/auth/gmail.modify'
+]
+
+# ==================== CONTEXT ====================
+class AgentContext:
+    """State of one conversation with the agent
+    
+    The Streamlit app keeps one per browser session; the CLI and the HTTP
+    server keep one per conversation.
+    """
+    
+    def __init__(self, account=None):
+        self.account = account
+        self.user_email = None
+        # Secret proving this conversation logged in to the account itself
+        self.grant = None
+        # Message ids behind the numbers of the latest listing
+        self.email_handles = []
+        self.mailbox_cache = None
+        self.body_cache = None
+        self.agent_timings = None
+        self.token_stats = None
+        self.llm_calls_saved = 0
+    
+    def reset(self):
+        """Forget the account and everything derived from it"""
+        self.__init__()
+
+_context_state = threading.local()
+
+def current_context():
+    """The AgentContext the calling thread works for"""
+    context = getattr(_context_state, 'context', None)
+    if context is None:
+        raise RuntimeError("No agent context: run tools inside use_context()")
+    return context
+
+@contextmanager
+def use_context(context):
+    """Make context the current one for the calling thread"""
+    previous = getattr(_context_state, 'context', None)
+    _context_state.context = context
+    try:
+        yield context
+    finally:
+        _context_state.context = previous
+
+def resource(fn):
+    """Create a shared resource once per process and set of arguments
+    
+    Works like st.cache_resource, without needing Streamlit; clear()
+    drops every instance, clear(*args) only the one built for args, and
+    peek(*args) returns the instance for args if one was built.
+    """
+    instances = {}
+    lock = threading.RLock()
+    
+    @functools.wraps(fn)
+    def wrapper(*args):
+        with lock:
+            if args not in instances:
+                instances[args] = fn(*args)
+            return instances[args]
+    
+    def clear(*args):
+        with lock:
+            if args:
+                instances.pop(args, None)
+            else:
+                instances.clear()
+    
+    def peek(*args):
+        with lock:
+            return instances.get(args)
+    
+    wrapper.clear = clear
+    wrapper.peek = peek
+    return wrapper
+
+# ==================== GMAIL AUTHENTICATION ====================
+# One token file per account, so a single process can serve many mailboxes
+TOKEN_DIR = os.getenv("TOKEN_DIR", "tokens")
+
+# Days a login stays usable before the browser flow has to run again
+GRANT_TTL_DAYS = int(os.getenv("GRANT_TTL_DAYS", "30"))
+
+# Where single-user installs kept their token; picked up on the next login
+LEGACY_TOKEN_PATH = 'token.pickle'
+
+CLIENT_SECRETS_PATH = 'credentials.json'
+
+def new_gmail_service(creds):
+    """Build a Gmail client from the discovery document bundled with
+    google-api-python-client, so no discovery HTTP fetch is made"""
+    from googleapiclient.discovery import build
+    return build('gmail', 'v1', credentials=creds, static_discovery=True, cache_discovery=False)
+
+@resource
+def get_account_pool():
+    """Credentials and pooled Gmail clients for every account of the process
+    
+    The pool's background thread renews access tokens before they expire,
+    so requests never wait on a token refresh.
+    """
+    store = TokenStore(TOKEN_DIR, grant_ttl=GRANT_TTL_DAYS * 86400)
+    # Nobody can use a token whose grants have all expired
+    for account in store.accounts():
+        if not store.count_grants(account):
+            store.delete(account)
+    pool = AccountPool(store, lambda creds: new_gmail_service(creds))
+    pool.start()
+    return pool
+
+def run_oauth_flow(login_hint=None):
+    """Run the OAuth consent flow in a local browser and return new credentials
+    
+    Raises:
+        FileNotFoundError: if credentials.json is missing
+    """
+    # You need to create credentials.json from Google Cloud Console
+    if not os.path.exists(CLIENT_SECRETS_PATH):
+        raise FileNotFoundError(f"{CLIENT_SECRETS_PATH} not found")
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_PATH, SCOPES)
+    if login_hint:
+        return flow.run_local_server(port=0, login_hint=login_hint)
+    return flow.run_local_server(port=0)
+
+def legacy_account():
+    """Address the single-user install's token.pickle belongs to, or None"""
+    if not os.path.exists(LEGACY_TOKEN_PATH):
+        return None
+    try:
+        with open(LEGACY_TOKEN_PATH, 'rb') as token:
+            creds = pickle.load(token)
+        if not creds.valid:
+            from google.auth.transport.requests import Request
+            with registry.timer("gmail", "auth.refresh"):
+                creds.refresh(Request())
+        profile = execute(new_gmail_service(creds).users().getProfile(
+            userId='me', fields=PROFILE_FIELDS))
+    except Exception:
+        return None
+    return normalize_account(profile['emailAddress'])
+
+def migrate_legacy_files(account):
+    """Move a single-user install's cache and outbox over to the account"""
+    for path in (MAILBOX_CACHE_PATH, OUTBOX_PATH):
+        if os.path.exists(path) and not os.path.exists(account_file(path, account)):
+            os.replace(path, account_file(path, account))
+    os.remove(LEGACY_TOKEN_PATH)
+
+def connect_account(context, account=None, authorize=None, grant=None):
+    """Connect a conversation to a Gmail account
+    
+    The stored token of the account is reused only for a grant issued by
+    an earlier login; otherwise authorize(login_hint) is asked for new
+    credentials. A successful login stores a new grant in context.grant,
+    which the caller keeps to reconnect later without logging in again.
+    
+    Returns:
+        The connected account's email address, or None if authorize
+        returned nothing
+    
+    Raises:
+        PermissionError: if a login is needed and no authorize was given
+    """
+    pool = get_account_pool()
+    account = (account or '').strip().lower()
+    
+    if account and pool.credentials(account) is not None:
+        if pool.store.check_grant(account, grant):
+            try:
+                # Only refreshes a token that is about to expire
+                pool.refresh(account)
+                context.account = context.user_email = account
+                context.grant = grant
+                return account
+            except Exception:
+                # Revoked or expired for good: the user has to log in again
+                pool.remove(account)
+        elif not pool.store.count_grants(account):
+            # Every session of the account logged out or let its grant expire
+            forget_account(account)
+    
+    if authorize is None:
+        raise PermissionError(
+            f"No Gmail login for {account or 'this conversation'}; log in once with `python cli.py --login`")
+    
+    creds = authorize(account or None)
+    if creds is None:
+        return None
+    
+    # Tokens are filed under the address they actually belong to
+    profile = execute(new_gmail_service(creds).users().getProfile(
+        userId='me', fields=PROFILE_FIELDS))
+    
+    account = pool.add(profile['emailAddress'], creds)
+    # The old single-user token is never used to log anyone in; its cache
+    # and outbox only move once its owner has logged in themselves
+    if legacy_account() == account:
+        migrate_legacy_files(account)
+    context.account = account
+    context.user_email = profile['emailAddress']
+    context.grant = pool.store.add_grant(account)
+    return account
+
+def disconnect_account(context):
+    """Log the conversation out of its account
+    
+    Only the conversation's own grant is withdrawn; other conversations
+    on the account keep working. The last one out also stops the
+    account's workers, clears its caches and forgets its token.
+    """
+    if get_account_pool().store.revoke_grant(context.account, context.grant):
+        context.reset()
+        return
+    forget_account(context.account, context)
+    context.reset()
+
+def forget_account(account, context=None):
+    """Stop an account's workers, clear its caches and forget its token
+    
+    The in-memory caches of context, if given, are cleared as well.
+    """
+    # Queued emails stay in the outbox for the next login
+    outbox_worker = start_outbox_worker.peek(account)
+    if outbox_worker:
+        outbox_worker.stop()
+    start_outbox_worker.clear(account)
+    prefetch_worker = start_prefetch_worker.peek(account)
+    if prefetch_worker:
+        # Joined before the caches are cleared, so a warm-up pass cannot refill them
+        prefetch_worker.stop()
+        prefetch_worker.body_cache.clear()
+    start_prefetch_worker.clear(account)
+    mailbox_cache = None
+    if context is not None:
+        if context.body_cache is not None:
+            context.body_cache.clear()
+        mailbox_cache = context.mailbox_cache
+    (mailbox_cache or MailboxCache(account_file(MAILBOX_CACHE_PATH, account))).clear()
+    get_attachment_store(account).clear()
+    get_attachment_store.clear(account)
+    get_account_pool().remove(account)
+
+# httplib2-backed clients must not be shared across threads, so each tool
+# call borrows a client of its own from the account pool
+_worker_state = threading.local()
+
+def current_gmail_service():
+    """Return the Gmail client for the calling thread"""
+    service = getattr(_worker_state, 'gmail_service', None)
+    account = current_context().account
+    if service is None and account:
+        service = get_account_pool().thread_client(account)
+    return service
+
+def report_progress(message):
+    """Send a progress update from a running tool to the chat UI, if one is listening"""
+    callback = getattr(_worker_state, 'progress', None)
+    if callback:
+        callback(message)
+
+def header_progress(done, total):
+    """Progress callback for batched metadata fetches"""
+    report_progress(f"fetching {total} headers… {done}/{total}")
+
+def get_user_email():
+    """Get the authenticated user's email address"""
+    context = current_context()
+    if context.user_email:
+        return context.user_email
+    try:
+        service = current_gmail_service()
+        if service:
+            profile = execute(service.users().getProfile(userId='me', fields=PROFILE_FIELDS))
+            context.user_email = profile.get('emailAddress', 'Unknown')
+            return context.user_email
+    except:
+        return 'Unknown'
+    return 'Unknown'
+
+# ==================== MAILBOX CACHE ====================
+MAILBOX_CACHE_PATH = os.getenv("MAILBOX_CACHE_PATH", "mailbox_cache.db")
+
+# Tools may run concurrently, so session resources are created under a lock
+_session_resource_lock = threading.Lock()
+
+def get_mailbox_cache():
+    """Return the local mailbox cache for this conversation"""
+    context = current_context()
+    with _session_resource_lock:
+        if context.mailbox_cache is None:
+            # Share the cache the background worker keeps warm, if there is one
+            worker = get_prefetch_worker()
+            context.mailbox_cache = worker.cache if worker else MailboxCache(
+                account_file(MAILBOX_CACHE_PATH, context.account),
+                on_delete=lambda message_ids: forget_bodies(context.body_cache, message_ids))
+        return context.mailbox_cache
+
+def forget_bodies(body_cache, message_ids):
+    """Drop bodies of messages deleted from the mailbox"""
+    if body_cache is not None:
+        for msg_id in message_ids:
+            body_cache.pop(msg_id)
+
+BODY_CACHE_SIZE = int(os.getenv("BODY_CACHE_SIZE", "64"))
+BODY_CACHE_TTL = int(os.getenv("BODY_CACHE_TTL", "900"))
+
+# Bodies are decoded and cached up to this many characters
+BODY_MAX_CHARS = int(os.getenv("BODY_MAX_CHARS", "4000"))
+
+def get_body_cache():
+    """Return the in-memory cache of decoded email bodies for this conversation"""
+    context = current_context()
+    with _session_resource_lock:
+        if context.body_cache is None:
+            worker = get_prefetch_worker()
+            context.body_cache = worker.body_cache if worker else LRUCache(BODY_CACHE_SIZE, BODY_CACHE_TTL)
+        return context.body_cache
+
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_SENDS_PER_MINUTE = float(os.getenv("OUTBOX_SENDS_PER_MINUTE", "20"))
+OUTBOX_DAILY_LIMIT = int(os.getenv("OUTBOX_DAILY_LIMIT", "500"))
+
+@resource
+def start_outbox_worker(account):
+    """Start the outbox sender pool once per account
+    
+    Emails still queued from an earlier run are picked up straight away.
+    """
+    worker = OutboxWorker(
+        Outbox(account_file(OUTBOX_PATH, account)),
+        lambda: get_account_pool().new_client(account),
+        workers=OUTBOX_WORKERS,
+        sends_per_minute=OUTBOX_SENDS_PER_MINUTE,
+        daily_limit=OUTBOX_DAILY_LIMIT,
+    )
+    worker.start()
+    return worker
+
+def get_outbox_worker():
+    """Return the running outbox worker for the conversation's account, if connected"""
+    account = current_context().account
+    if account is None:
+        return None
+    return start_outbox_worker(account)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_INTERVAL = int(os.getenv("PREFETCH_INTERVAL", "60"))
+PREFETCH_BODIES = int(os.getenv("PREFETCH_BODIES", "10"))
+
+@resource
+def start_prefetch_worker(account):
+    """Start the background warm-up once per account
+    
+    The worker owns the mailbox and body caches, which every session of
+    the account then shares.
+    """
+    body_cache = LRUCache(BODY_CACHE_SIZE, BODY_CACHE_TTL)
+    worker = PrefetchWorker(
+        MailboxCache(account_file(MAILBOX_CACHE_PATH, account),
+                     on_delete=lambda message_ids: forget_bodies(body_cache, message_ids)),
+        body_cache,
+        lambda: get_account_pool().new_client(account),
+        interval=PREFETCH_INTERVAL,
+        warm_bodies=PREFETCH_BODIES,
+        body_max_chars=BODY_MAX_CHARS,
+    )
+    worker.start()
+    return worker
+
+def get_prefetch_worker():
+    """Return the running warm-up worker for the conversation's account, if connected"""
+    account = current_context().account
+    if account is None or not PREFETCH_ENABLED:
+        return None
+    return start_prefetch_worker(account)
+
+def remember_listing(message_ids):
+    """Record which message each number in the latest listing refers to
+    
+    Concurrent tool calls hold their listings back; run_tool_calls applies
+    them in call order once all calls are done.
+    """
+    held = getattr(_worker_state, 'listings', None)
+    if held is not None:
+        held.append(list(message_ids))
+        return
+    context = current_context()
+    context.email_handles = list(message_ids)
+    # The emails just listed are the ones most likely to be opened next
+    worker = get_prefetch_worker()
+    if worker:
+        worker.hint(context.email_handles[:PREFETCH_BODIES])
+
+def listed_message_ids(email_numbers):
+    """Message ids for comma-separated numbers from the latest listing
+    
+    Raises:
+        ValueError: for numbers that are not in the listing
+    """
+    handles = current_context().email_handles
+    try:
+        numbers = [int(n) for n in email_numbers.replace(' ', '').split(',') if n]
+    except ValueError:
+        raise ValueError(f"Invalid email numbers: '{email_numbers}'")
+    invalid = [n for n in numbers if n < 1 or n > len(handles)]
+    if invalid or not numbers:
+        raise ValueError(f"Invalid email numbers {invalid or email_numbers}. "
+                         f"Please choose between 1 and {len(handles)}.")
+    return list(dict.fromkeys(handles[n - 1] for n in numbers))
+
+# Upper bound on messages a single listing walks through
+MAX_LISTING_RESULTS = int(os.getenv("MAX_LISTING_RESULTS", "10000"))
+
+# Ids per lookup when a listing is served from the local index
+LOCAL_PAGE_SIZE = 500
+
+def iter_listing(service, cache, query=None, label_ids=None, limit=None):
+    """Yield a listing one page of message dicts at a time, newest first
+    
+    Metadata comes from the mailbox cache where possible; the rest of each
+    page is batch-fetched and cached as the page arrives. Failed lookups
+    are yielded as {'id': ..., 'error': ...}.
+    """
+    for message_ids in iter_message_pages(service, query=query, label_ids=label_ids, limit=limit):
+        cached = cache.get_messages(message_ids)
+        missing = [msg_id for msg_id in message_ids if msg_id not in cached]
+        errors = {}
+        if missing:
+            fetched = fetch_message_metadata(service, missing, progress=header_progress)
+            cache.store_messages(fetched)
+            cached.update(cache.get_messages(missing))
+            errors = {m['id']: m['error'] for m in fetched if 'error' in m}
+        yield [
+            cached.get(msg_id) or {'id': msg_id, 'error': errors.get(msg_id, 'Unknown error')}
+            for msg_id in message_ids
+        ]
+
+def inbox_pages(service, cache, limit):
+    """Yield the newest inbox messages a page at a time, from the cache when
+    it is known to hold all of them, else from the API"""
+    cached = cache.list_inbox(limit)
+    if cached is not None:
+        yield cached
+    else:
+        yield from iter_listing(service, cache, label_ids=['INBOX'], limit=limit)
+
+# ==================== GMAIL TOOLS ====================
+@LazyTool
+@instrument_tool
+def check_gmail_inbox(max_results: int = 10) -> EmailList | str:
+    """Check real Gmail inbox and return recent emails
+    
+    Args:
+        max_results: Number of emails to fetch (default 10, max 10000; only the first 50 are listed, the rest are summarized)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected. Please authenticate first."
+        
+        # Limit max results
+        max_results = min(max_results, MAX_LISTING_RESULTS)
+        
+        # Catch up with the server, then read from the local cache
+        cache = get_mailbox_cache()
+        report_progress("syncing inbox…")
+        cache.sync(service, progress=header_progress)
+        
+        listing = ListingAggregate()
+        for page in inbox_pages(service, cache, max_results):
+            listing.add(page)
+            report_progress(f"listing inbox… {listing.progress()}")
+        
+        if not listing.total:
+            return "📭 No emails found in inbox."
+        
+        remember_listing(message['id'] for message in listing.rows)
+        
+        return listing.record('inbox')
+    
+    except Exception as e:
+        return f"❌ Error fetching emails: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def send_gmail(to: str, subject: str, body: str) -> str:
+    """Send a real email via Gmail
+    
+    Args:
+        to: Recipient email address
+        subject: Email subject
+        body: Email body content
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected. Please authenticate first."
+        
+        # Validate email
+        if '@' not in to:
+            return "❌ Invalid email address format."
+        
+        # Create and encode message
+        raw_message = encode_message(to, subject, body)
+        
+        # Send message
+        report_progress(f"sending email to {to}…")
+        # Sending is not idempotent, so only quota rejections are retried
+        send_message = execute(service.users().messages().send(
+            userId='me',
+            body={'raw': raw_message},
+            fields='id'
+        ), idempotent=False)
+        
+        return f"""✅ **Email sent successfully!**
+
+**To:** {to}
+**Subject:** {subject}
+**Body Preview:** {body[:100]}{'...' if len(body) > 100 else ''}
+**Message ID:** {send_message['id']}
+**Sent at:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
+    
+    except Exception as e:
+        return f"❌ Error sending email: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def search_gmail(query: str, max_results: int = 10) -> EmailList | str:
+    """Search Gmail with a query
+    
+    Args:
+        query: Search query (e.g., 'from:john@example.com', 'subject:meeting', 'is:unread')
+        max_results: Number of results to return (default 10, max 10000; only the first 50 are listed, the rest are summarized)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected. Please authenticate first."
+        
+        max_results = min(max_results, MAX_LISTING_RESULTS)
+        
+        cache = get_mailbox_cache()
+        cache.sync(service, progress=header_progress)
+        
+        listing = ListingAggregate()
+        local_ids = cache.search(query, max_results)
+        if local_ids is not None:
+            # The local index holds every match, so no API calls are needed
+            for start in range(0, len(local_ids), LOCAL_PAGE_SIZE):
+                page_ids = local_ids[start:start + LOCAL_PAGE_SIZE]
+                cached = cache.get_messages(page_ids)
+                listing.add(cached[msg_id] for msg_id in page_ids if msg_id in cached)
+        else:
+            # Only fetch metadata for matches that are not cached yet
+            found = []
+            for page in iter_listing(service, cache, query=query, limit=max_results):
+                listing.add(page)
+                found.extend(message['id'] for message in page)
+                report_progress(f"searching… {listing.progress()}")
+            # A complete, error-free result can answer this query locally next time
+            if len(found) < max_results and not listing.errors:
+                cache.record_search(query, found)
+        
+        if not listing.total:
+            return f"📭 No emails found matching: '{query}'"
+        
+        remember_listing(message['id'] for message in listing.rows)
+        
+        return listing.record('search', query)
+    
+    except Exception as e:
+        return f"❌ Error searching emails: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def get_unread_count() -> str:
+    """Get count of unread emails"""
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        # The cached count stays valid until history reports a change
+        cache = get_mailbox_cache()
+        cache.sync(service, progress=header_progress)
+        count = cache.get_unread_count()
+        if count is None:
+            label = execute(service.users().labels().get(userId='me', id='UNREAD', fields='messagesTotal'))
+            count = label.get('messagesTotal', 0)
+            cache.set_unread_count(count)
+        
+        return f"📬 You have **{count}** unread emails."
+    
+    except Exception as e:
+        return f"❌ Error: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def read_email_content(email_number: int) -> EmailContent | str:
+    """Read the full content of a specific email from the last inbox or search listing
+    
+    Args:
+        email_number: The number of the email in the most recent inbox or search list (1-based)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        cache = get_mailbox_cache()
+        
+        # Numbers refer to the listing the user last saw; default to the inbox
+        handles = current_context().email_handles
+        if not handles:
+            cache.sync(service, progress=header_progress)
+            handles = [message['id'] for page in inbox_pages(service, cache, 50) for message in page]
+            remember_listing(handles)
+        
+        if email_number < 1 or email_number > len(handles):
+            return f"❌ Invalid email number. Please choose between 1 and {len(handles)}."
+        
+        msg_id = handles[email_number - 1]
+        message = cache.get_messages([msg_id]).get(msg_id)
+        
+        # Bodies never change, so only download them once; without the
+        # header row (not cached yet, or dropped by a sync) fetch it all again
+        body_cache = get_body_cache()
+        body = None
+        if message is not None:
+            body = body_cache.get(msg_id)
+            if body is None:
+                body = cache.get_body(msg_id)
+        if body is None:
+            report_progress(f"downloading email #{email_number}…")
+            full_message = execute(service.users().messages().get(
+                userId='me',
+                id=msg_id,
+                format='full',
+                fields=FULL_FIELDS
+            ))
+            body = extract_body(full_message['payload'], BODY_MAX_CHARS)
+            cache.store_messages([full_message])
+            cache.set_body(msg_id, body)
+            message = cache.get_messages([msg_id])[msg_id]
+        body_cache.set(msg_id, body)
+        
+        return EmailContent(email_number, msg_id, message['from'], message['subject'], message['date'],
+                            body[:BODY_PREVIEW_CHARS], len(body) > BODY_PREVIEW_CHARS)
+    
+    except Exception as e:
+        return f"❌ Error reading email: {str(e)}"
+
+BULK_MODIFY_LIMIT = int(os.getenv("BULK_MODIFY_LIMIT", "10000"))
+
+@LazyTool
+@instrument_tool
+def bulk_modify_emails(action: str, query: str = "", email_numbers: str = "", label: str = "",
+                       dry_run: bool = True) -> str:
+    """Archive, mark read/unread, star or label many emails at once
+    
+    Always call with dry_run=True first and tell the user how many emails
+    would change; only call with dry_run=False once they confirm.
+    
+    Args:
+        action: One of archive, move_to_inbox, mark_read, mark_unread, star, unstar, mark_important, mark_not_important, add_label, remove_label
+        query: Gmail search query selecting the emails (e.g., 'from:news@example.com older_than:30d')
+        email_numbers: Comma-separated numbers from the most recent inbox or search list, instead of a query
+        label: Label name for add_label / remove_label
+        dry_run: Only count the matching emails, change nothing (default True)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        if bool(query) == bool(email_numbers):
+            return "❌ Give either a search query or email numbers."
+        
+        try:
+            add_label_ids, remove_label_ids = label_changes(service, action, label)
+        except ValueError as e:
+            return f"❌ {str(e)}"
+        
+        if email_numbers:
+            try:
+                message_ids = listed_message_ids(email_numbers)
+            except ValueError as e:
+                return f"❌ {str(e)}"
+            selection = f"emails {email_numbers}"
+        else:
+            # Only ids are listed, no metadata is fetched; emails that already
+            # have the change are skipped, so a capped run can be repeated
+            pending_query, label_ids = pending_selection(query, add_label_ids, remove_label_ids, label)
+            message_ids = []
+            for page in iter_message_pages(service, query=pending_query, label_ids=label_ids or None,
+                                           limit=BULK_MODIFY_LIMIT):
+                message_ids.extend(page)
+                report_progress(f"finding matches… {len(message_ids)}")
+            selection = f"'{query}'"
+        
+        if not message_ids:
+            return f"📭 No emails matching {selection} still need this change."
+        
+        capped = " (limit reached, run again for the rest)" if len(message_ids) >= BULK_MODIFY_LIMIT else ""
+        if dry_run:
+            return (f"🧪 **Dry run:** {action.replace('_', ' ')} would change "
+                    f"**{len(message_ids)}** emails matching {selection}{capped}. "
+                    f"Nothing was changed.")
+        
+        modified, failures = batch_modify(
+            service, message_ids, add_label_ids, remove_label_ids,
+            progress=lambda done, total: report_progress(f"updating {done}/{total} emails…"))
+        
+        result = f"✅ **{action.replace('_', ' ').capitalize()}:** {modified} emails matching {selection}{capped}"
+        if failures:
+            failed = sum(count for count, _ in failures)
+            result += f"\n\n⚠️ {failed} emails could not be changed: {failures[0][1]}"
+        return result
+    
+    except Exception as e:
+        return f"❌ Error modifying emails: {str(e)}"
+
+MAIL_MERGE_LIMIT = int(os.getenv("MAIL_MERGE_LIMIT", "1000"))
+
+# Recipient .csv files are only read from this directory; unset, only inline CSV is accepted
+MAIL_MERGE_UPLOAD_DIR = os.getenv("MAIL_MERGE_UPLOAD_DIR", "")
+
+@LazyTool
+@instrument_tool
+def queue_mail_merge(recipients: str, subject_template: str, body_template: str,
+                     dry_run: bool = True) -> str:
+    """Send one templated email to many recipients through the background outbox
+    
+    Always call with dry_run=True first, show the preview and only call
+    with dry_run=False once the user confirms.
+    
+    Args:
+        recipients: CSV text with a header row containing 'email' (other columns fill {placeholders}), the name of such an uploaded .csv file, or a comma-separated list of addresses
+        subject_template: Subject with optional {column} placeholders, e.g. 'Update for {name}'
+        body_template: Body with optional {column} placeholders
+        dry_run: Only render a preview, queue nothing (default True)
+    """
+    try:
+        worker = get_outbox_worker()
+        if worker is None:
+            return "❌ Gmail not connected. Please authenticate first."
+        
+        try:
+            emails = render_merge(parse_recipients(recipients, MAIL_MERGE_UPLOAD_DIR),
+                                  subject_template, body_template)
+        except ValueError as e:
+            return f"❌ Could not build the emails: {str(e)}"
+        
+        if not emails:
+            return "❌ No recipients found."
+        if len(emails) > MAIL_MERGE_LIMIT:
+            return f"❌ {len(emails)} recipients is over the limit of {MAIL_MERGE_LIMIT}."
+        
+        minutes = len(emails) / OUTBOX_SENDS_PER_MINUTE
+        if dry_run:
+            to, subject, body = emails[0]
+            return f"""🧪 **Dry run:** {len(emails)} emails would be queued (about {minutes:.0f} min to send).
+
+**First email**
+**To:** {to}
+**Subject:** {subject}
+**Body Preview:** {body[:200]}{'...' if len(body) > 200 else ''}"""
+        
+        batch_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        queued, duplicates = worker.outbox.enqueue(emails, batch_id=batch_id)
+        worker.notify()
+        
+        result = f"📤 **Queued {queued} emails** in the outbox (about {minutes:.0f} min to send)."
+        if duplicates:
+            result += f"\n\n{duplicates} were already queued or sent and were skipped."
+        return result
+    
+    except Exception as e:
+        return f"❌ Error queueing emails: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def get_outbox_status() -> str:
+    """Get progress of queued bulk emails (queued, sent, failed)"""
+    try:
+        worker = get_outbox_worker()
+        if worker is None:
+            return "❌ Gmail not connected."
+        stats = worker.outbox.stats()
+        result = (f"📤 **Outbox:** {stats['queued'] + stats['sending']} queued · "
+                  f"{stats['sent']} sent · {stats['failed']} failed · "
+                  f"{stats['sent_last_10_min'] / 10:.1f} sent/min")
+        if stats['last_error']:
+            result += f"\n\nLast failure: {stats['last_error']}"
+        return result
+    
+    except Exception as e:
+        return f"❌ Error: {str(e)}"
+
+SUMMARY_MAX_EMAILS = int(os.getenv("SUMMARY_MAX_EMAILS", "100"))
+SUMMARY_LLM_CONCURRENCY = int(os.getenv("SUMMARY_LLM_CONCURRENCY", "4"))
+
+# Bounds summarization LLM calls across all sessions in the process
+_summary_llm_slots = threading.BoundedSemaphore(SUMMARY_LLM_CONCURRENCY)
+
+def load_bodies(service, cache, message_ids):
+    """Return {message_id: body}, downloading uncached bodies in batches"""
+    body_cache = get_body_cache()
+    bodies = {}
+    missing = []
+    for msg_id in message_ids:
+        body = body_cache.get(msg_id)
+        if body is None:
+            body = cache.get_body(msg_id)
+        if body is None:
+            missing.append(msg_id)
+        else:
+            bodies[msg_id] = body
+    
+    if missing:
+        fetched = fetch_full_messages(
+            service, missing,
+            progress=lambda done, total: report_progress(f"downloading {total} emails… {done}/{total}"))
+        fetched = [message for message in fetched if 'error' not in message]
+        cache.store_messages(fetched)
+        for message in fetched:
+            body = extract_body(message['payload'], BODY_MAX_CHARS)
+            cache.set_body(message['id'], body)
+            bodies[message['id']] = body
+    
+    for msg_id, body in bodies.items():
+        body_cache.set(msg_id, body)
+    return bodies
+
+@LazyTool
+@instrument_tool
+def summarize_emails(query: str = "in:inbox newer_than:1d", max_emails: int = 20) -> str:
+    """Summarize and triage many emails at once: one line per email, and which ones need a reply
+    
+    Args:
+        query: Gmail search query selecting the emails (default: today's inbox, 'in:inbox newer_than:1d')
+        max_emails: Maximum number of emails to summarize (default 20, max 100)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        max_emails = min(max_emails, SUMMARY_MAX_EMAILS)
+        
+        cache = get_mailbox_cache()
+        cache.sync(service, progress=header_progress)
+        
+        message_ids = cache.search(query, max_emails)
+        if message_ids is None:
+            message_ids = [msg_id for page in iter_message_pages(service, query=query, limit=max_emails)
+                           for msg_id in page]
+        if not message_ids:
+            return f"📭 No emails found matching: '{query}'"
+        
+        bodies = load_bodies(service, cache, message_ids)
+        cached = cache.get_messages(message_ids)
+        missing = [msg_id for msg_id in message_ids if msg_id not in cached]
+        if missing:
+            cache.store_messages(fetch_message_metadata(service, missing, progress=header_progress))
+            cached.update(cache.get_messages(missing))
+        
+        emails = []
+        for msg_id in message_ids:
+            message = cached.get(msg_id)
+            if message is None:
+                continue
+            body = bodies.get(msg_id, message['snippet'] or '')
+            emails.append({**message, 'body': body, 'hash': content_hash(message['subject'], body)})
+        
+        results, reused = summarize_batch(
+            get_summary_llm(), emails, _summary_llm_slots, cache=cache,
+            model_name=f"{GEMINI_MODEL}:summarize",
+            progress=lambda done, total: report_progress(f"summarizing… {done}/{total} batches"))
+        
+        digest, ordered_ids = render_digest(emails, results, f"📝 **Email Digest** for '{query}'")
+        remember_listing(ordered_ids)
+        if reused:
+            digest += f"\n\n_{reused} summaries reused from earlier runs._"
+        return digest
+    
+    except Exception as e:
+        return f"❌ Error summarizing emails: {str(e)}"
+
+# Attachments are kept per account, one file per distinct content
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "attachments")
+ATTACHMENT_CONCURRENCY = int(os.getenv("ATTACHMENT_CONCURRENCY", "4"))
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# Extracted text shown to the model per attachment
+ATTACHMENT_TEXT_CHARS = int(os.getenv("ATTACHMENT_TEXT_CHARS", "3000"))
+
+# Bounds attachment downloads across all sessions in the process
+_attachment_slots = threading.BoundedSemaphore(ATTACHMENT_CONCURRENCY)
+
+@resource
+def get_attachment_store(account):
+    """Content-addressed attachment store of an account (opened once per process)"""
+    return AttachmentStore(account_file(ATTACHMENT_DIR, account))
+
+def load_attachment_parts(service, store, message_ids):
+    """Return {message_id: attachment list}, asking Gmail only for messages not seen before"""
+    parts = {}
+    for msg_id in message_ids:
+        listed = store.get_parts(msg_id)
+        if listed is None:
+            listed = fetch_attachment_parts(service, msg_id)
+            store.set_parts(msg_id, listed)
+        parts[msg_id] = listed
+    return parts
+
+def describe_email(cache, msg_id, number):
+    message = cache.get_messages([msg_id]).get(msg_id)
+    if message is None:
+        return f"**Email #{number}**"
+    return f"**Email #{number}** · {message['from']} · {message['subject']}"
+
+@LazyTool
+@instrument_tool
+def list_email_attachments(email_numbers: str) -> str:
+    """List the attachments of emails from the last inbox or search listing, with their sizes
+    
+    Args:
+        email_numbers: Comma-separated numbers from the most recent inbox or search list (e.g. '3' or '1,4')
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        try:
+            message_ids = listed_message_ids(email_numbers)
+        except ValueError as e:
+            return f"❌ {str(e)}"
+        
+        store = get_attachment_store(current_context().account)
+        cache = get_mailbox_cache()
+        parts = load_attachment_parts(service, store, message_ids)
+        
+        handles = current_context().email_handles
+        lines = ["📎 **Attachments**\n"]
+        for msg_id in message_ids:
+            lines.append(describe_email(cache, msg_id, handles.index(msg_id) + 1))
+            if not parts[msg_id]:
+                lines.append("   (no attachments)")
+            for attachment in parts[msg_id]:
+                lines.append(f"   - {attachment['filename']} ({attachment['mime_type']}, "
+                             f"{format_size(attachment['size'])})")
+        return "\n".join(lines)
+    
+    except Exception as e:
+        return f"❌ Error listing attachments: {str(e)}"
+
+@LazyTool
+@instrument_tool
+def read_email_attachments(email_numbers: str, names: str = "", extract_text: bool = True) -> str:
+    """Download attachments of emails from the last listing and show the text inside them (PDF, Word, text, HTML, CSV)
+    
+    Args:
+        email_numbers: Comma-separated numbers from the most recent inbox or search list (e.g. '3' or '1,4')
+        names: Comma-separated file names or parts of names to pick (e.g. 'pdf' or 'invoice.pdf'); empty for all
+        extract_text: Include the text of each attachment (default True)
+    """
+    try:
+        service = current_gmail_service()
+        if not service:
+            return "❌ Gmail not connected."
+        
+        try:
+            message_ids = listed_message_ids(email_numbers)
+        except ValueError as e:
+            return f"❌ {str(e)}"
+        
+        context = current_context()
+        store = get_attachment_store(context.account)
+        parts = load_attachment_parts(service, store, message_ids)
+        
+        wanted = [name.strip().lower() for name in names.split(',') if name.strip()]
+        selected = [
+            (msg_id, attachment) for msg_id in message_ids for attachment in parts[msg_id]
+            if not wanted or any(name in attachment['filename'].lower() for name in wanted)
+        ]
+        if not selected:
+            return f"📭 No attachments{' matching ' + repr(names) if wanted else ''} in emails {email_numbers}."
+        
+        too_large = [(msg_id, a) for msg_id, a in selected if a['size'] > ATTACHMENT_MAX_BYTES]
+        selected = [(msg_id, a) for msg_id, a in selected if a['size'] <= ATTACHMENT_MAX_BYTES]
+        
+        # Every download thread borrows its own client
+        pool = get_account_pool()
+        results = fetch_attachments(
+            lambda: pool.client(context.account), store, selected, _attachment_slots,
+            progress=lambda done, total: report_progress(f"downloading attachments… {done}/{total}"))
+        
+        cache = get_mailbox_cache()
+        statuses = [status for sha256, status in results if sha256]
+        lines = [f"📎 **{len(statuses)} attachments** ({statuses.count('downloaded')} downloaded, "
+                 f"{len(statuses) - statuses.count('downloaded')} already stored)\n"]
+        for (msg_id, attachment), (sha256, status) in zip(selected, results):
+            number = context.email_handles.index(msg_id) + 1
+            header = (f"📄 **{attachment['filename']}** ({format_size(attachment['size'])}) "
+                      f"from {describe_email(cache, msg_id, number)}")
+            if sha256 is None:
+                lines.append(f"{header}\n❌ Download failed: {status}\n")
+                continue
+            lines.append(f"{header}\nSaved as `{store.path(sha256)}`")
+            if extract_text:
+                text = store.text(sha256, attachment['mime_type'], attachment['filename'])
+                if text is None:
+                    lines.append("(no text could be extracted from this file type)")
+                elif not text:
+                    lines.append("(no text inside)")
+                else:
+                    more = '...' if len(text) > ATTACHMENT_TEXT_CHARS else ''
+                    lines.append(f"```\n{text[:ATTACHMENT_TEXT_CHARS]}{more}\n```")
+            lines.append("")
+        for msg_id, attachment in too_large:
+            lines.append(f"⚠️ Skipped {attachment['filename']} ({format_size(attachment['size'])}): "
+                         f"over the {format_size(ATTACHMENT_MAX_BYTES)} limit")
+        return "\n".join(lines).rstrip()
+    
+    except Exception as e:
+        return f"❌ Error reading attachments: {str(e)}"
+
+# ==================== AGENT ====================
+GEMINI_MODEL = "gemini-2.5-flash"
+
+@resource
+def create_gmail_agent():
+    """Create agent with Gmail tools (built once per process)"""
+    
+    tools = [lazy.tool for lazy in (
+        check_gmail_inbox, send_gmail, search_gmail, get_unread_count, read_email_content,
+        bulk_modify_emails, queue_mail_merge, get_outbox_status, summarize_emails,
+        list_email_attachments, read_email_attachments)]
+    
+    system_message = """You are a helpful Gmail assistant with access to real Gmail functionality.
+
+Available tools:
+- check_gmail_inbox: View recent emails in inbox
+- send_gmail: Send emails to recipients
+- search_gmail: Search emails with queries (e.g., 'from:someone@example.com', 'is:unread')
+- get_unread_count: Check number of unread emails
+- read_email_content: Read full content of a specific email by number
+- bulk_modify_emails: Archive, mark read/unread, star or label many emails at once (dry run first, then ask the user to confirm)
+- queue_mail_merge: Send a templated email to many recipients in the background (dry run first, then ask the user to confirm)
+- get_outbox_status: Check progress of queued bulk emails
+- summarize_emails: Summarize many emails at once and flag which need a reply (e.g. "what came in today")
+- list_email_attachments: List the attachments of emails by number, with their sizes
+- read_email_attachments: Download attachments of emails by number and read the text inside (e.g. "what's in the PDF Bob sent": search 'from:Bob has:attachment', then read the pdf)
+
+For questions about many emails (e.g. "all invoices from last quarter"), pass a large max_results; the first 50 are listed and the rest come back as a summary.
+
+Always use tools when users ask about their emails. Be helpful and provide clear responses."""
+    
+    # Deferred: the Gemini client takes longer to import than the rest of the app
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    llm = ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        temperature=0.3
+    )
+    
+    llm_with_tools = llm.bind_tools(tools)
+    
+    return llm_with_tools, tools, system_message
+
+@resource
+def get_summary_llm():
+    """Plain Gemini client for summarization calls (built once per process)"""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=GEMINI_MODEL,
+        google_api_key=os.getenv("GOOGLE_API_KEY"),
+        temperature=0
+    )
+
+MAX_AGENT_STEPS = int(os.getenv("MAX_AGENT_STEPS", "5"))
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "4"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "1") == "1"
+# Empty keeps cached plans in memory only
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", "")
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "256"))
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "86400"))
+# Token-set similarity for near-duplicate prompts, e.g. 0.9; empty for exact matches only
+PLAN_CACHE_SIMILARITY = float(os.getenv("PLAN_CACHE_SIMILARITY") or 0) or None
+
+@resource
+def get_plan_cache():
+    """Cache of model tool plans and answers, shared by every conversation"""
+    return PlanCache(PLAN_CACHE_PATH or None, PLAN_CACHE_SIZE, PLAN_CACHE_TTL, PLAN_CACHE_SIMILARITY)
+
+def current_history_id():
+    """Mailbox history id after catching up with Gmail, or None if not connected"""
+    service = current_gmail_service()
+    if not service:
+        return None
+    cache = get_mailbox_cache()
+    cache.sync(service, progress=header_progress)
+    return cache.history_id()
+
+def run_tool_calls(tool_calls, tool_map, progress=None):
+    """Run one turn's tool calls concurrently
+    
+    Args:
+        tool_calls: Tool calls from one model response
+        tool_map: Tool name to tool
+        progress: Optional callback(message) for tool progress updates
+    
+    Returns:
+        A list of (result, elapsed_ms) in the same order as tool_calls
+    """
+    context = current_context()
+    account = context.account
+    accounts = get_account_pool() if account else None
+    
+    def run_one(tool_call):
+        start = time.perf_counter()
+        tool = tool_map.get(tool_call['name'])
+        if tool is None:
+            result = f"❌ Unknown tool: {tool_call['name']}"
+        else:
+            _worker_state.progress = progress
+            try:
+                result = tool.invoke(tool_call['args'])
+            except Exception as e:
+                result = f"❌ Error running {tool_call['name']}: {str(e)}"
+            finally:
+                _worker_state.progress = None
+        return result, (time.perf_counter() - start) * 1000
+    
+    def run_with_client(tool_call):
+        if accounts is None:
+            return run_one(tool_call)
+        # Each call borrows its own client, so concurrent calls never share one
+        with accounts.client(account) as service:
+            _worker_state.gmail_service = service
+            try:
+                return run_one(tool_call)
+            finally:
+                _worker_state.gmail_service = None
+    
+    def run_in_worker(tool_call):
+        with use_context(context):
+            _worker_state.listings = []
+            try:
+                return run_with_client(tool_call), _worker_state.listings
+            finally:
+                _worker_state.listings = None
+    
+    if len(tool_calls) == 1:
+        return [run_with_client(tool_calls[0])]
+    
+    with ThreadPoolExecutor(max_workers=min(len(tool_calls), TOOL_WORKERS)) as pool:
+        outcomes = list(pool.map(run_in_worker, tool_calls))
+    # The last listing in call order wins, whichever call finished last
+    for _, listings in outcomes:
+        for message_ids in listings:
+            remember_listing(message_ids)
+    return [result for result, _ in outcomes]
+
+def stream_tool_calls(tool_calls, tool_map):
+    """Run tool calls in the background, yielding progress events until they finish
+    
+    Yields ("progress", message) events; the generator's return value is
+    the list from run_tool_calls.
+    """
+    events = queue.Queue()
+    context = current_context()
+    
+    def work():
+        try:
+            with use_context(context):
+                results = run_tool_calls(
+                    tool_calls, tool_map, progress=lambda message: events.put(("progress", message)))
+            events.put(("done", results))
+        except Exception as e:
+            events.put(("error", e))
+    
+    threading.Thread(target=work, daemon=True).start()
+    
+    while True:
+        kind, payload = events.get()
+        if kind == "progress":
+            yield kind, payload
+        elif kind == "done":
+            return payload
+        else:
+            raise payload
+
+def replay_plan(entry, tool_map):
+    """Answer from a cached plan, re-running its tool calls on current data
+    
+    The cached answer text is only reused while the mailbox is unchanged;
+    otherwise the fresh output of the last step is shown. Returns False,
+    without yielding anything, when the plan cannot be replayed safely.
+    """
+    plans = get_plan_cache()
+    context = current_context()
+    account = context.account
+    steps = entry['steps']
+    
+    # Later steps may depend on what earlier ones returned, so multi-step
+    # plans only replay while the mailbox is unchanged
+    if len(steps) > 1 and (entry['account'] != account or current_history_id() != entry['history_id']):
+        return False
+    
+    timings = []
+    results = []
+    last_step = []
+    for step, calls in enumerate(steps, 1):
+        start = time.perf_counter()
+        step_results = yield from stream_tool_calls(
+            [{"name": call['name'], "args": call['args'], "id": f"cached-{step}-{i}"}
+             for i, call in enumerate(calls)],
+            tool_map)
+        timings.append({
+            "step": step,
+            "cached": True,
+            "tools": [(call['name'], elapsed_ms) for call, (_, elapsed_ms) in zip(calls, step_results)],
+            "tools_ms": (time.perf_counter() - start) * 1000,
+        })
+        last_step = [result for result, _ in step_results]
+        results.extend(to_llm(result) for result in last_step)
+    
+    context.agent_timings = timings
+    context.token_stats = None
+    # One model call per tool step plus the final answer
+    context.llm_calls_saved += len(steps) + 1
+    
+    history_id = current_history_id() if steps else None
+    if plans.answer_valid(entry, account, history_id, results):
+        yield "text", entry['answer']
+    else:
+        yield from result_events(last_step)
+    return True
+
+def result_events(results):
+    """Show tool results to the user: records as ("record", record), text as ("text", text)"""
+    for i, result in enumerate(results):
+        if i:
+            yield "text", "\n\n"
+        yield ("text" if isinstance(result, str) else "record"), result
+
+def run_agent_stream(user_input: str, chat_history: list, context):
+    """Run the agent loop, streaming events as they happen
+    
+    Args:
+        user_input: The user's message
+        chat_history: Earlier (role, content) turns of the conversation;
+            content may be text, a record or a list of both
+        context: AgentContext of the conversation
+    
+    Yields:
+        ("text", chunk) for model output as it arrives,
+        ("record", record) for tool results shown to the user as they are, and
+        ("progress", message) while tools run
+    """
+    with use_context(context):
+        yield from _agent_turn(user_input, chat_history, context)
+
+def _agent_turn(user_input, chat_history, context):
+    from langchain_core.messages import ToolMessage
+    try:
+        llm_with_tools, tools, system_message = create_gmail_agent()
+        
+        tool_map = {tool.name: tool for tool in tools}
+        
+        # Known commands go straight to their tool without asking Gemini
+        routed = route(user_input, MAX_LISTING_RESULTS)
+        if routed:
+            tool_name, tool_args = routed
+            start = time.perf_counter()
+            results = yield from stream_tool_calls(
+                [{"name": tool_name, "args": tool_args, "id": "router"}], tool_map)
+            result, elapsed_ms = results[0]
+            context.agent_timings = [{
+                "step": 1,
+                "routed": True,
+                "tools": [(tool_name, elapsed_ms)],
+                "tools_ms": (time.perf_counter() - start) * 1000,
+            }]
+            context.token_stats = None
+            context.llm_calls_saved += 1
+            yield from result_events([result])
+            return
+        
+        messages = [{"role": "system", "content": system_message}]
+        
+        # Keep the prompt inside the token budget as the session grows
+        history, history_stats = compact_history(
+            [(role, to_llm(content)) for role, content in chat_history],
+            HISTORY_TOKEN_BUDGET, HISTORY_KEEP_TURNS)
+        token_stats = {
+            "history_tokens": history_stats["original_tokens"],
+            "prompt_history_tokens": history_stats["compacted_tokens"],
+            "input_tokens": 0,
+            "output_tokens": 0,
+        }
+        context.token_stats = token_stats
+        
+        # Repeat questions replay the model's earlier tool plan
+        plans = get_plan_cache() if PLAN_CACHE_ENABLED else None
+        if plans:
+            plan_key = plans.key(user_input, history,
+                                 salt=f"{context.account}\0{GEMINI_MODEL}\0{system_message}")
+            cached = plans.get(plan_key, user_input, history, context.account)
+            if cached and (yield from replay_plan(cached, tool_map)):
+                return
+        
+        for role, content in history:
+            if role == "human":
+                messages.append({"role": "user", "content": content})
+            else:
+                messages.append({"role": "assistant", "content": content})
+        
+        messages.append({"role": "user", "content": user_input})
+        
+        timings = []
+        context.agent_timings = timings
+        tool_results = []
+        confirmations = []
+        # What the turn did, for the plan cache
+        steps = []
+        all_results = []
+        answer = []
+        completed = False
+        
+        for step in range(1, MAX_AGENT_STEPS + 1):
+            start = time.perf_counter()
+            step_timing = {"step": step, "tools": []}
+            timings.append(step_timing)
+            
+            response = None
+            for chunk in llm_with_tools.stream(messages):
+                if response is None:
+                    step_timing["first_token_ms"] = (time.perf_counter() - start) * 1000
+                    response = chunk
+                else:
+                    response = response + chunk
+                if chunk.text:
+                    answer.append(chunk.text)
+                    yield "text", chunk.text
+            step_timing["llm_ms"] = (time.perf_counter() - start) * 1000
+            
+            usage = getattr(response, "usage_metadata", None) or {}
+            token_stats["input_tokens"] += usage.get("input_tokens", 0)
+            token_stats["output_tokens"] += usage.get("output_tokens", 0)
+            registry.observe("llm", GEMINI_MODEL, step_timing["llm_ms"])
+            registry.add_tokens(
+                GEMINI_MODEL, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+            
+            if response is None or not response.tool_calls:
+                completed = True
+                break
+            
+            messages.append(response)
+            steps.append([{"name": tool_call['name'], "args": tool_call['args']}
+                          for tool_call in response.tool_calls])
+            
+            start = time.perf_counter()
+            results = yield from stream_tool_calls(response.tool_calls, tool_map)
+            step_timing["tools_ms"] = (time.perf_counter() - start) * 1000
+            
+            tool_results = []
+            for tool_call, (result, elapsed_ms) in zip(response.tool_calls, results):
+                step_timing["tools"].append((tool_call['name'], elapsed_ms))
+                # The model gets the terse form of structured results
+                text = to_llm(result)
+                messages.append(ToolMessage(content=text, tool_call_id=tool_call['id']))
+                all_results.append(text)
+                if SEND_CONFIRMATION_MARKER in text:
+                    confirmations.append(text)
+                else:
+                    tool_results.append(result)
+        else:
+            # Step limit reached: show what the tools returned rather than nothing
+            yield from result_events(tool_results)
+            yield "text", f"\n\n⚠️ Stopped after {MAX_AGENT_STEPS} steps."
+        
+        # Send confirmations go into the chat verbatim so they survive compaction
+        for confirmation in confirmations:
+            yield "text", "\n\n" + confirmation
+        
+        if (plans and completed and cacheable(steps) and "".join(answer).strip()
+                and not any(result.startswith("❌") for result in all_results)):
+            plans.put(plan_key, user_input, history, steps, "".join(answer),
+                      account=context.account,
+                      history_id=current_history_id() if steps else None,
+                      results=all_results)
+    
+    except Exception as e:
+        yield "text", f"❌ Error: {str(e)}\n\nPlease try again or rephrase your request."
+
+def run_agent_parts(user_input: str, chat_history: list, context):
+    """Run the agent loop and return the reply as a list of text and records"""
+    parts = []
+    for kind, payload in run_agent_stream(user_input, chat_history, context):
+        if kind != "progress":
+            append_part(parts, payload)
+    return parts
+
+def run_agent(user_input: str, chat_history: list, context):
+    """Run the agent loop and return the complete answer as markdown"""
+    return to_markdown(run_agent_parts(user_input, chat_history, context))
+
@@ -3,34 +3,20 @@
 Production Gmail Agent with Real API Integration
 Author: NOFIL AHMED KHAN
 Date: 01-01-26
+
+Streamlit UI over agent_core, which holds the tools and the agent loop.
 """
 
 import os
+import time
 import streamlit as st
-from dotenv import load_dotenv
-import base64
-from email.mime.text import MIMEText
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import pickle
-import os.path
-from datetime import datetime
-
-# ==================== ENV ====================
-load_dotenv()
-
-# ==================== LANGCHAIN IMPORTS ====================
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.tools import tool
-
-# ==================== GMAIL SCOPES ====================
-SCOPES = [
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/gmail.send',
-    'https://www.googleapis.com/auth/gmail.modify'
-]
+from agent_core import (AgentContext, OUTBOX_DAILY_LIMIT, PLAN_CACHE_ENABLED, connect_account,
+                        current_context, disconnect_account, get_account_pool, get_outbox_worker,
+                        get_plan_cache, get_prefetch_worker, get_user_email, run_agent_parts,
+                        run_agent_stream, run_oauth_flow, use_context)
+from gmail_quota import account_quota
+from metrics import registry
+from records import EmailList, append_part
 
 # ==================== PAGE CONFIG ====================
 st.set_page_config(
@@ -59,368 +45,103 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ==================== GMAIL AUTHENTICATION ====================
-def get_gmail_service():
-    """Authenticate and return Gmail API service"""
-    creds = None
-    
-    # Token file stores user's access and refresh tokens
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    
-    # If no valid credentials, let user log in
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e:
-                st.error(f"Token refresh failed: {str(e)}")
-                if os.path.exists('token.pickle'):
-                    os.remove('token.pickle')
-                return None
-        else:
-            # You need to create credentials.json from Google Cloud Console
-            if not os.path.exists('credentials.json'):
-                st.error("❌ credentials.json not found!")
-                st.info("""
-                Please follow these steps:
-                1. Go to Google Cloud Console
-                2. Create OAuth 2.0 credentials
-                3. Download as credentials.json
-                4. Place in project folder
-                """)
-                return None
-            
-            try:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    'credentials.json', SCOPES)
-                creds = flow.run_local_server(port=0)
-            except Exception as e:
-                st.error(f"Authentication failed: {str(e)}")
-                return None
-        
-        # Save credentials for next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    
-    try:
-        return build('gmail', 'v1', credentials=creds)
-    except Exception as e:
-        st.error(f"Failed to build service: {str(e)}")
-        return None
-
-def get_user_email():
-    """Get the authenticated user's email address"""
-    try:
-        service = st.session_state.get('gmail_service')
-        if service:
-            profile = service.users().getProfile(userId='me').execute()
-            return profile.get('emailAddress', 'Unknown')
-    except:
-        return 'Unknown'
-    return 'Unknown'
-
-# ==================== GMAIL TOOLS ====================
-@tool
-def check_gmail_inbox(max_results: int = 10) -> str:
-    """Check real Gmail inbox and return recent emails
-    
-    Args:
-        max_results: Number of emails to fetch (default 10, max 50)
-    """
-    try:
-        service = st.session_state.get('gmail_service')
-        if not service:
-            return "❌ Gmail not connected. Please authenticate first."
-        
-        # Limit max results
-        max_results = min(max_results, 50)
-        
-        # Get messages
-        results = service.users().messages().list(
-            userId='me', 
-            maxResults=max_results,
-            labelIds=['INBOX']
-        ).execute()
-        
-        messages = results.get('messages', [])
-        
-        if not messages:
-            return "📭 No emails found in inbox."
-        
-        email_list = [f"📧 **GMAIL INBOX** ({len(messages)} emails)\n"]
-        
-        for i, msg in enumerate(messages, 1):
-            # Get message details
-            message = service.users().messages().get(
-                userId='me', 
-                id=msg['id'],
-                format='metadata',
-                metadataHeaders=['From', 'Subject', 'Date']
-            ).execute()
-            
-            headers = message['payload']['headers']
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
-            
-            # Check if unread
-            labels = message.get('labelIds', [])
-            unread_marker = "🔵 " if 'UNREAD' in labels else ""
-            
-            email_list.append(f"\n{unread_marker}**{i}. From:** {from_email}")
-            email_list.append(f"   **Subject:** {subject}")
-            email_list.append(f"   **Date:** {date}")
-            email_list.append("   " + "-" * 50)
-        
-        return "\n".join(email_list)
-    
-    except Exception as e:
-        return f"❌ Error fetching emails: {str(e)}"
-
-@tool
-def send_gmail(to: str, subject: str, body: str) -> str:
-    """Send a real email via Gmail
-    
-    Args:
-        to: Recipient email address
-        subject: Email subject
-        body: Email body content
-    """
-    try:
-        service = st.session_state.get('gmail_service')
-        if not service:
-            return "❌ Gmail not connected. Please authenticate first."
-        
-        # Validate email
-        if '@' not in to:
-            return "❌ Invalid email address format."
-        
-        # Create message
-        message = MIMEText(body)
-        message['to'] = to
-        message['subject'] = subject
-        
-        # Encode message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        
-        # Send message
-        send_message = service.users().messages().send(
-            userId='me',
-            body={'raw': raw_message}
-        ).execute()
-        
-        return f"""✅ **Email sent successfully!**
-
-**To:** {to}
-**Subject:** {subject}
-**Body Preview:** {body[:100]}{'...' if len(body) > 100 else ''}
-**Message ID:** {send_message['id']}
-**Sent at:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"""
-    
-    except Exception as e:
-        return f"❌ Error sending email: {str(e)}"
+# ==================== SESSION ====================
+def get_context():
+    """The agent state of this browser session"""
+    if st.session_state.get('agent_context') is None:
+        st.session_state.agent_context = AgentContext()
+    return st.session_state.agent_context
 
-@tool
-def search_gmail(query: str, max_results: int = 10) -> str:
-    """Search Gmail with a query
-    
-    Args:
-        query: Search query (e.g., 'from:john@example.com', 'subject:meeting', 'is:unread')
-        max_results: Number of results to return (default 10, max 50)
-    """
+def authorize(login_hint=None):
+    """Run the OAuth consent flow and return new credentials, or None"""
     try:
-        service = st.session_state.get('gmail_service')
-        if not service:
-            return "❌ Gmail not connected. Please authenticate first."
-        
-        max_results = min(max_results, 50)
-        
-        results = service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=max_results
-        ).execute()
-        
-        messages = results.get('messages', [])
-        
-        if not messages:
-            return f"📭 No emails found matching: '{query}'"
-        
-        email_list = [f"🔍 **Search Results** for '{query}' ({len(messages)} found)\n"]
-        
-        for i, msg in enumerate(messages, 1):
-            message = service.users().messages().get(
-                userId='me',
-                id=msg['id'],
-                format='metadata',
-                metadataHeaders=['From', 'Subject', 'Date']
-            ).execute()
-            
-            headers = message['payload']['headers']
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
-            
-            email_list.append(f"\n**{i}. From:** {from_email}")
-            email_list.append(f"   **Subject:** {subject}")
-            email_list.append(f"   **Date:** {date}")
-            email_list.append("   " + "-" * 50)
-        
-        return "\n".join(email_list)
-    
+        return run_oauth_flow(login_hint)
+    except FileNotFoundError:
+        st.error("❌ credentials.json not found!")
+        st.info("""
+        Please follow these steps:
+        1. Go to Google Cloud Console
+        2. Create OAuth 2.0 credentials
+        3. Download as credentials.json
+        4. Place in project folder
+        """)
     except Exception as e:
-        return f"❌ Error searching emails: {str(e)}"
+        st.error(f"Authentication failed: {str(e)}")
+    return None
 
-@tool
-def get_unread_count() -> str:
-    """Get count of unread emails"""
+def connect_gmail(ctx, account=None):
+    """Connect the session to a Gmail account, logging in if needed"""
     try:
-        service = st.session_state.get('gmail_service')
-        if not service:
-            return "❌ Gmail not connected."
-        
-        results = service.users().messages().list(
-            userId='me',
-            labelIds=['UNREAD']
-        ).execute()
-        
-        count = results.get('resultSizeEstimate', 0)
-        return f"📬 You have **{count}** unread emails."
-    
+        account = connect_account(ctx, account, authorize=authorize)
     except Exception as e:
-        return f"❌ Error: {str(e)}"
+        st.error(f"Failed to build service: {str(e)}")
+        return None
+    if account:
+        # Kept in the page URL so a browser refresh reconnects without a login
+        st.query_params["account"] = account
+        st.query_params["grant"] = ctx.grant
+    return account
 
-@tool
-def read_email_content(email_number: int) -> str:
-    """Read the full content of a specific email from the inbox
-    
-    Args:
-        email_number: The number of the email from the inbox list (1-based)
-    """
+def reconnect_gmail(ctx):
+    """Reconnect a refreshed page with the grant kept in its URL"""
+    account, grant = st.query_params.get("account"), st.query_params.get("grant")
+    if not (account and grant):
+        return None
     try:
-        service = st.session_state.get('gmail_service')
-        if not service:
-            return "❌ Gmail not connected."
-        
-        # Get recent messages
-        results = service.users().messages().list(
-            userId='me',
-            maxResults=50,
-            labelIds=['INBOX']
-        ).execute()
-        
-        messages = results.get('messages', [])
-        
-        if email_number < 1 or email_number > len(messages):
-            return f"❌ Invalid email number. Please choose between 1 and {len(messages)}."
-        
-        # Get the specific message
-        msg_id = messages[email_number - 1]['id']
-        message = service.users().messages().get(
-            userId='me',
-            id=msg_id,
-            format='full'
-        ).execute()
-        
-        # Extract headers
-        headers = message['payload']['headers']
-        from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
-        
-        # Extract body
-        def get_body(payload):
-            if 'body' in payload and 'data' in payload['body']:
-                return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-            elif 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-            return "No readable content"
-        
-        body = get_body(message['payload'])
-        
-        return f"""📧 **Email #{email_number}**
-
-**From:** {from_email}
-**Subject:** {subject}
-**Date:** {date}
-
-**Content:**
-{body[:1000]}{'...' if len(body) > 1000 else ''}"""
-    
-    except Exception as e:
-        return f"❌ Error reading email: {str(e)}"
+        return connect_account(ctx, account, grant=grant)
+    except Exception:
+        # Expired, revoked or logged out elsewhere
+        st.query_params.clear()
+        return None
 
-# ==================== AGENT ====================
-def create_gmail_agent():
-    """Create agent with Gmail tools"""
-    
-    tools = [check_gmail_inbox, send_gmail, search_gmail, get_unread_count, read_email_content]
-    
-    system_message = """You are a helpful Gmail assistant with access to real Gmail functionality.
+# ==================== CHAT RENDERING ====================
+# Messages rendered per rerun; older ones are behind a "show earlier" button
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "20"))
 
-Available tools:
-- check_gmail_inbox: View recent emails in inbox
-- send_gmail: Send emails to recipients
-- search_gmail: Search emails with queries (e.g., 'from:someone@example.com', 'is:unread')
-- get_unread_count: Check number of unread emails
-- read_email_content: Read full content of a specific email by number
+def render_part(part):
+    """Render reply text as markdown and email lists as tables"""
+    if isinstance(part, str):
+        st.markdown(part)
+    elif isinstance(part, EmailList):
+        st.markdown(f"{part.title} ({part.total} emails)")
+        st.dataframe(part.table(), hide_index=True, use_container_width=True)
+        if part.hidden:
+            st.caption(f"Only the first {len(part.rows)} are listed. " + " ".join(part.summary_lines()))
+    else:
+        st.markdown(part.to_markdown())
 
-Always use tools when users ask about their emails. Be helpful and provide clear responses."""
-    
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=os.getenv("GOOGLE_API_KEY"),
-        temperature=0.3
-    )
-    
-    llm_with_tools = llm.bind_tools(tools)
-    
-    return llm_with_tools, tools, system_message
+def render_message(role, content):
+    if role == "human":
+        with st.chat_message("user"):
+            st.write(content)
+        return
+    with st.chat_message("assistant"):
+        for part in content if isinstance(content, (list, tuple)) else [content]:
+            render_part(part)
 
-def run_agent(user_input: str, chat_history: list):
-    """Run the agent with Gmail tools"""
-    try:
-        llm_with_tools, tools, system_message = create_gmail_agent()
-        
-        tool_map = {tool.name: tool for tool in tools}
-        
-        messages = [{"role": "system", "content": system_message}]
-        
-        for role, content in chat_history:
-            if role == "human":
-                messages.append({"role": "user", "content": content})
-            else:
-                messages.append({"role": "assistant", "content": content})
-        
-        messages.append({"role": "user", "content": user_input})
-        
-        response = llm_with_tools.invoke(messages)
-        
-        if hasattr(response, 'tool_calls') and response.tool_calls:
-            tool_results = []
-            
-            for tool_call in response.tool_calls:
-                tool_name = tool_call['name']
-                tool_args = tool_call['args']
-                
-                if tool_name in tool_map:
-                    tool = tool_map[tool_name]
-                    result = tool.invoke(tool_args)
-                    tool_results.append(result)
-            
-            return "\n\n".join(tool_results)
+def stream_reply(events, status):
+    """Render an agent turn while it streams and return its parts"""
+    parts = []
+    text_slot = None
+    for kind, payload in events:
+        if kind == "progress":
+            status.caption(f"⚙️ {payload}")
+            continue
+        append_part(parts, payload)
+        if kind == "record":
+            render_part(payload)
+            text_slot = None
         else:
-            return response.content
-    
-    except Exception as e:
-        return f"❌ Error: {str(e)}\n\nPlease try again or rephrase your request."
+            if text_slot is None:
+                text_slot = st.empty()
+            text_slot.markdown(parts[-1])
+    status.empty()
+    return parts
 
 # ==================== STREAMLIT UI ====================
 def main():
+    ctx = current_context()
+    
     # Header
     st.markdown('<p class="main-header">🤖 Production Gmail Agent</p>', unsafe_allow_html=True)
     st.markdown("**AI-Powered Email Management with Real Gmail Integration**")
@@ -430,7 +151,7 @@ def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "gmail_connected" not in st.session_state:
-        st.session_state.gmail_connected = False
+        st.session_state.gmail_connected = bool(reconnect_gmail(ctx))
     
     # Sidebar
     with st.sidebar:
@@ -447,21 +168,27 @@ def main():
                     st.rerun()
             with col2:
                 if st.button("🔓 Logout", use_container_width=True):
+                    disconnect_account(ctx)
+                    st.query_params.clear()
                     st.session_state.gmail_connected = False
-                    st.session_state.gmail_service = None
-                    if os.path.exists('token.pickle'):
-                        os.remove('token.pickle')
                     st.success("Logged out!")
                     st.rerun()
+            
+            token_error = get_account_pool().error(ctx.account)
+            if token_error:
+                st.warning(f"⚠️ Gmail login expired, please log out and connect again ({token_error})")
         else:
             st.warning("🔒 Gmail Not Connected")
             
+            # Each browser session logs in to its own mailbox; a saved token
+            # is only reused by the session that logged in
+            account = st.text_input("Gmail address", placeholder="you@gmail.com")
             if st.button("🔐 Connect Gmail", use_container_width=True, type="primary"):
                 with st.spinner("🔄 Connecting to Gmail..."):
-                    service = get_gmail_service()
-                    if service:
-                        st.session_state.gmail_service = service
+                    if connect_gmail(ctx, account):
                         st.session_state.gmail_connected = True
+                        # Start warming the inbox while the page reloads
+                        get_prefetch_worker()
                         st.success("✅ Connected!")
                         st.balloons()
                         st.rerun()
@@ -474,21 +201,21 @@ def main():
         if st.session_state.gmail_connected:
             if st.button("📥 Check Inbox", use_container_width=True):
                 with st.spinner("📧 Fetching emails..."):
-                    result = run_agent("Check my inbox", st.session_state.messages)
+                    result = run_agent_parts("Check my inbox", st.session_state.messages, ctx)
                     st.session_state.messages.append(("human", "Check my inbox"))
                     st.session_state.messages.append(("assistant", result))
                 st.rerun()
             
             if st.button("🔵 Unread Count", use_container_width=True):
                 with st.spinner("🔢 Counting..."):
-                    result = run_agent("How many unread emails do I have?", st.session_state.messages)
+                    result = run_agent_parts("How many unread emails do I have?", st.session_state.messages, ctx)
                     st.session_state.messages.append(("human", "Unread count"))
                     st.session_state.messages.append(("assistant", result))
                 st.rerun()
             
             if st.button("🔍 Search Unread", use_container_width=True):
                 with st.spinner("🔎 Searching..."):
-                    result = run_agent("Search for unread emails", st.session_state.messages)
+                    result = run_agent_parts("Search for unread emails", st.session_state.messages, ctx)
                     st.session_state.messages.append(("human", "Search unread"))
                     st.session_state.messages.append(("assistant", result))
                 st.rerun()
@@ -501,9 +228,113 @@ def main():
         if st.session_state.gmail_connected:
             st.header("📊 Session Stats")
             st.metric("Messages", len(st.session_state.messages))
+            st.metric("LLM Calls Saved", ctx.llm_calls_saved,
+                      help="Quick actions, simple commands and repeat questions answered without calling Gemini")
+            if PLAN_CACHE_ENABLED:
+                plan_stats = get_plan_cache().stats()
+                if plan_stats["hits"] + plan_stats["misses"]:
+                    st.caption(
+                        f"🧠 Plan cache · {plan_stats['hit_rate']:.0%} hit rate "
+                        f"({plan_stats['hits']}/{plan_stats['hits'] + plan_stats['misses']}) · "
+                        f"{plan_stats['answer_hits']} answers reused · {plan_stats['entries']} plans"
+                    )
+            
+            if ctx.agent_timings:
+                with st.expander("⏱️ Last Turn Timings"):
+                    for timing in ctx.agent_timings:
+                        if timing.get("routed"):
+                            st.caption(f"**Step {timing['step']}** · routed directly, no LLM call")
+                        elif timing.get("cached"):
+                            st.caption(f"**Step {timing['step']}** · replayed cached plan, no LLM call")
+                        else:
+                            st.caption(
+                                f"**Step {timing['step']}** · LLM {timing.get('llm_ms', 0):.0f} ms"
+                                f" (first token {timing.get('first_token_ms', 0):.0f} ms)"
+                            )
+                        for tool_name, elapsed_ms in timing["tools"]:
+                            st.caption(f"↳ {tool_name}: {elapsed_ms:.0f} ms")
+                        if "tools_ms" in timing:
+                            st.caption(f"↳ tools wall time: {timing['tools_ms']:.0f} ms")
+            
+            token_stats = ctx.token_stats
+            if token_stats:
+                with st.expander("🧮 Last Turn Tokens"):
+                    st.caption(
+                        f"History: {token_stats['history_tokens']} → "
+                        f"{token_stats['prompt_history_tokens']} tokens (estimated)"
+                    )
+                    st.caption(
+                        f"Gemini: {token_stats['input_tokens']} in / "
+                        f"{token_stats['output_tokens']} out"
+                    )
+            
+            quota_stats = account_quota(get_account_pool().credentials(ctx.account)).stats()
+            if quota_stats:
+                with st.expander("📈 Gmail API Usage"):
+                    for method, entry in sorted(quota_stats.items()):
+                        st.caption(
+                            f"**{method.replace('gmail.users.', '')}** · {entry['calls']} calls · "
+                            f"{entry['units']} units · {entry['retries']} retries · "
+                            f"{entry['throttled']} throttled · {entry['errors']} errors"
+                        )
+            
+            prefetch_worker = get_prefetch_worker()
+            if prefetch_worker and prefetch_worker.last_run:
+                prefetch_status = prefetch_worker.status()
+                st.caption(
+                    f"🔥 Inbox kept warm · synced {time.time() - prefetch_status['last_run']:.0f} s ago · "
+                    f"{prefetch_status['warm_bodies']} bodies in memory"
+                )
+            
+            # Starting the worker here also resumes mail queued before a restart
+            outbox_worker = get_outbox_worker()
+            outbox_stats = outbox_worker.outbox.stats() if outbox_worker else None
+            if outbox_stats and any(outbox_stats[k] for k in ("queued", "sending", "sent", "failed")):
+                with st.expander("📤 Outbox"):
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Queued", outbox_stats["queued"] + outbox_stats["sending"])
+                    col2.metric("Sent", outbox_stats["sent"])
+                    col3.metric("Failed", outbox_stats["failed"])
+                    st.caption(
+                        f"{outbox_stats['sent_last_10_min'] / 10:.1f} sent/min (last 10 min) · "
+                        f"{outbox_stats['sent_last_24_h']}/{OUTBOX_DAILY_LIMIT} in the last 24 h"
+                    )
+                    if outbox_stats["last_error"]:
+                        st.caption(f"Last failure: {outbox_stats['last_error']}")
+            
+            metrics = registry.snapshot()
+            if metrics:
+                with st.expander("⚡ Performance", expanded=True):
+                    st.dataframe(
+                        [
+                            {
+                                "kind": entry["kind"],
+                                "name": entry["name"],
+                                "calls": entry["count"],
+                                "errors": entry["errors"],
+                                "p50 ms": entry["p50_ms"],
+                                "p95 ms": entry["p95_ms"],
+                                "mean ms": entry["mean_ms"],
+                                "KB in": round(entry["bytes_received"] / 1024, 1),
+                                "tokens": entry["input_tokens"] + entry["output_tokens"],
+                            }
+                            for entry in metrics
+                        ],
+                        hide_index=True,
+                        use_container_width=True,
+                    )
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.download_button("JSONL", registry.to_jsonl(), "metrics.jsonl",
+                                           mime="application/x-ndjson", use_container_width=True)
+                    with col2:
+                        st.download_button("Prometheus", registry.to_prometheus(), "metrics.prom",
+                                           mime="text/plain", use_container_width=True)
         
         if st.button("🗑️ Clear Chat", use_container_width=True):
             st.session_state.messages = []
+            st.session_state.chat_window = CHAT_WINDOW
+            ctx.email_handles = []
             st.rerun()
         
         st.markdown("---")
@@ -538,16 +369,17 @@ def main():
     if not st.session_state.gmail_connected:
         st.warning("⚠️ Please connect your Gmail account using the sidebar to start chatting.")
     
-    # Display chat history
+    # Display chat history: only the latest messages, so reruns stay fast
+    messages = st.session_state.messages
+    window = st.session_state.get('chat_window', CHAT_WINDOW)
     chat_container = st.container()
     with chat_container:
-        for role, content in st.session_state.messages:
-            if role == "human":
-                with st.chat_message("user"):
-                    st.write(content)
-            else:
-                with st.chat_message("assistant"):
-                    st.markdown(content)
+        hidden = len(messages) - window
+        if hidden > 0 and st.button(f"⬆️ Show {min(hidden, CHAT_WINDOW)} earlier messages ({hidden} hidden)"):
+            st.session_state.chat_window = window + CHAT_WINDOW
+            st.rerun()
+        for role, content in messages[-window:]:
+            render_message(role, content)
     
     # Chat input
     if prompt := st.chat_input("💬 Ask about your emails... (e.g., 'Check my inbox', 'Send email to john@example.com')"):
@@ -557,8 +389,15 @@ def main():
         
         st.session_state.messages.append(("human", prompt))
         
-        with st.spinner("🤔 Processing your request..."):
-            result = run_agent(prompt, st.session_state.messages[:-1])
+        with st.chat_message("user"):
+            st.write(prompt)
+        
+        # Stream the answer as it arrives; tool progress goes to a status line
+        with st.chat_message("assistant"):
+            status = st.empty()
+            status.caption("🤔 Processing your request...")
+            
+            result = stream_reply(run_agent_stream(prompt, st.session_state.messages[:-1], ctx), status)
             st.session_state.messages.append(("assistant", result))
         
         st.rerun()
@@ -590,4 +429,6 @@ def main():
 
 # ==================== RUN ====================
 if __name__ == "__main__":
-    main()
+    # Tools read and write the agent state of this browser session
+    with use_context(get_context()):
+        main()
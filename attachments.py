@@ -0,0 +1,355 @@
+# ==================== FILE 27: attachments.py ====================
+"""
+Email attachments on local disk
+Attachment parts are listed from a message's MIME tree without their
+data, downloaded through messages().attachments().get into a
+content-addressed store (one file per distinct content, however many
+messages carry it) and optionally turned into text, cached by content
+hash.
+"""
+
+import base64
+import codecs
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from gmail_quota import execute
+from mime_body import html_to_text, is_attachment, iter_parts
+
+DEFAULT_STORE_DIR = 'attachments'
+
+# Characters of extracted text kept per attachment
+DEFAULT_TEXT_CHARS = 20000
+
+# base64 characters decoded per write; a multiple of 4
+DECODE_CHUNK_CHARS = 256 * 1024
+
+# Attachment parts without their data; nesting covers mixed > alternative > related
+_PART = 'partId,filename,mimeType,headers,body(attachmentId,size)'
+ATTACHMENT_FIELDS = f'id,payload({_PART},parts({_PART},parts({_PART},parts({_PART}))))'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parts (
+    message_id TEXT PRIMARY KEY,
+    parts TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT NOT NULL,
+    part_id TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (message_id, part_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS texts (
+    sha256 TEXT PRIMARY KEY,
+    text TEXT
+);
+"""
+
+_DOCX_TEXT = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}t'
+_DOCX_PARAGRAPH = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p'
+
+
+def _header(part, name):
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+
+def list_attachments(payload):
+    """Attachment parts of a message payload, in document order
+
+    Returns:
+        Dicts with part_id, filename, mime_type, size and attachment_id
+        (None for small parts Gmail sends inline)
+    """
+    attachments = []
+    for part in iter_parts(payload):
+        if part.get('parts') or not is_attachment(part):
+            continue
+        body = part.get('body', {})
+        match = re.search(r'filename="?([^";]+)"?', _header(part, 'Content-Disposition'))
+        filename = part.get('filename') or (match.group(1) if match else 'unnamed')
+        attachments.append({
+            'part_id': part.get('partId', ''),
+            'filename': filename,
+            'mime_type': part.get('mimeType', 'application/octet-stream').lower(),
+            'size': body.get('size', 0),
+            'attachment_id': body.get('attachmentId'),
+        })
+    return attachments
+
+
+def format_size(size):
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+# ---------- store ----------
+class AttachmentStore:
+    """Content-addressed attachment files plus an SQLite index
+
+    Files live at <directory>/<sha256[:2]>/<sha256>. The index maps each
+    (message, part) to its content hash, remembers each message's
+    attachment list and caches extracted text per hash.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    # ---------- index ----------
+    def get_parts(self, message_id):
+        with self._lock:
+            row = self._conn.execute("SELECT parts FROM parts WHERE message_id = ?", (message_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_parts(self, message_id, parts):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO parts (message_id, parts) VALUES (?, ?)",
+                               (message_id, json.dumps(parts)))
+
+    def lookup(self, message_id, part_id):
+        """Content hash of a part already on disk, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT a.sha256 FROM attachments a JOIN blobs b ON a.sha256 = b.sha256
+                   WHERE a.message_id = ? AND a.part_id = ?""",
+                (message_id, part_id)
+            ).fetchone()
+        if row is None or not os.path.exists(self.path(row[0])):
+            return None
+        return row[0]
+
+    # ---------- files ----------
+    def write_base64(self, message_id, part_id, data):
+        """Decode base64url data to disk a chunk at a time and file it by content
+
+        Returns:
+            (sha256, size, deduplicated): deduplicated is True when the same
+            content was already stored, e.g. from another message
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.directory, f".{message_id}.{part_id}.{threading.get_ident()}.tmp")
+        try:
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                for start in range(0, len(data), DECODE_CHUNK_CHARS):
+                    chunk = data[start:start + DECODE_CHUNK_CHARS]
+                    raw = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))
+                    digest.update(raw)
+                    size += len(raw)
+                    f.write(raw)
+            sha256 = digest.hexdigest()
+            path = self.path(sha256)
+            deduplicated = os.path.exists(path)
+            if deduplicated:
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO blobs (sha256, size, stored_at) VALUES (?, ?, ?)",
+                (sha256, size, time.time())
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO attachments (message_id, part_id, sha256) VALUES (?, ?, ?)",
+                (message_id, part_id, sha256)
+            )
+        return sha256, size, deduplicated
+
+    # ---------- text ----------
+    def text(self, sha256, mime_type, filename, max_chars=DEFAULT_TEXT_CHARS):
+        """Extracted text of a stored file, computed once per content hash
+
+        Returns None for formats without an extractor; that is not
+        cached, so installing an optional extractor takes effect.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM texts WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is not None:
+            return row[0]
+        text = extract_text(self.path(sha256), mime_type, filename, max_chars)
+        if text is None:
+            return None
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO texts (sha256, text) VALUES (?, ?)", (sha256, text))
+        return text
+
+    def stats(self):
+        with self._lock:
+            files, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            refs = self._conn.execute("SELECT COUNT(*) FROM attachments").fetchone()[0]
+        return {'files': files, 'bytes': size, 'attachments': refs}
+
+    def clear(self):
+        """Delete every stored file and forget the index"""
+        with self._lock, self._conn:
+            for (sha256,) in self._conn.execute("SELECT sha256 FROM blobs").fetchall():
+                path = self.path(sha256)
+                if os.path.exists(path):
+                    os.remove(path)
+                folder = os.path.dirname(path)
+                if os.path.isdir(folder) and not os.listdir(folder):
+                    os.rmdir(folder)
+            self._conn.executescript(
+                "DELETE FROM parts; DELETE FROM attachments; DELETE FROM blobs; DELETE FROM texts;")
+
+
+# ---------- Gmail ----------
+def fetch_attachment_parts(service, message_id):
+    """The message's attachment list, without any attachment data"""
+    message = execute(service.users().messages().get(
+        userId='me', id=message_id, format='full', fields=ATTACHMENT_FIELDS))
+    return list_attachments(message['payload'])
+
+
+def _inline_data(service, message_id, part_id):
+    """Data of a small part Gmail sends inside the message instead of by attachment id"""
+    message = execute(service.users().messages().get(
+        userId='me', id=message_id, format='full', fields='payload'))
+    part = next((p for p in iter_parts(message['payload']) if p.get('partId') == part_id), None)
+    return (part or {}).get('body', {}).get('data', '')
+
+
+def download_attachment(service, store, message_id, attachment):
+    """Download one attachment into the store unless it is already there
+
+    Returns:
+        (sha256, status) with status 'cached', 'deduplicated' or 'downloaded'
+    """
+    sha256 = store.lookup(message_id, attachment['part_id'])
+    if sha256:
+        return sha256, 'cached'
+    if attachment['attachment_id']:
+        # Gmail returns the whole attachment base64 encoded in one JSON
+        # response; only the encoded form is held, never a decoded copy
+        data = execute(service.users().messages().attachments().get(
+            userId='me', messageId=message_id, id=attachment['attachment_id'], fields='data'))['data']
+    else:
+        data = _inline_data(service, message_id, attachment['part_id'])
+    sha256, _, deduplicated = store.write_base64(message_id, attachment['part_id'], data)
+    return sha256, 'deduplicated' if deduplicated else 'downloaded'
+
+
+def fetch_attachments(client, store, requests, slots, progress=None):
+    """Download many attachments concurrently, each at most once
+
+    Args:
+        client: Callable returning a context manager that lends a Gmail
+            client to one thread (httplib2 clients are not thread-safe)
+        store: AttachmentStore to file them in
+        requests: (message_id, attachment) pairs
+        slots: Semaphore bounding concurrent downloads (shared process-wide)
+        progress: Optional callback(done, total) after each download
+
+    Returns:
+        A list in the order of requests of (sha256, status), or
+        (None, error message) for a failed download
+    """
+    unique = list(dict.fromkeys((message_id, attachment['part_id']) for message_id, attachment in requests))
+    by_key = {(message_id, attachment['part_id']): attachment for message_id, attachment in requests}
+    results = {}
+    done = 0
+
+    def fetch(key):
+        message_id, _ = key
+        with slots, client() as service:
+            return download_attachment(service, store, message_id, by_key[key])
+
+    if unique:
+        with ThreadPoolExecutor(max_workers=len(unique)) as pool:
+            futures = {key: pool.submit(fetch, key) for key in unique}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = (None, str(e))
+                done += 1
+                if progress:
+                    progress(done, len(unique))
+
+    return [results[(message_id, attachment['part_id'])] for message_id, attachment in requests]
+
+
+# ---------- text extraction ----------
+def _read_text(path, max_chars):
+    with open(path, 'rb') as f:
+        raw = f.read(max_chars * 4)
+    return codecs.getincrementaldecoder('utf-8')(errors='replace').decode(raw)
+
+
+def _docx_text(path):
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    return "\n".join(
+        "".join(node.text or '' for node in paragraph.iter(_DOCX_TEXT))
+        for paragraph in root.iter(_DOCX_PARAGRAPH)
+    )
+
+
+def _pdf_text(path, max_chars):
+    # Optional: PDFs are only read when pypdf is installed
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    parts, length = [], 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ''
+        parts.append(text)
+        length += len(text)
+        if length >= max_chars:
+            break
+    return "\n".join(parts)
+
+
+def extract_text(path, mime_type, filename, max_chars=DEFAULT_TEXT_CHARS):
+    """Up to max_chars of text from a stored attachment, or None if the format is not supported"""
+    extension = os.path.splitext(filename.lower())[1]
+    try:
+        if mime_type == 'text/html' or extension in ('.html', '.htm'):
+            text = html_to_text(_read_text(path, max_chars * 8))
+        elif mime_type.startswith('text/') or extension in ('.txt', '.csv', '.md', '.json', '.ics', '.log'):
+            text = _read_text(path, max_chars)
+        elif mime_type == 'application/json':
+            text = _read_text(path, max_chars)
+        elif extension == '.docx':
+            text = _docx_text(path)
+        elif mime_type == 'application/pdf' or extension == '.pdf':
+            text = _pdf_text(path, max_chars)
+        else:
+            return None
+    except Exception:
+        # A damaged or mislabelled file is treated like an unsupported one
+        return None
+    if text is None:
+        return None
+    return text.strip()[:max_chars]
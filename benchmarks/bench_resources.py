@@ -0,0 +1,75 @@
+# ==================== FILE 5: benchmarks/bench_resources.py ====================
+"""
+Startup and per-turn resource benchmark
+Compares building the Gemini client, tool binding and Gmail service on
+every turn against reusing the process-level cached agent and borrowing
+pooled Gmail clients.
+
+Run from the project root:
+    python benchmarks/bench_resources.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The LLM client is only constructed here, never called
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder-key")
+
+TURNS = 20
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    start = time.perf_counter()
+    import agent_core
+    from google.auth.credentials import AnonymousCredentials
+    from googleapiclient.discovery import build
+    from gmail_accounts import AccountPool, TokenStore
+    print(f"import agent_core:                  {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    creds = AnonymousCredentials()
+    pool = AccountPool(TokenStore(tempfile.mkdtemp()), agent_core.new_gmail_service)
+    account = pool.add("benchmark@example.com", creds, persist=False)
+    uncached_agent = agent_core.create_gmail_agent.__wrapped__
+
+    per_turn_build = [
+        timed(lambda: build('gmail', 'v1', credentials=creds,
+                            static_discovery=True, cache_discovery=False))
+        for _ in range(TURNS)
+    ]
+
+    def borrow():
+        with pool.client(account):
+            pass
+
+    first_service = timed(borrow)
+    cached_service = [timed(borrow) for _ in range(TURNS)]
+
+    per_turn_agent = [timed(uncached_agent) for _ in range(TURNS)]
+    first_agent = timed(agent_core.create_gmail_agent)
+    cached_agent = [timed(agent_core.create_gmail_agent) for _ in range(TURNS)]
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    print(f"gmail build(), per turn:            {mean(per_turn_build):8.2f} ms")
+    print(f"gmail client pooled, first borrow:  {first_service:8.2f} ms")
+    print(f"gmail client pooled, per turn:      {mean(cached_service):8.3f} ms")
+    print(f"create_gmail_agent, per turn:       {mean(per_turn_agent):8.2f} ms")
+    print(f"create_gmail_agent cached, first:   {first_agent:8.2f} ms")
+    print(f"create_gmail_agent cached, turn:   {mean(cached_agent):8.3f} ms")
+    saved = mean(per_turn_agent) - mean(cached_agent)
+    print(f"saved per turn (agent):             {saved:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
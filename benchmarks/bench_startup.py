@@ -0,0 +1,125 @@
+# ==================== FILE 26: benchmarks/bench_startup.py ====================
+"""
+Cold start benchmark for the headless agent core
+Times `import agent_core` and a cold start (fresh interpreter, import,
+first check_gmail_inbox against the fake Gmail backend) in subprocesses,
+and checks that the heavy client libraries stay unimported until used.
+
+Run from the project root:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --max-import-ms 200 --max-cold-start-ms 3000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Imported on first use only; loading any of them at import time is a regression
+DEFERRED_MODULES = [
+    "streamlit",
+    "langchain_core",
+    "langchain_google_genai",
+    "googleapiclient.discovery",
+    "google_auth_oauthlib",
+]
+
+# Budgets for the medians, with headroom over a typical laptop (about
+# 100 ms and 2.5 s); override them for slower CI machines
+MAX_IMPORT_MS = 300
+MAX_COLD_START_MS = 4000
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import agent_core
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({"import_ms": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+# A first tool call needs the Gmail discovery client, so this also pays
+# for the deferred imports a real first request would
+COLD_START_SCRIPT = """
+import json, os, sys, tempfile
+sys.path.insert(0, %r)
+os.environ.setdefault("PREFETCH_ENABLED", "0")
+import agent_core
+from fake_gmail import FakeCredentials, FakeGmailHttp, FakeMailbox, fake_service
+from gmail_accounts import AccountPool, TokenStore
+
+workdir = tempfile.mkdtemp(prefix="gmail-startup-")
+mailbox = FakeMailbox(100)
+pool = AccountPool(TokenStore(os.path.join(workdir, "tokens")),
+                   lambda creds: fake_service(FakeGmailHttp(mailbox, 0)))
+pool.add("benchmark@example.com", FakeCredentials(), persist=False)
+agent_core.get_account_pool = lambda: pool
+agent_core.MAILBOX_CACHE_PATH = os.path.join(workdir, "cache.db")
+with agent_core.use_context(agent_core.AgentContext("benchmark@example.com")):
+    result = agent_core.check_gmail_inbox.invoke({"max_results": 10})
+print(json.dumps({"ok": not (isinstance(result, str) and result.startswith("❌"))}))
+"""
+
+
+def run_python(script):
+    """Run script in a fresh interpreter; returns (wall ms, parsed last output line)"""
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip() or f"exit status {completed.returncode}")
+    return elapsed, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=MAX_IMPORT_MS,
+                        help="exit non-zero if the median import time exceeds this (0 disables)")
+    parser.add_argument("--max-cold-start-ms", type=float, default=MAX_COLD_START_MS,
+                        help="exit non-zero if the median cold start exceeds this (0 disables)")
+    args = parser.parse_args()
+
+    # The first run compiles bytecode; it is not what users see
+    run_python(IMPORT_SCRIPT % DEFERRED_MODULES)
+
+    import_ms, loaded = [], set()
+    for _ in range(args.runs):
+        _, result = run_python(IMPORT_SCRIPT % DEFERRED_MODULES)
+        import_ms.append(result["import_ms"])
+        loaded.update(result["loaded"])
+
+    cold_ms = []
+    for _ in range(args.runs):
+        elapsed, result = run_python(COLD_START_SCRIPT % HERE)
+        if not result["ok"]:
+            raise RuntimeError("first tool call failed")
+        cold_ms.append(elapsed)
+
+    print(f"import agent_core, median:          {median(import_ms):8.1f} ms")
+    print(f"cold start to first tool, median:   {median(cold_ms):8.1f} ms")
+
+    failures = []
+    for module in sorted(loaded):
+        failures.append(f"{module} is imported by `import agent_core`; import it on first use")
+    if args.max_import_ms and median(import_ms) > args.max_import_ms:
+        failures.append(f"import took {median(import_ms):.1f} ms > {args.max_import_ms} ms")
+    if args.max_cold_start_ms and median(cold_ms) > args.max_cold_start_ms:
+        failures.append(f"cold start took {median(cold_ms):.1f} ms > {args.max_cold_start_ms} ms")
+    for failure in failures:
+        print(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# ==================== FILE 11: benchmarks/fake_gmail.py ====================
+"""
+In-process fake Gmail backend for offline benchmarks
+FakeGmailHttp stands in for httplib2.Http, so a real googleapiclient
+service (discovery, request building, batching, response parsing) runs
+against a generated mailbox with configurable size and injected latency.
+"""
+
+import base64
+import email
+import json
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, unquote, urlparse
+
+import httplib2
+from googleapiclient.discovery import build
+
+TOPICS = ["invoice", "meeting", "newsletter", "project update", "travel", "receipt", "report"]
+BASE_INTERNAL_DATE = 1767225600000  # 2026-01-01T00:00:00Z in milliseconds
+PAGE_SIZE_DEFAULT = 100
+SYSTEM_LABELS = ['INBOX', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'TRASH', 'SPAM']
+
+
+class FakeMailbox:
+    """Deterministic generated mailbox; message fields are derived from the index
+
+    Only label changes and newly added messages are stored, so a 100k
+    message mailbox costs almost nothing to hold.
+    """
+
+    def __init__(self, size, unread_every=4, body_chars=2000):
+        self.size = size
+        self.unread_every = unread_every
+        self.body_chars = body_chars
+        self.history_id = 1000
+        self.history = []
+        self.label_overrides = {}
+        self.added = {}
+        self.deleted = set()
+        self.lock = threading.RLock()
+
+    # ---------- message generation ----------
+    @staticmethod
+    def message_id(index):
+        return f"{index:016x}"
+
+    def _index(self, message_id):
+        try:
+            index = int(message_id, 16)
+        except ValueError:
+            return None
+        return index if 0 <= index < self.size else None
+
+    def _generated(self, index):
+        topic = TOPICS[index % len(TOPICS)]
+        labels = ['INBOX'] + (['UNREAD'] if index % self.unread_every == 0 else [])
+        sender = f"sender{index % 97}@example.com"
+        subject = f"Subject {index}: {topic}"
+        body = (f"Hello, this is message {index} about the {topic}. " * 50)[:self.body_chars]
+        return {
+            'id': self.message_id(index),
+            'threadId': self.message_id(index),
+            'labelIds': labels,
+            'internalDate': str(BASE_INTERNAL_DATE - index * 60000),
+            'from': sender,
+            'subject': subject,
+            'date': time.strftime('%a, %d %b %Y %H:%M:%S +0000',
+                                  time.gmtime(BASE_INTERNAL_DATE / 1000 - index * 60)),
+            'body': body,
+        }
+
+    def get(self, message_id):
+        with self.lock:
+            if message_id in self.deleted:
+                return None
+            if message_id in self.added:
+                message = dict(self.added[message_id])
+            else:
+                index = self._index(message_id)
+                if index is None:
+                    return None
+                message = self._generated(index)
+            if message_id in self.label_overrides:
+                message['labelIds'] = list(self.label_overrides[message_id])
+            return message
+
+    def iter_ids(self):
+        """Newest first: added messages, then generated ones"""
+        with self.lock:
+            added = sorted(self.added, key=lambda m: -int(self.added[m]['internalDate']))
+        yield from added
+        for index in range(self.size):
+            yield self.message_id(index)
+
+    # ---------- mutations ----------
+    def _record(self, **change):
+        self.history_id += 1
+        self.history.append({'id': str(self.history_id), **change})
+
+    def add_message(self, sender, subject, body, labels=('INBOX', 'UNREAD')):
+        with self.lock:
+            message_id = f"new{len(self.added):013x}"
+            self.added[message_id] = {
+                'id': message_id,
+                'threadId': message_id,
+                'labelIds': list(labels),
+                'internalDate': str(int(time.time() * 1000)),
+                'from': sender,
+                'subject': subject,
+                'date': time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime()),
+                'body': body,
+            }
+            self._record(messagesAdded=[{'message': {'id': message_id, 'labelIds': list(labels)}}])
+            return message_id
+
+    def modify(self, message_id, add=(), remove=()):
+        with self.lock:
+            message = self.get(message_id)
+            if message is None:
+                return False
+            labels = [l for l in message['labelIds'] if l not in remove]
+            labels.extend(l for l in add if l not in labels)
+            self.label_overrides[message_id] = labels
+            if add:
+                self._record(labelsAdded=[{'message': {'id': message_id}, 'labelIds': list(add)}])
+            if remove:
+                self._record(labelsRemoved=[{'message': {'id': message_id}, 'labelIds': list(remove)}])
+            return True
+
+    # ---------- search ----------
+    @staticmethod
+    def matches(message, labels, query):
+        if labels and not all(label in message['labelIds'] for label in labels):
+            return False
+        for term in (query or '').split():
+            term = term.lower()
+            if term == 'is:unread':
+                if 'UNREAD' not in message['labelIds']:
+                    return False
+            elif term == 'is:read':
+                if 'UNREAD' in message['labelIds']:
+                    return False
+            elif term.startswith('from:'):
+                if term[5:] not in message['from'].lower():
+                    return False
+            elif term.startswith('subject:'):
+                if term[8:] not in message['subject'].lower():
+                    return False
+            elif term.startswith('in:'):
+                if term[3:].upper() not in message['labelIds']:
+                    return False
+            elif ':' in term:
+                continue  # operators the fake does not model match everything
+            elif term not in (message['subject'] + ' ' + message['body']).lower():
+                return False
+        return True
+
+
+class FakeGmailHttp:
+    """httplib2.Http stand-in that serves the Gmail REST API from a FakeMailbox
+
+    Args:
+        mailbox: The FakeMailbox to serve
+        latency_ms: Sleep injected per HTTP round trip (batch counts once)
+        calls: Shared Counter of API calls by method; created if omitted
+    """
+
+    def __init__(self, mailbox, latency_ms=0, calls=None):
+        self.mailbox = mailbox
+        self.latency_ms = latency_ms
+        self.calls = calls if calls is not None else Counter()
+        self.round_trips = 0
+
+    # ---------- httplib2 interface ----------
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5,
+                connection_type=None):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        self.round_trips += 1
+        path = urlparse(uri).path
+        if path.startswith('/batch'):
+            return self._batch(body, headers or {})
+        status, payload = self._dispatch(method, uri, body)
+        return self._response(status, payload)
+
+    # ---------- batch ----------
+    def _batch(self, body, headers):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        content_type = headers.get('content-type') or headers.get('Content-Type')
+        envelope = email.message_from_string(f"Content-Type: {content_type}\r\n\r\n{body}")
+        boundary = "fake_gmail_batch"
+        chunks = []
+        for part in envelope.get_payload():
+            content_id = part['Content-ID'].strip('<>')
+            raw = part.get_payload()
+            head, _, inner_body = raw.partition('\r\n\r\n') if '\r\n\r\n' in raw else raw.partition('\n\n')
+            request_line = head.splitlines()[0]
+            inner_method, inner_uri, _ = request_line.split(' ', 2)
+            status, payload = self._dispatch(inner_method, inner_uri, inner_body or None)
+            chunks.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        chunks.append(f"--{boundary}--")
+        return self._response(
+            200, "".join(chunks), f'multipart/mixed; boundary="{boundary}"')
+
+    @staticmethod
+    def _response(status, payload, content_type='application/json'):
+        content = payload if isinstance(payload, str) else json.dumps(payload)
+        return httplib2.Response({'status': str(status), 'content-type': content_type}), \
+            content.encode('utf-8')
+
+    # ---------- routing ----------
+    def _dispatch(self, method, uri, body):
+        parsed = urlparse(uri)
+        params = {key: values for key, values in parse_qs(parsed.query).items()}
+        path = unquote(parsed.path)
+        match = re.match(r'^(?:/gmail/v1)?/users/[^/]+/(.*)$', path)
+        if not match:
+            return 404, self._error(404, f"Unknown path {path}")
+        route = match.group(1)
+
+        if route == 'profile':
+            return self._profile()
+        if route == 'messages' and method == 'GET':
+            return self._list(params)
+        if route == 'messages/send':
+            return self._send(body)
+        if route == 'messages/batchModify':
+            return self._batch_modify(body)
+        if route.startswith('messages/') and method == 'GET':
+            return self._get(route.split('/', 1)[1], params)
+        if route == 'history':
+            return self._history(params)
+        if route == 'labels':
+            return self._labels()
+        if route.startswith('labels/'):
+            return self._label(route.split('/', 1)[1])
+        return 404, self._error(404, f"Unsupported route {method} {route}")
+
+    @staticmethod
+    def _error(code, message):
+        return {'error': {'code': code, 'message': message, 'errors': [{'reason': 'notFound'}]}}
+
+    def _count(self, name):
+        with self.mailbox.lock:
+            self.calls[name] += 1
+
+    def _profile(self):
+        self._count('users.getProfile')
+        return 200, {'emailAddress': 'benchmark@example.com',
+                     'historyId': str(self.mailbox.history_id)}
+
+    def _list(self, params):
+        self._count('users.messages.list')
+        labels = params.get('labelIds', [])
+        query = params.get('q', [''])[0]
+        max_results = min(int(params.get('maxResults', [PAGE_SIZE_DEFAULT])[0]), 500)
+        offset = int(params.get('pageToken', ['0'])[0])
+
+        matched = []
+        seen = 0
+        for message_id in self.mailbox.iter_ids():
+            message = self.mailbox.get(message_id)
+            if message is None or not self.mailbox.matches(message, labels, query):
+                continue
+            if seen >= offset:
+                matched.append({'id': message['id'], 'threadId': message['threadId']})
+                if len(matched) > max_results:
+                    break
+            seen += 1
+
+        result = {'messages': matched[:max_results], 'resultSizeEstimate': len(matched)}
+        if len(matched) > max_results:
+            result['nextPageToken'] = str(offset + max_results)
+        if not result['messages']:
+            del result['messages']
+        return 200, result
+
+    def _get(self, message_id, params):
+        self._count('users.messages.get')
+        message = self.mailbox.get(message_id)
+        if message is None:
+            return 404, self._error(404, 'Requested entity was not found.')
+        fmt = params.get('format', ['full'])[0]
+        headers = [
+            {'name': 'From', 'value': message['from']},
+            {'name': 'To', 'value': 'benchmark@example.com'},
+            {'name': 'Subject', 'value': message['subject']},
+            {'name': 'Date', 'value': message['date']},
+        ]
+        resource = {
+            'id': message['id'],
+            'threadId': message['threadId'],
+            'labelIds': message['labelIds'],
+            'snippet': message['body'][:100],
+            'historyId': str(self.mailbox.history_id),
+            'internalDate': message['internalDate'],
+            'sizeEstimate': len(message['body']) + 500,
+        }
+        if fmt == 'metadata':
+            wanted = {h.lower() for h in params.get('metadataHeaders', [])}
+            resource['payload'] = {
+                'mimeType': 'text/plain',
+                'headers': [h for h in headers if not wanted or h['name'].lower() in wanted],
+            }
+        elif fmt != 'minimal':
+            data = base64.urlsafe_b64encode(message['body'].encode('utf-8')).decode('ascii')
+            resource['payload'] = {
+                'partId': '',
+                'mimeType': 'text/plain',
+                'headers': headers + [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                'body': {'size': len(message['body']), 'data': data},
+            }
+        return 200, resource
+
+    def _history(self, params):
+        self._count('users.history.list')
+        start = int(params.get('startHistoryId', ['0'])[0])
+        with self.mailbox.lock:
+            if start < 1000:
+                return 404, self._error(404, 'Requested entity was not found.')
+            records = [record for record in self.mailbox.history if int(record['id']) > start]
+            return 200, {'history': records, 'historyId': str(self.mailbox.history_id)}
+
+    def _label(self, label_id):
+        self._count('users.labels.get')
+        total = unread = 0
+        for message_id in self.mailbox.iter_ids():
+            message = self.mailbox.get(message_id)
+            if message is None or label_id not in message['labelIds']:
+                continue
+            total += 1
+            unread += 'UNREAD' in message['labelIds']
+        return 200, {'id': label_id, 'name': label_id,
+                     'messagesTotal': total, 'messagesUnread': unread}
+
+    def _labels(self):
+        self._count('users.labels.list')
+        return 200, {'labels': [{'id': label, 'name': label, 'type': 'system'}
+                                for label in SYSTEM_LABELS]}
+
+    def _batch_modify(self, body):
+        self._count('users.messages.batchModify')
+        payload = json.loads(body or '{}')
+        if len(payload.get('ids', [])) > 1000:
+            return 400, self._error(400, 'Too many ids')
+        for message_id in payload.get('ids', []):
+            self.mailbox.modify(message_id, payload.get('addLabelIds', []),
+                                payload.get('removeLabelIds', []))
+        return 204, ''
+
+    def _send(self, body):
+        self._count('users.messages.send')
+        payload = json.loads(body or '{}')
+        raw = base64.urlsafe_b64decode(payload.get('raw', '') + '===')
+        sent = email.message_from_bytes(raw)
+        message_id = self.mailbox.add_message(
+            'benchmark@example.com', sent.get('subject', ''), sent.get_payload() or '',
+            labels=('SENT',))
+        return 200, {'id': message_id, 'threadId': message_id, 'labelIds': ['SENT']}
+
+
+def fake_service(http):
+    """Build a real Gmail API client whose transport is a FakeGmailHttp"""
+    return build('gmail', 'v1', http=http, static_discovery=True, cache_discovery=False)
+
+
+class FakeCredentials:
+    """Stand-in for OAuth credentials that never expire, for an AccountPool"""
+    valid = True
+    expiry = None
+    refresh_token = None
@@ -0,0 +1,256 @@
+# ==================== FILE 13: benchmarks/run_benchmarks.py ====================
+"""
+Offline latency benchmarks for the Gmail tools and the agent loop
+Runs check_gmail_inbox, search_gmail, read_email_content and run_agent
+against the fake Gmail backend and a scripted chat model, and reports
+p50/p95 latency, Gmail API call counts and peak memory per scenario.
+
+Run from the project root:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10 1000 --iterations 10 --latency-ms 20
+    python benchmarks/run_benchmarks.py --max-p95-ms 2000 --json results.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+# The LLM is scripted; the key only satisfies client construction
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder-key")
+# Scenarios warm caches explicitly; a background worker would blur cold runs
+os.environ.setdefault("PREFETCH_ENABLED", "0")
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+ACCOUNT = "benchmark@example.com"
+
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def set_gmail_quota(units_per_second):
+    """Resize the shared Gmail rate limiter (None lifts it)"""
+    from gmail_quota import default_quota
+
+    # A huge bucket never blocks, so only the code under test is timed
+    units = units_per_second or 1e9
+    default_quota.units_per_second = units
+    default_quota.capacity = units
+
+
+class Harness:
+    """One fake mailbox plus the agent core wired to it"""
+
+    def __init__(self, core, size, latency_ms, llm_latency_ms, workdir):
+        from fake_gmail import FakeCredentials, FakeGmailHttp, FakeMailbox, fake_service
+        from gmail_accounts import AccountPool, TokenStore
+        from plan_cache import PlanCache
+        from scripted_llm import ScriptedChatModel, text, tool_call, tool_calls
+
+        self.core = core
+        self.context = None
+        self.size = size
+        self.workdir = tempfile.mkdtemp(prefix=f"size-{size}-", dir=workdir)
+        self.mailbox = FakeMailbox(size)
+        self.calls = Counter()
+        self._sessions = 0
+
+        def service():
+            return fake_service(FakeGmailHttp(self.mailbox, latency_ms, self.calls))
+        self.service = service
+
+        self.llm = ScriptedChatModel(
+            script=[
+                tool_calls(tool_call('check_gmail_inbox', max_results=20),
+                           tool_call('get_unread_count')),
+                text("You have 20 recent emails in your inbox and some unread mail."),
+            ],
+            latency_ms=llm_latency_ms,
+        )
+        self.tools = [core.check_gmail_inbox, core.send_gmail, core.search_gmail,
+                      core.get_unread_count, core.read_email_content, core.bulk_modify_emails]
+
+        # Tool calls borrow pooled clients, as with a real account
+        self.accounts = AccountPool(TokenStore(os.path.join(self.workdir, "tokens")),
+                                    lambda creds: service())
+        self.accounts.add(ACCOUNT, FakeCredentials(), persist=False)
+        core.get_account_pool = lambda: self.accounts
+        self.plans = PlanCache()
+        core.get_plan_cache = lambda: self.plans
+        core.create_gmail_agent = lambda: (self.llm, self.tools, "You are a Gmail assistant.")
+
+    def new_session(self):
+        """Start a new conversation so the next call starts with a cold cache"""
+        self._sessions += 1
+        self.core.MAILBOX_CACHE_PATH = os.path.join(self.workdir, f"cache-{self._sessions}.db")
+        self.context = self.core.AgentContext(ACCOUNT)
+        self.plans.clear()
+        self.llm.reset()
+
+    def session(self):
+        """Make the current conversation the one tools work for"""
+        return self.core.use_context(self.context)
+
+    def api_calls(self):
+        return sum(self.calls.values())
+
+
+def inbox(h):
+    return h.core.check_gmail_inbox.invoke({"max_results": 50})
+
+
+def search(h):
+    return h.core.search_gmail.invoke({"query": "subject:invoice", "max_results": 20})
+
+
+def search_refined(h):
+    return h.core.search_gmail.invoke({"query": "subject:invoice is:unread", "max_results": 20})
+
+
+def search_deep(h):
+    return h.core.search_gmail.invoke({"query": "subject:invoice", "max_results": 1000})
+
+
+def read(h):
+    return h.core.read_email_content.invoke({"email_number": 3})
+
+
+def bulk_archive(h):
+    return h.core.bulk_modify_emails.invoke(
+        {"action": "archive", "query": "subject:newsletter", "dry_run": False})
+
+
+def prefetch(h):
+    """One synchronous pass of the background warm-up worker"""
+    from prefetch import PrefetchWorker
+    worker = PrefetchWorker(h.core.get_mailbox_cache(), h.core.get_body_cache(), h.service)
+    worker.warm(h.service())
+
+
+def agent(h):
+    h.llm.reset()
+    return h.core.run_agent("Check my inbox and count unread emails", [], h.context)
+
+
+def routed(h):
+    return h.core.run_agent("Check my inbox", [], h.context)
+
+
+# name -> (setup steps run untimed after a fresh session, timed step)
+SCENARIOS = {
+    "inbox_cold": ([], inbox),
+    "inbox_warm": ([inbox], inbox),
+    "search_cold": ([], search),
+    "search_warm": ([search], search),
+    "search_refined": ([search_deep], search_refined),
+    "search_deep": ([], search_deep),
+    "read_cold": ([inbox], read),
+    "read_warm": ([inbox, read], read),
+    "read_prefetched": ([inbox, prefetch], read),
+    "bulk_archive": ([], bulk_archive),
+    "agent_turn": ([], agent),
+    "agent_repeat": ([agent], agent),
+    "routed_turn": ([inbox], routed),
+}
+
+
+def run_scenario(h, setup, step, iterations):
+    latencies, calls = [], []
+    for _ in range(iterations):
+        h.new_session()
+        with h.session():
+            for prepare in setup:
+                prepare(h)
+            before = h.api_calls()
+            start = time.perf_counter()
+            result = step(h)
+            latencies.append((time.perf_counter() - start) * 1000)
+        calls.append(h.api_calls() - before)
+        if isinstance(result, str) and result.startswith("❌"):
+            raise RuntimeError(result)
+
+    # One extra untimed pass for peak memory; tracemalloc slows everything down
+    h.new_session()
+    with h.session():
+        for prepare in setup:
+            prepare(h)
+        tracemalloc.start()
+        step(h)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "api_calls": percentile(calls, 0.50),
+        "peak_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="mailbox sizes to benchmark")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=10,
+                        help="latency injected per Gmail HTTP round trip")
+    parser.add_argument("--llm-latency-ms", type=float, default=0,
+                        help="latency injected per scripted LLM call")
+    parser.add_argument("--gmail-quota", type=float,
+                        help="Gmail quota units per second to enforce (default: unthrottled; "
+                             "the real per-user limit is 250)")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--max-p95-ms", type=float,
+                        help="exit non-zero if any scenario's p95 exceeds this")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    import agent_core
+    set_gmail_quota(args.gmail_quota)
+
+    workdir = tempfile.mkdtemp(prefix="gmail-bench-")
+    results = []
+    try:
+        print(f"{'size':>7}  {'scenario':<12} {'p50 ms':>9} {'p95 ms':>9} {'api calls':>9} {'peak KB':>9}")
+        for size in args.sizes:
+            h = Harness(agent_core, size, args.latency_ms, args.llm_latency_ms, workdir)
+            for name in args.scenarios:
+                setup, step = SCENARIOS[name]
+                row = {"size": size, "scenario": name,
+                       **run_scenario(h, setup, step, args.iterations)}
+                results.append(row)
+                print(f"{size:>7}  {name:<12} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+                      f"{row['api_calls']:>9} {row['peak_kb']:>9.0f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_p95_ms is not None:
+        slow = [row for row in results if row["p95_ms"] > args.max_p95_ms]
+        for row in slow:
+            print(f"❌ {row['scenario']} at {row['size']} messages: "
+                  f"p95 {row['p95_ms']:.1f} ms > {args.max_p95_ms} ms")
+        sys.exit(1 if slow else 0)
+
+
+if __name__ == "__main__":
+    main()
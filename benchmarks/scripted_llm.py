@@ -0,0 +1,106 @@
+# ==================== FILE 12: benchmarks/scripted_llm.py ====================
+"""
+Deterministic chat model for offline benchmarks
+Replays a fixed script of responses (tool calls or text) instead of
+calling Gemini, with optional injected latency.
+"""
+
+import json
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def tool_call(name, **args):
+    """Script step: ask for one tool call"""
+    return {'tool_calls': [{'name': name, 'args': args}]}
+
+
+def tool_calls(*calls):
+    """Script step: ask for several tool calls in one response"""
+    return {'tool_calls': [call['tool_calls'][0] for call in calls]}
+
+
+def text(content):
+    """Script step: answer in text"""
+    return {'text': content}
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model that cycles through a script of responses
+
+    Each step is a dict from tool_call/tool_calls/text. The script
+    restarts from the top after the last step.
+    """
+
+    script: List[dict]
+    latency_ms: float = 0
+    position: int = 0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def reset(self):
+        self.position = 0
+
+    def _next_step(self):
+        step = self.script[self.position % len(self.script)]
+        self.position += 1
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return step
+
+    @staticmethod
+    def _usage(messages, content):
+        prompt_chars = sum(len(str(message.content)) for message in messages)
+        return {
+            'input_tokens': prompt_chars // 4,
+            'output_tokens': len(content) // 4,
+            'total_tokens': (prompt_chars + len(content)) // 4,
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        step = self._next_step()
+        content = step.get('text', '')
+        message = AIMessage(
+            content=content,
+            tool_calls=[
+                {'name': call['name'], 'args': call['args'], 'id': f"call_{self.calls}_{i}"}
+                for i, call in enumerate(step.get('tool_calls', []))
+            ],
+            usage_metadata=self._usage(messages, content),
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        step = self._next_step()
+        content = step.get('text', '')
+        words = content.split(' ') if content else []
+        for i, word in enumerate(words):
+            separator = ' ' if i < len(words) - 1 else ''
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + separator))
+        if step.get('tool_calls'):
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content='',
+                tool_call_chunks=[
+                    {'name': call['name'], 'args': json.dumps(call['args']),
+                     'id': f"call_{self.calls}_{i}", 'index': i}
+                    for i, call in enumerate(step['tool_calls'])
+                ],
+            ))
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content='', usage_metadata=self._usage(messages, content)))
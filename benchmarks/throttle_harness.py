@@ -0,0 +1,185 @@
+# ==================== FILE 9: benchmarks/throttle_harness.py ====================
+"""
+Throttling harness for the Gmail quota wrapper
+Replays 429 / 5xx / Retry-After responses through HttpMockSequence and
+checks the retry, backoff and accounting behaviour of gmail_quota,
+without a Google account or network access and without real sleeping.
+
+Run from the project root:
+    python benchmarks/throttle_harness.py
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+from gmail_fetch import fetch_message_metadata
+from gmail_quota import GmailQuota
+
+BOUNDARY = "batch_harness"
+
+
+class FakeClock:
+    """Clock and sleep pair so backoff and rate limiting cost no wall time"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_quota(**kwargs):
+    clock = FakeClock()
+    return GmailQuota(sleep=clock.sleep, clock=clock.clock, **kwargs), clock
+
+
+def service_for(responses):
+    return build('gmail', 'v1', http=HttpMockSequence(responses),
+                 static_discovery=True, cache_discovery=False)
+
+
+def error(status, reason, retry_after=None):
+    headers = {'status': str(status), 'content-type': 'application/json'}
+    if retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    body = {'error': {'code': status, 'message': reason,
+                      'errors': [{'reason': reason, 'message': reason}]}}
+    return headers, json.dumps(body)
+
+
+def ok(body):
+    return {'status': '200', 'content-type': 'application/json'}, json.dumps(body)
+
+
+def batch_response(parts):
+    """Build a multipart batch response from (request_id, status, body) tuples"""
+    chunks = []
+    for request_id, status, body in parts:
+        chunks.append(
+            f"--{BOUNDARY}\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-harness + {request_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n"
+            f"{json.dumps(body)}\r\n"
+        )
+    chunks.append(f"--{BOUNDARY}--")
+    headers = {'status': '200', 'content-type': f'multipart/mixed; boundary="{BOUNDARY}"'}
+    return headers, "".join(chunks)
+
+
+def scenario_retry_after():
+    quota, clock = make_quota()
+    service = service_for([
+        error(429, 'rateLimitExceeded', retry_after=3),
+        error(503, 'backendError'),
+        ok({'emailAddress': 'me@example.com', 'historyId': '1'}),
+    ])
+    profile = quota.execute(service.users().getProfile(userId='me'))
+    stats = quota.stats()['gmail.users.getProfile']
+    assert profile['emailAddress'] == 'me@example.com'
+    assert stats == {'calls': 3, 'units': 3, 'retries': 2, 'errors': 0, 'throttled': 1}, stats
+    assert clock.sleeps[0] >= 3, "Retry-After must be respected"
+    return f"429 + 503 then 200: recovered after sleeps {[round(s, 2) for s in clock.sleeps]}"
+
+
+def scenario_send_not_retried_on_5xx():
+    quota, _ = make_quota()
+    service = service_for([error(503, 'backendError'), ok({'id': 'never'})])
+    try:
+        quota.execute(service.users().messages().send(userId='me', body={'raw': ''}),
+                      idempotent=False)
+    except HttpError as e:
+        assert e.resp.status == 503
+    else:
+        raise AssertionError("send must not be retried after an ambiguous 5xx")
+    stats = quota.stats()['gmail.users.messages.send']
+    assert stats['calls'] == 1 and stats['errors'] == 1, stats
+    return "send + 503: surfaced without retry (no duplicate send)"
+
+
+def scenario_send_retried_on_429():
+    quota, _ = make_quota()
+    service = service_for([error(429, 'userRateLimitExceeded'), ok({'id': 'sent-1'})])
+    sent = quota.execute(service.users().messages().send(userId='me', body={'raw': ''}),
+                         idempotent=False)
+    assert sent['id'] == 'sent-1'
+    return "send + 429: retried once and sent"
+
+
+def scenario_gives_up():
+    quota, _ = make_quota(max_retries=2)
+    service = service_for([error(500, 'backendError')] * 3)
+    try:
+        quota.execute(service.users().labels().get(userId='me', id='UNREAD'))
+    except HttpError:
+        pass
+    else:
+        raise AssertionError("expected the last error to be raised")
+    stats = quota.stats()['gmail.users.labels.get']
+    assert stats['calls'] == 3 and stats['retries'] == 2 and stats['errors'] == 1, stats
+    return "persistent 500: gave up after max_retries"
+
+
+def scenario_batch_item_throttled():
+    quota, _ = make_quota()
+    service = service_for([
+        batch_response([
+            (0, 200, {'id': 'a'}),
+            (1, 429, {'error': {'code': 429, 'message': 'rateLimitExceeded'}}),
+            (2, 404, {'error': {'code': 404, 'message': 'Not Found'}}),
+        ]),
+        batch_response([(1, 200, {'id': 'b'})]),
+    ])
+    results = fetch_message_metadata(service, ['a', 'b', 'c'], quota=quota)
+    assert results[0] == {'id': 'a'} and results[1] == {'id': 'b'}, results
+    assert 'error' in results[2]
+    stats = quota.stats()['gmail.users.messages.get']
+    assert stats['calls'] == 4 and stats['retries'] == 1 and stats['errors'] == 1, stats
+    return "batch with one 429 item: only that item re-sent; 404 reported per item"
+
+
+def scenario_token_bucket():
+    quota, clock = make_quota(units_per_second=250)
+    service = service_for([ok({'id': str(i)}) for i in range(10)])
+    for _ in range(10):
+        quota.execute(service.users().messages().send(userId='me', body={'raw': ''}),
+                      idempotent=False)
+    # 10 sends x 100 units, 250 in the bucket, refilled at 250 units/s
+    assert abs(clock.now - 3.0) < 1e-6, clock.now
+    return f"10 sends (1000 units): paced over {clock.now:.1f}s of simulated time"
+
+
+SCENARIOS = [
+    scenario_retry_after,
+    scenario_send_not_retried_on_5xx,
+    scenario_send_retried_on_429,
+    scenario_gives_up,
+    scenario_batch_item_throttled,
+    scenario_token_bucket,
+]
+
+
+def main():
+    failures = 0
+    for scenario in SCENARIOS:
+        try:
+            print(f"✅ {scenario.__name__}: {scenario()}")
+        except AssertionError as e:
+            failures += 1
+            print(f"❌ {scenario.__name__}: {e}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# ==================== FILE 6: chat_history.py ====================
+"""
+Token-budgeted chat history for the agent prompt
+Keeps recent turns verbatim and shrinks older ones so the prompt does
+not grow with every inbox listing in the session.
+"""
+
+DEFAULT_TOKEN_BUDGET = 4000
+DEFAULT_KEEP_TURNS = 3
+
+# Assistant messages containing this marker are never compacted
+SEND_CONFIRMATION_MARKER = "✅ **Email sent successfully!**"
+
+STUB_PREFIXES = {
+    "📧 **GMAIL INBOX**": "inbox listing",
+    "🔍 **Search Results**": "search results",
+    "📧 **Email #": "email content",
+    "📝 **Email Digest**": "email digest",
+    # Terse forms of listing and email records
+    "[inbox": "inbox listing",
+    "[search": "search results",
+    "[email #": "email content",
+}
+
+MAX_OLD_MESSAGE_CHARS = 200
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def compact_message(role, content):
+    """Return a short stand-in for an older message"""
+    if SEND_CONFIRMATION_MARKER in content or len(content) <= MAX_OLD_MESSAGE_CHARS:
+        return content
+
+    if role != "human":
+        first_line = (content.strip().splitlines() or [""])[0]
+        for prefix, kind in STUB_PREFIXES.items():
+            if first_line.startswith(prefix):
+                return f"[earlier {kind}: {first_line[:120]} — call the tool again for current data]"
+
+    return content[:MAX_OLD_MESSAGE_CHARS] + "… [truncated]"
+
+
+def compact_history(chat_history, token_budget=DEFAULT_TOKEN_BUDGET, keep_turns=DEFAULT_KEEP_TURNS):
+    """Fit chat history into a token budget
+
+    The last keep_turns user/assistant pairs are kept verbatim. Older
+    messages are replaced with compact stubs, and if that is still over
+    budget the oldest ones are folded into a one-line rolling summary.
+    Send confirmations are always kept.
+
+    Returns:
+        (history, stats) where history is a list of (role, content) and
+        stats has original_tokens and compacted_tokens
+    """
+    chat_history = list(chat_history)
+    original_tokens = sum(estimate_tokens(content) for _, content in chat_history)
+
+    split = max(0, len(chat_history) - keep_turns * 2)
+    older = [(role, compact_message(role, content)) for role, content in chat_history[:split]]
+    recent = chat_history[split:]
+
+    def total(messages):
+        return sum(estimate_tokens(content) for _, content in messages)
+
+    recent_tokens = total(recent)
+    dropped_requests = []
+    while older and total(older) + recent_tokens > token_budget:
+        # Drop the oldest message that is not a send confirmation
+        index = next(
+            (i for i, (_, content) in enumerate(older) if SEND_CONFIRMATION_MARKER not in content),
+            None
+        )
+        if index is None:
+            break
+        role, content = older.pop(index)
+        if role == "human":
+            dropped_requests.append(content[:60])
+
+    history = []
+    if dropped_requests:
+        summary = "; ".join(f"'{request}'" for request in dropped_requests)
+        history.append(("assistant", f"[Earlier in this conversation the user asked: {summary}]"))
+    history.extend(older)
+    history.extend(recent)
+
+    return history, {
+        "original_tokens": original_tokens,
+        "compacted_tokens": total(history),
+    }
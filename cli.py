@@ -0,0 +1,113 @@
+# ==================== FILE 24: cli.py ====================
+"""
+Gmail agent from the command line
+Runs the agent core without Streamlit: one question per invocation, or an
+interactive session when no message is given.
+
+    python cli.py --login                      # one-time browser login
+    python cli.py "How many unread emails do I have?"
+    python cli.py --account me@example.com     # interactive session
+    python cli.py --server-grant               # access key for server.py clients
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from agent_core import (TOKEN_DIR, AgentContext, connect_account, get_account_pool,
+                        run_agent_stream, run_oauth_flow)
+from records import append_part
+
+# Grants of the accounts logged in from this command line, by account
+CLI_GRANTS_PATH = os.getenv("CLI_GRANTS_PATH", os.path.join(TOKEN_DIR, "cli_grants.json"))
+
+
+def load_grants():
+    if not os.path.exists(CLI_GRANTS_PATH):
+        return {}
+    with open(CLI_GRANTS_PATH) as f:
+        return json.load(f)
+
+
+def save_grants(grants):
+    os.makedirs(os.path.dirname(CLI_GRANTS_PATH) or ".", mode=0o700, exist_ok=True)
+    with open(os.open(CLI_GRANTS_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(grants, f)
+
+
+def ask(context, history, message, show_timings=False):
+    """Stream one agent turn to stdout and record it in history"""
+    start = time.perf_counter()
+    parts = []
+    for kind, payload in run_agent_stream(message, history, context):
+        if kind == "progress":
+            sys.stderr.write(f"… {payload}\n")
+            continue
+        append_part(parts, payload)
+        sys.stdout.write(payload if kind == "text" else payload.to_markdown())
+        sys.stdout.flush()
+    sys.stdout.write("\n")
+    if show_timings:
+        sys.stderr.write(f"⏱️ {(time.perf_counter() - start) * 1000:.0f} ms\n")
+    history.append(("human", message))
+    history.append(("assistant", parts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ask the Gmail agent from the command line")
+    parser.add_argument("message", nargs="*", help="question to ask; omit for an interactive session")
+    parser.add_argument("--account",
+                        help="Gmail address to use (default: the only account logged in from here)")
+    parser.add_argument("--login", action="store_true",
+                        help="log in through the browser if no stored token is usable")
+    parser.add_argument("--server-grant", action="store_true",
+                        help="print a new access key for the account to send to server.py")
+    parser.add_argument("--timings", action="store_true", help="print how long each turn took")
+    args = parser.parse_args(argv)
+
+    grants = load_grants()
+    account = (args.account or "").strip().lower()
+    if not account and len(grants) == 1:
+        account = next(iter(grants))
+
+    context = AgentContext()
+    try:
+        account = connect_account(context, account, authorize=run_oauth_flow if args.login else None,
+                                  grant=grants.get(account))
+    except (PermissionError, FileNotFoundError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    if account is None:
+        print("❌ Login was cancelled", file=sys.stderr)
+        return 1
+    if grants.get(account) != context.grant:
+        grants[account] = context.grant
+        save_grants(grants)
+    print(f"✅ Connected as {context.user_email}", file=sys.stderr)
+
+    if args.server_grant:
+        print(get_account_pool().store.add_grant(account))
+        if not args.message:
+            return 0
+
+    history = []
+    if args.message:
+        ask(context, history, " ".join(args.message), args.timings)
+        return 0
+
+    while True:
+        try:
+            message = input("you> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return 0
+        if message in ("exit", "quit"):
+            return 0
+        if message:
+            ask(context, history, message, args.timings)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,364 @@
+# ==================== FILE 21: gmail_accounts.py ====================
+"""
+Per-account Gmail credentials and clients
+Tokens are stored one file per account, a background thread refreshes
+access tokens before they expire, and Gmail clients are pooled per
+account so every thread borrows a client of its own (httplib2 clients
+are not thread-safe).
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import re
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from metrics import registry
+
+DEFAULT_TOKEN_DIR = 'tokens'
+
+# Access tokens are renewed this long before they expire
+REFRESH_MARGIN_SECONDS = 300
+REFRESH_CHECK_SECONDS = 60
+
+# Idle clients kept per account for reuse
+MAX_IDLE_CLIENTS = 8
+
+# Grants expire this long after the login that issued them
+GRANT_TTL_SECONDS = 30 * 86400
+
+
+def normalize_account(account):
+    return account.strip().lower()
+
+
+def account_file(path, account):
+    """Per-account variant of a file path: mailbox_cache.db -> mailbox_cache.<account>.db"""
+    root, ext = os.path.splitext(path)
+    name = re.sub(r'[^\w.@+-]', '_', normalize_account(account))
+    return f"{root}.{name}{ext}"
+
+
+def seconds_to_expiry(creds):
+    """Seconds until the access token expires, or None if it has no expiry"""
+    expiry = getattr(creds, 'expiry', None)
+    if expiry is None:
+        return None
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds()
+
+
+_grants_lock = threading.Lock()
+
+
+def _grant_hash(secret):
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+class TokenStore:
+    """OAuth tokens on disk, one pickle per account
+
+    A stored token is only handed to callers that show a grant: a secret
+    issued when they completed the OAuth flow themselves. Only hashes of
+    the grants are kept on disk, each with the time it expires.
+
+    Args:
+        directory: Directory holding the token and grant files
+        grant_ttl: Seconds a grant stays valid after it is issued
+    """
+
+    def __init__(self, directory=DEFAULT_TOKEN_DIR, grant_ttl=GRANT_TTL_SECONDS):
+        self.directory = directory
+        self.grant_ttl = grant_ttl
+
+    def path(self, account):
+        return account_file(os.path.join(self.directory, 'token.pickle'), account)
+
+    def load(self, account):
+        path = self.path(account)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as token:
+            return pickle.load(token)
+
+    def save(self, account, creds):
+        self._write(self.path(account), pickle.dumps(creds))
+
+    def _write(self, path, data):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # Write then rename, so a concurrent load never sees half a file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as token:
+            token.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, account):
+        for path in (self.path(account), self.grants_path(account)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ---------- grants ----------
+    def grants_path(self, account):
+        return account_file(os.path.join(self.directory, 'grants.json'), account)
+
+    def _grants(self, account):
+        """Live grants of the account as {hash: expires_at}; expired ones are pruned"""
+        path = self.grants_path(account)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as grants:
+            stored = json.load(grants)
+        if isinstance(stored, list):
+            # Written before grants expired: give them a full term from now
+            stored = dict.fromkeys(stored, time.time() + self.grant_ttl)
+        now = time.time()
+        live = {digest: expires_at for digest, expires_at in stored.items() if expires_at > now}
+        if live != stored:
+            self._save_grants(account, live)
+        return live
+
+    def _save_grants(self, account, grants):
+        self._write(self.grants_path(account), json.dumps(grants).encode())
+
+    def add_grant(self, account):
+        """Issue a new grant for the account and return its secret"""
+        secret = secrets.token_urlsafe(32)
+        with _grants_lock:
+            grants = self._grants(account)
+            grants[_grant_hash(secret)] = time.time() + self.grant_ttl
+            self._save_grants(account, grants)
+        return secret
+
+    def check_grant(self, account, secret):
+        """Whether secret is a live grant for the account"""
+        if not secret:
+            return False
+        digest = _grant_hash(secret)
+        with _grants_lock:
+            return any(hmac.compare_digest(digest, grant) for grant in self._grants(account))
+
+    def count_grants(self, account):
+        """Number of live grants of the account"""
+        with _grants_lock:
+            return len(self._grants(account))
+
+    def revoke_grant(self, account, secret):
+        """Withdraw a grant; returns how many live grants the account has left"""
+        digest = _grant_hash(secret or '')
+        with _grants_lock:
+            grants = {grant: expires_at for grant, expires_at in self._grants(account).items()
+                      if not hmac.compare_digest(digest, grant)}
+            self._save_grants(account, grants)
+        return len(grants)
+
+    def accounts(self):
+        """Accounts with a stored token"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[len('token.'):-len('.pickle')] for name in os.listdir(self.directory)
+            if name.startswith('token.') and name.endswith('.pickle')
+        )
+
+
+class AccountPool:
+    """Credentials and Gmail clients for every connected account
+
+    Each account has one Credentials object shared by all of its clients,
+    so a refresh by the background thread reaches every client at once.
+
+    Args:
+        store: TokenStore holding the accounts' tokens
+        service_factory: Callable(creds) building a new Gmail client
+        refresh_margin: Renew access tokens this many seconds before expiry
+        check_interval: Seconds between expiry checks
+    """
+
+    def __init__(self, store, service_factory, refresh_margin=REFRESH_MARGIN_SECONDS,
+                 check_interval=REFRESH_CHECK_SECONDS):
+        self.store = store
+        self.service_factory = service_factory
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._credentials = {}
+        self._idle = defaultdict(list)
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._refresh_locks = defaultdict(threading.Lock)
+        self._thread_clients = threading.local()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- accounts ----------
+    def add(self, account, creds, persist=True):
+        """Register an account's credentials, replacing any earlier ones"""
+        account = normalize_account(account)
+        with self._lock:
+            if self._credentials.get(account) is not creds:
+                self._credentials[account] = creds
+                self._idle.pop(account, None)
+            self._errors.pop(account, None)
+        if persist:
+            self.store.save(account, creds)
+        return account
+
+    def credentials(self, account):
+        """The account's credentials, loaded from the token store on first use"""
+        account = normalize_account(account)
+        with self._lock:
+            creds = self._credentials.get(account)
+        if creds is None:
+            creds = self.store.load(account)
+            if creds is None:
+                return None
+            with self._lock:
+                creds = self._credentials.setdefault(account, creds)
+        return creds
+
+    def remove(self, account):
+        """Forget an account and delete its stored token"""
+        account = normalize_account(account)
+        with self._lock:
+            self._credentials.pop(account, None)
+            self._idle.pop(account, None)
+            self._errors.pop(account, None)
+        self.store.delete(account)
+
+    def accounts(self):
+        with self._lock:
+            connected = set(self._credentials)
+        return sorted(connected | set(self.store.accounts()))
+
+    def error(self, account):
+        """The last refresh failure for the account, if its token is unusable"""
+        return self._errors.get(normalize_account(account))
+
+    # ---------- tokens ----------
+    def refresh(self, account, force=False):
+        """Renew the account's access token if it expires within the margin
+
+        Concurrent callers wait for one refresh instead of each making one.
+
+        Raises:
+            google.auth.exceptions.RefreshError: when the refresh token was
+                revoked or expired; the account then needs a new login
+        """
+        account = normalize_account(account)
+        creds = self.credentials(account)
+        if creds is None:
+            raise KeyError(f"No credentials for {account}")
+        with self._lock:
+            refresh_lock = self._refresh_locks[account]
+        with refresh_lock:
+            remaining = seconds_to_expiry(creds)
+            due = not creds.valid or (remaining is not None and remaining < self.refresh_margin)
+            if not (force or due):
+                return creds
+            try:
+                # Deferred: pulls in requests, which most imports never need
+                from google.auth.transport.requests import Request
+                with registry.timer("gmail", "auth.refresh"):
+                    creds.refresh(Request())
+            except Exception as e:
+                self._errors[account] = str(e)
+                raise
+            self._errors.pop(account, None)
+            self.store.save(account, creds)
+        return creds
+
+    def refresh_due(self):
+        """Refresh every account whose token is close to expiry
+
+        Returns:
+            (refreshed, failed) account lists
+        """
+        refreshed, failed = [], []
+        with self._lock:
+            pool = list(self._credentials.items())
+        for account, creds in pool:
+            if account in self._errors or not getattr(creds, 'refresh_token', None):
+                continue
+            remaining = seconds_to_expiry(creds)
+            if creds.valid and (remaining is None or remaining >= self.refresh_margin):
+                continue
+            try:
+                self.refresh(account)
+                refreshed.append(account)
+            except Exception:
+                failed.append(account)
+        return refreshed, failed
+
+    def start(self):
+        """Start the background refresher"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.refresh_due()
+            except Exception:
+                pass
+
+    # ---------- clients ----------
+    def _usable_credentials(self, account):
+        creds = self.credentials(account)
+        if creds is None:
+            raise KeyError(f"No credentials for {account}")
+        # Normally the refresher got there first; this only runs after a stall
+        if not creds.valid and getattr(creds, 'refresh_token', None):
+            creds = self.refresh(account)
+        return creds
+
+    def new_client(self, account):
+        """A Gmail client of the caller's own, e.g. for a long-lived worker thread"""
+        return self.service_factory(self._usable_credentials(account))
+
+    @contextmanager
+    def client(self, account):
+        """Borrow a Gmail client for the duration of a with block"""
+        account = normalize_account(account)
+        creds = self._usable_credentials(account)
+        with self._lock:
+            idle = self._idle[account]
+            service = idle.pop() if idle else None
+        if service is None:
+            service = self.service_factory(creds)
+        try:
+            yield service
+        finally:
+            with self._lock:
+                # Clients of a replaced or removed login are dropped
+                if self._credentials.get(account) is creds and len(self._idle[account]) < MAX_IDLE_CLIENTS:
+                    self._idle[account].append(service)
+
+    def thread_client(self, account):
+        """A Gmail client private to the calling thread"""
+        account = normalize_account(account)
+        creds = self._usable_credentials(account)
+        clients = getattr(self._thread_clients, 'clients', None)
+        if clients is None:
+            clients = self._thread_clients.clients = {}
+        entry = clients.get(account)
+        if entry is None or entry[0] is not creds:
+            entry = clients[account] = (creds, self.service_factory(creds))
+        return entry[1]
+
+    def status(self, account):
+        creds = self.credentials(account)
+        return {
+            'expires_in': seconds_to_expiry(creds) if creds else None,
+            'error': self.error(account),
+        }
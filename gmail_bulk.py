@@ -0,0 +1,139 @@
+# ==================== FILE 15: gmail_bulk.py ====================
+"""
+Bulk label changes
+Applies one label change to many messages with users().messages().batchModify,
+up to 1000 ids per call, and reports chunks that failed instead of
+stopping at the first error.
+"""
+
+import re
+
+from gmail_quota import execute
+
+# batchModify accepts at most 1000 ids per call
+BATCH_MODIFY_LIMIT = 1000
+
+# Named actions as (labels to add, labels to remove)
+ACTIONS = {
+    'archive': ([], ['INBOX']),
+    'move_to_inbox': (['INBOX'], []),
+    'mark_read': ([], ['UNREAD']),
+    'mark_unread': (['UNREAD'], []),
+    'star': (['STARRED'], []),
+    'unstar': ([], ['STARRED']),
+    'mark_important': (['IMPORTANT'], []),
+    'mark_not_important': ([], ['IMPORTANT']),
+}
+
+# Actions that take a user label name
+LABEL_ACTIONS = ('add_label', 'remove_label')
+
+# Search terms for messages still missing a system label
+MISSING_LABEL_TERMS = {
+    'INBOX': '-in:inbox',
+    'UNREAD': '-is:unread',
+    'STARRED': '-is:starred',
+    'IMPORTANT': '-is:important',
+}
+
+
+def resolve_label(service, name):
+    """Return the id of a label given its name or id (case-insensitive)
+
+    Raises:
+        ValueError: if the mailbox has no such label
+    """
+    labels = execute(service.users().labels().list(
+        userId='me', fields='labels(id,name)')).get('labels', [])
+    wanted = name.strip().lower()
+    for label in labels:
+        if label['id'].lower() == wanted or label['name'].lower() == wanted:
+            return label['id']
+    raise ValueError(f"No label named '{name}'")
+
+
+def label_changes(service, action, label=None):
+    """Translate an action into (add_label_ids, remove_label_ids)
+
+    Raises:
+        ValueError: for an unknown action or label
+    """
+    if action in ACTIONS:
+        return ACTIONS[action]
+    if action in LABEL_ACTIONS:
+        if not label:
+            raise ValueError(f"'{action}' needs a label name")
+        label_id = resolve_label(service, label)
+        return ([label_id], []) if action == 'add_label' else ([], [label_id])
+    raise ValueError(
+        f"Unknown action '{action}'. Use one of: {', '.join([*ACTIONS, *LABEL_ACTIONS])}")
+
+
+def pending_selection(query, add_label_ids=(), remove_label_ids=(), label_name=None):
+    """Narrow a search to the messages a label change would still alter
+
+    Messages the change was already applied to are left out, so a run
+    stopped by a limit continues with the rest when repeated.
+
+    Args:
+        query: Gmail search query selecting the messages
+        add_label_ids: Label ids the change adds
+        remove_label_ids: Label ids the change removes
+        label_name: Name of the user label among add_label_ids, if any
+
+    Returns:
+        (query, label_ids) to list the messages with
+    """
+    terms = []
+    for label_id in add_label_ids:
+        term = MISSING_LABEL_TERMS.get(label_id)
+        if term is None:
+            # Gmail searches user labels by name, with spaces and slashes as dashes
+            term = '-label:' + re.sub(r'[\s/]+', '-', (label_name or label_id).strip().lower())
+        terms.append(term)
+    if terms:
+        if re.search(r'\bOR\b|[{}]', query):
+            query = f"({query})"
+        query = ' '.join([query, *terms])
+    return query, list(remove_label_ids)
+
+
+def batch_modify(service, message_ids, add_label_ids=(), remove_label_ids=(),
+                 chunk_size=BATCH_MODIFY_LIMIT, progress=None):
+    """Apply a label change to many messages
+
+    Args:
+        service: Authenticated Gmail API service
+        message_ids: Message ids to change
+        add_label_ids: Label ids to add
+        remove_label_ids: Label ids to remove
+        chunk_size: Ids per batchModify call (max 1000)
+        progress: Optional callback(done, total) called after each chunk
+
+    Returns:
+        (modified, failures) where modified is the number of messages
+        changed and failures is a list of (message_count, error) for
+        chunks that failed after retries.
+    """
+    message_ids = list(message_ids)
+    modified = 0
+    failures = []
+
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        try:
+            execute(service.users().messages().batchModify(
+                userId='me',
+                body={
+                    'ids': chunk,
+                    'addLabelIds': list(add_label_ids),
+                    'removeLabelIds': list(remove_label_ids),
+                }
+            ))
+            modified += len(chunk)
+        except Exception as e:
+            failures.append((len(chunk), str(e)))
+        if progress:
+            progress(min(start + chunk_size, len(message_ids)), len(message_ids))
+
+    return modified, failures
@@ -0,0 +1,160 @@
+# ==================== FILE 2: gmail_fetch.py ====================
+"""
+Shared Gmail metadata fetch layer
+Sends per-message lookups as Gmail batch requests instead of one
+blocking HTTPS round trip per message, and walks messages().list
+pages lazily.
+"""
+
+from gmail_quota import execute, is_rate_limited, is_retryable, quota_for, quota_units
+from metrics import count_response_bytes
+
+GET_METHOD = 'gmail.users.messages.get'
+
+# Gmail accepts up to 100 calls per batch, but recommends 50 or fewer
+# to stay clear of per-user concurrency limits.
+BATCH_SIZE = 50
+
+# Full messages carry bodies, so fewer go in each batch
+FULL_BATCH_SIZE = 20
+
+METADATA_HEADERS = ['From', 'Subject', 'Date']
+
+# Partial-response field masks, so Gmail only sends what is used
+LIST_FIELDS = 'messages/id,nextPageToken'
+METADATA_FIELDS = 'id,threadId,labelIds,snippet,internalDate,payload/headers'
+FULL_FIELDS = 'id,threadId,labelIds,snippet,internalDate,payload'
+PROFILE_FIELDS = 'emailAddress,historyId'
+HISTORY_FIELDS = ('history(messagesAdded/message(id,labelIds),messagesDeleted/message/id,'
+                  'labelsAdded(message/id,labelIds),labelsRemoved(message/id,labelIds)),'
+                  'historyId,nextPageToken')
+
+# messages().list returns at most 500 ids per page
+LIST_PAGE_SIZE = 500
+
+
+def get_header(headers, name, default):
+    """Return the value of a header from a Gmail payload header list"""
+    return next((h['value'] for h in headers if h['name'] == name), default)
+
+
+def fetch_message_metadata(service, message_ids, metadata_headers=None, batch_size=BATCH_SIZE,
+                           progress=None, quota=None):
+    """Fetch metadata for many messages using Gmail batch requests
+
+    Args:
+        service: Authenticated Gmail API service
+        message_ids: Message ids to look up
+        metadata_headers: Headers to include (default From, Subject, Date)
+        batch_size: Number of lookups per batch request (max 100)
+        progress: Optional callback(done, total) called after each batch
+        quota: GmailQuota to run under (default: the account's own)
+
+    Returns:
+        A list in the same order as message_ids. Each item is the Gmail
+        message resource, or {'id': ..., 'error': ...} if that single
+        lookup failed.
+    """
+    return fetch_messages(service, message_ids, format='metadata', batch_size=batch_size,
+                          progress=progress, quota=quota,
+                          metadataHeaders=metadata_headers or METADATA_HEADERS,
+                          fields=METADATA_FIELDS)
+
+
+def fetch_full_messages(service, message_ids, batch_size=FULL_BATCH_SIZE, progress=None, quota=None):
+    """Fetch complete messages (headers and inline bodies) using Gmail batch requests
+
+    Same return value as fetch_message_metadata.
+    """
+    return fetch_messages(service, message_ids, format='full', batch_size=batch_size,
+                          progress=progress, quota=quota, fields=FULL_FIELDS)
+
+
+def fetch_messages(service, message_ids, format='metadata', batch_size=BATCH_SIZE,
+                   progress=None, quota=None, **get_args):
+    """Run messages().get for many ids as batch requests
+
+    Throttled or 5xx items inside a batch are retried in a smaller batch.
+    get_args are passed to every messages().get call.
+    """
+    message_ids = list(message_ids)
+    quota = quota or quota_for(getattr(service, '_http', None))
+    results = [None] * len(message_ids)
+
+    for start in range(0, len(message_ids), batch_size):
+        pending = list(range(start, min(start + batch_size, len(message_ids))))
+
+        for attempt in range(quota.max_retries + 1):
+            retry = []
+
+            def on_response(request_id, response, exception):
+                index = int(request_id)
+                if exception is None:
+                    results[index] = response
+                elif is_retryable(exception) and attempt < quota.max_retries:
+                    retry.append((index, exception))
+                else:
+                    quota.record(GET_METHOD, errors=1, throttled=int(is_rate_limited(exception)))
+                    results[index] = {'id': message_ids[index], 'error': str(exception)}
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for index in pending:
+                request = service.users().messages().get(
+                    userId='me',
+                    id=message_ids[index],
+                    format=format,
+                    **get_args
+                )
+                batch.add(count_response_bytes(request, GET_METHOD), request_id=str(index))
+            quota.call(batch.execute, GET_METHOD, quota_units(GET_METHOD) * len(pending),
+                       calls=len(pending))
+
+            if not retry:
+                break
+            throttled = sum(is_rate_limited(error) for _, error in retry)
+            quota.record(GET_METHOD, retries=len(retry), throttled=throttled)
+            quota.pause(attempt, retry[0][1])
+            pending = [index for index, _ in retry]
+
+        if progress:
+            progress(min(start + batch_size, len(message_ids)), len(message_ids))
+
+    return results
+
+
+def iter_message_pages(service, query=None, label_ids=None, limit=None, page_size=LIST_PAGE_SIZE):
+    """Yield message ids one messages().list page at a time
+
+    The next page is only requested once the caller has consumed the
+    previous one, so callers can stop early and never hold more than
+    a page of ids.
+
+    Args:
+        service: Authenticated Gmail API service
+        query: Gmail search query
+        label_ids: Only list messages carrying all of these labels
+        limit: Stop after this many ids (default: no limit)
+        page_size: Ids per page (max 500)
+
+    Yields:
+        Non-empty lists of message ids, newest first
+    """
+    remaining = limit
+    page_token = None
+    while remaining is None or remaining > 0:
+        results = execute(service.users().messages().list(
+            userId='me',
+            q=query,
+            labelIds=label_ids,
+            maxResults=page_size if remaining is None else min(page_size, remaining),
+            pageToken=page_token,
+            fields=LIST_FIELDS
+        ))
+        message_ids = [msg['id'] for msg in results.get('messages', [])]
+        if message_ids:
+            yield message_ids
+        if remaining is not None:
+            remaining -= len(message_ids)
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
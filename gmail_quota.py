@@ -0,0 +1,195 @@
+# ==================== FILE 8: gmail_quota.py ====================
+"""
+Quota-aware execution wrapper for Gmail API calls
+Token-bucket rate limiting by Gmail quota units, exponential backoff with
+jitter on retryable errors, Retry-After support and per-method accounting.
+"""
+
+import random
+import socket
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+from googleapiclient.errors import HttpError
+
+from metrics import count_response_bytes, registry
+
+# Quota units per method, from the Gmail API usage limits page
+QUOTA_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.labels.get': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.attachments.get': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.send': 100,
+    'gmail.users.watch': 100,
+}
+DEFAULT_UNITS = 5
+
+# Per-user limit is 250 quota units per second (moving average)
+USER_UNITS_PER_SECOND = 250
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def quota_units(method_id):
+    return QUOTA_UNITS.get(method_id, DEFAULT_UNITS)
+
+
+def is_rate_limited(error):
+    """True if Gmail rejected the call for quota reasons, so it was not applied"""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        reasons = {detail.get('reason') for detail in (error.error_details or [])
+                   if isinstance(detail, dict)}
+        return bool(reasons & RATE_LIMIT_REASONS) or 'rate limit' in str(error).lower()
+    return False
+
+
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or is_rate_limited(error)
+    return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def retry_after_seconds(error):
+    """Seconds requested by a Retry-After header, if any"""
+    if not isinstance(error, HttpError):
+        return None
+    value = error.resp.get('retry-after')
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class GmailQuota:
+    """Token bucket over Gmail quota units plus retry policy and accounting"""
+
+    def __init__(self, units_per_second=USER_UNITS_PER_SECOND, burst=None, max_retries=5,
+                 base_delay=1.0, max_delay=32.0, sleep=time.sleep, clock=time.monotonic):
+        self.units_per_second = units_per_second
+        self.capacity = burst or units_per_second
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {
+            'calls': 0, 'units': 0, 'retries': 0, 'errors': 0, 'throttled': 0
+        })
+
+    # ---------- rate limiting ----------
+    def acquire(self, units):
+        """Block until the bucket holds enough quota units, then spend them"""
+        units = min(units, self.capacity)
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.units_per_second)
+                self._updated = now
+                # Small tolerance so float rounding after a sleep cannot loop forever
+                if self._tokens >= units - 1e-9:
+                    self._tokens -= units
+                    return
+                wait = (units - self._tokens) / self.units_per_second
+            self._sleep(wait)
+
+    def backoff_delay(self, attempt, error=None):
+        """Exponential backoff with full jitter, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        requested = retry_after_seconds(error)
+        return max(delay, requested) if requested is not None else delay
+
+    def pause(self, attempt, error=None):
+        """Sleep before retry number attempt + 1"""
+        self._sleep(self.backoff_delay(attempt, error))
+
+    # ---------- accounting ----------
+    def record(self, method_id, calls=0, units=0, retries=0, errors=0, throttled=0):
+        with self._lock:
+            entry = self._stats[method_id]
+            entry['calls'] += calls
+            entry['units'] += units
+            entry['retries'] += retries
+            entry['errors'] += errors
+            entry['throttled'] += throttled
+
+    def stats(self):
+        """Per-method counters: calls, units, retries, errors, throttled"""
+        with self._lock:
+            return {method: dict(entry) for method, entry in self._stats.items()}
+
+    # ---------- execution ----------
+    def call(self, fn, method_id, units, idempotent=True, calls=1):
+        """Run fn() under the rate limit, retrying retryable failures
+
+        Non-idempotent calls (e.g. send) are only retried when Gmail
+        rejected them for rate limiting, since a 5xx may mean the call
+        was applied anyway. calls is the number of API calls fn() makes,
+        for batches.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(units)
+            self.record(method_id, calls=calls, units=units)
+            try:
+                with registry.timer("gmail", method_id):
+                    return fn()
+            except Exception as e:
+                throttled = is_rate_limited(e)
+                retry = is_retryable(e) and (idempotent or throttled)
+                if not retry or attempt == self.max_retries:
+                    self.record(method_id, errors=1, throttled=int(throttled))
+                    raise
+                self.record(method_id, retries=1, throttled=int(throttled))
+                self.pause(attempt, e)
+
+    def execute(self, request, idempotent=True):
+        """Execute a googleapiclient HttpRequest under the quota policy"""
+        method_id = getattr(request, 'methodId', None) or 'unknown'
+        count_response_bytes(request, method_id)
+        return self.call(request.execute, method_id, quota_units(method_id), idempotent)
+
+
+# Used by calls that carry no credentials of their own
+default_quota = GmailQuota()
+
+# The quota is per user, so each account's credentials get their own bucket
+_account_quotas = weakref.WeakKeyDictionary()
+_account_quotas_lock = threading.Lock()
+
+
+def account_quota(credentials):
+    """The GmailQuota of the account these credentials belong to"""
+    if credentials is None:
+        return default_quota
+    with _account_quotas_lock:
+        quota = _account_quotas.get(credentials)
+        if quota is None:
+            quota = _account_quotas[credentials] = GmailQuota()
+    return quota
+
+
+def quota_for(http):
+    """The GmailQuota for requests made through an authorized http"""
+    return account_quota(getattr(http, 'credentials', None))
+
+
+def execute(request, idempotent=True, quota=None):
+    """Execute a Gmail API request with rate limiting, retries and accounting"""
+    quota = quota or quota_for(getattr(request, 'http', None))
+    return quota.execute(request, idempotent=idempotent)
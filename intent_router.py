@@ -0,0 +1,73 @@
+# ==================== FILE 7: intent_router.py ====================
+"""
+Deterministic intent router
+Maps quick actions and unambiguous typed commands straight to a tool
+call, so they skip the Gemini round trip. Anything else returns None
+and goes to the LLM as usual.
+"""
+
+import re
+
+_INBOX = r"(?:my\s+)?(?:inbox|emails|mails?|messages)"
+
+
+def _inbox(match):
+    count = match.groupdict().get("count")
+    args = {"max_results": int(count)} if count else {}
+    return "check_gmail_inbox", args
+
+
+def _read(match):
+    return "read_email_content", {"email_number": int(match.group("number"))}
+
+
+def _unread_count(match):
+    return "get_unread_count", {}
+
+
+def _search_unread(match):
+    return "search_gmail", {"query": "is:unread"}
+
+
+# Patterns are matched against the whole normalized command, so extra
+# words ("...from John about the meeting") fall through to the LLM
+ROUTES = [
+    (rf"(?:check|show|open|view|list)\s+(?:me\s+)?{_INBOX}", _inbox),
+    (r"(?:check|show|list)\s+(?:me\s+)?(?:my\s+)?(?:the\s+)?(?:last|latest|recent|top)\s+"
+     r"(?P<count>\d+)\s+(?:emails|mails|messages)", _inbox),
+    (r"(?:read|open|show)\s+(?:me\s+)?(?:email|mail|message)\s+(?:number\s+|no\.?\s*|#)?(?P<number>\d+)",
+     _read),
+    (r"how\s+many\s+unread(?:\s+(?:emails|mails|messages))?(?:\s+do\s+i\s+have)?", _unread_count),
+    (r"(?:unread\s+count|count\s+(?:my\s+)?unread(?:\s+(?:emails|mails|messages))?)", _unread_count),
+    (r"(?:search|find|show)\s+(?:for\s+)?(?:me\s+)?(?:my\s+)?unread(?:\s+(?:emails|mails|messages))?",
+     _search_unread),
+]
+
+_COMPILED = [(re.compile(pattern), handler) for pattern, handler in ROUTES]
+
+
+def normalize(text):
+    """Lowercase, drop polite filler and trailing punctuation"""
+    text = text.strip().lower()
+    text = re.sub(r"[?!.]+$", "", text)
+    text = re.sub(r"^(?:please\s+|can\s+you\s+|could\s+you\s+)+", "", text)
+    text = re.sub(r"\s+please$", "", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def route(text, max_results=None):
+    """Return (tool_name, args) for a high-confidence command, else None
+
+    Args:
+        text: The user's message
+        max_results: Cap for listing sizes, the same as the listing tools use
+    """
+    command = normalize(text)
+    for pattern, handler in _COMPILED:
+        match = pattern.fullmatch(command)
+        if match:
+            tool_name, args = handler(match)
+            if max_results is not None and "max_results" in args:
+                args["max_results"] = min(args["max_results"], max_results)
+            return tool_name, args
+    return None
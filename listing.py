@@ -0,0 +1,72 @@
+# ==================== FILE 14: listing.py ====================
+"""
+Bounded aggregation for long email listings
+Lists the first messages in full and folds the rest into counts, top
+senders and a date range, so a listing of tens of thousands of messages
+uses fixed memory and reaches the LLM as a short summary.
+"""
+
+from collections import Counter
+from datetime import datetime, timezone
+
+from records import EmailList, EmailRow
+
+# Messages listed individually; the remainder is only summarized
+DISPLAY_LIMIT = 50
+
+TOP_SENDERS = 5
+
+
+def format_day(internal_date):
+    """Gmail internalDate (ms since the epoch) as YYYY-MM-DD"""
+    return datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+class ListingAggregate:
+    """Running summary of a message listing fed one page at a time"""
+
+    def __init__(self, display_limit=DISPLAY_LIMIT):
+        self.display_limit = display_limit
+        self.rows = []
+        self.total = 0
+        self.unread = 0
+        self.errors = 0
+        self.senders = Counter()
+        self.oldest = None
+        self.newest = None
+
+    def add(self, messages):
+        """Add cached message dicts, or {'id': ..., 'error': ...} for failed lookups"""
+        for message in messages:
+            self.total += 1
+            if len(self.rows) < self.display_limit:
+                self.rows.append(message)
+            if 'error' in message:
+                self.errors += 1
+                continue
+            self.unread += 'UNREAD' in message['labels']
+            self.senders[message['from']] += 1
+            internal_date = message.get('internal_date')
+            if internal_date:
+                self.oldest = internal_date if self.oldest is None else min(self.oldest, internal_date)
+                self.newest = internal_date if self.newest is None else max(self.newest, internal_date)
+
+    def progress(self):
+        """One-line running status for the UI"""
+        return f"{self.total} messages so far · {self.unread} unread"
+
+    def record(self, kind, query=''):
+        """The listing as an EmailList: the first rows in full, a summary of the rest"""
+        rows = tuple(
+            EmailRow(number, message['id'], error=message['error']) if 'error' in message else
+            EmailRow(number, message['id'], message['from'], message['subject'], message['date'],
+                     message.get('internal_date') or 0, 'UNREAD' in message['labels'])
+            for number, message in enumerate(self.rows, 1)
+        )
+        return EmailList(
+            kind, query, rows, self.total, self.unread,
+            oldest=format_day(self.oldest) if self.oldest is not None else '',
+            newest=format_day(self.newest) if self.newest is not None else '',
+            top_senders=tuple(self.senders.most_common(TOP_SENDERS)),
+            errors=self.errors,
+        )
@@ -0,0 +1,577 @@
+# ==================== FILE 3: mailbox_cache.py ====================
+"""
+Persistent local mailbox cache
+Keeps inbox message headers, labels and bodies in SQLite and catches up
+with users().history().list() instead of re-listing the mailbox. An FTS5
+index over the cached messages answers searches whose results the cache
+is known to hold in full.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from gmail_fetch import (HISTORY_FIELDS, LIST_FIELDS, PROFILE_FIELDS, fetch_message_metadata,
+                         get_header)
+from gmail_quota import execute
+from search_query import normalize_query, parse_query
+
+DEFAULT_CACHE_PATH = 'mailbox_cache.db'
+
+# Number of most recent inbox messages pulled in by a full sync
+FULL_SYNC_LIMIT = 500
+
+# Syncs that retry a failed metadata lookup before it is given up
+PENDING_FETCH_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    internal_date INTEGER,
+    label_ids TEXT,
+    sender TEXT,
+    subject TEXT,
+    date TEXT,
+    snippet TEXT,
+    body TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (internal_date DESC);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS pending_fetch (
+    id TEXT PRIMARY KEY,
+    attempts INTEGER
+);
+CREATE TABLE IF NOT EXISTS search_coverage (
+    query TEXT PRIMARY KEY,
+    tokens TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS search_results (
+    query TEXT,
+    position INTEGER,
+    message_id TEXT,
+    PRIMARY KEY (query, position)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    message_id TEXT,
+    content_hash TEXT,
+    summary TEXT,
+    needs_reply INTEGER,
+    PRIMARY KEY (message_id, content_hash)
+);
+"""
+
+# External-content index kept in step with the messages table by triggers,
+# so every fetched header and downloaded body is searchable immediately
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    sender, subject, snippet, body, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, sender, subject, snippet, body)
+    VALUES (new.rowid, new.sender, new.subject, new.snippet, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet, body)
+    VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update
+AFTER UPDATE OF sender, subject, snippet, body ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, sender, subject, snippet, body)
+    VALUES ('delete', old.rowid, old.sender, old.subject, old.snippet, old.body);
+    INSERT INTO messages_fts (rowid, sender, subject, snippet, body)
+    VALUES (new.rowid, new.sender, new.subject, new.snippet, new.body);
+END;
+"""
+
+# Number of complete server search results kept for local reuse
+SEARCH_COVERAGE_LIMIT = 50
+
+
+class MailboxCache:
+    """SQLite-backed copy of the mailbox kept current with Gmail history
+
+    Args:
+        path: SQLite database file
+        on_delete: Optional callback(message_ids) run when history deletes
+            messages, to evict copies kept outside the cache
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, on_delete=None):
+        self.path = path
+        self.on_delete = on_delete
+        self._lock = threading.RLock()
+        # Held for a whole sync so only one runs at a time; _lock is only
+        # taken around the local reads and writes, never across API calls
+        self._sync_lock = threading.RLock()
+        # Bumped by clear() so a sync in flight does not write its results back
+        self._generation = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(SCHEMA)
+            self.fts = self._create_index()
+
+    def _create_index(self):
+        """Create the search index; False if SQLite was built without FTS5"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError:
+            return False
+        if not exists:
+            # Index messages cached before the index existed
+            with self._conn:
+                self._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        return True
+
+    # ---------- state ----------
+    def _get_state(self, key):
+        row = self._conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, str(value))
+        )
+
+    def history_id(self):
+        """Gmail history id the cache was last synced to, or None"""
+        with self._lock:
+            return self._get_state('history_id')
+
+    # ---------- sync ----------
+    def sync(self, service, progress=None):
+        """Bring the cache up to date
+
+        Args:
+            service: Authenticated Gmail API service
+            progress: Optional callback(done, total) for metadata fetches
+
+        Returns:
+            'full' after a full sync, 'delta' if history changes were applied,
+            or 'none' if nothing changed since the last sync.
+        """
+        with self._sync_lock:
+            history_id = self.history_id()
+            if history_id is None:
+                self.full_sync(service, progress)
+                return 'full'
+            try:
+                changed = self._apply_history(service, history_id, progress)
+            except HttpError as e:
+                # Gmail returns 404 once the start history id has expired
+                if e.resp.status != 404:
+                    raise
+                self.full_sync(service, progress)
+                return 'full'
+            return 'delta' if changed else 'none'
+
+    def full_sync(self, service, progress=None):
+        """Discard the cache and reload the most recent inbox messages"""
+        with self._sync_lock:
+            generation = self._generation
+            # Read the history id first so changes made while listing are replayed
+            profile = execute(service.users().getProfile(userId='me', fields=PROFILE_FIELDS))
+
+            message_ids = []
+            page_token = None
+            while len(message_ids) < FULL_SYNC_LIMIT:
+                results = execute(service.users().messages().list(
+                    userId='me',
+                    labelIds=['INBOX'],
+                    maxResults=min(500, FULL_SYNC_LIMIT - len(message_ids)),
+                    pageToken=page_token,
+                    fields=LIST_FIELDS
+                ))
+                message_ids.extend(msg['id'] for msg in results.get('messages', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+
+            details = fetch_message_metadata(service, message_ids, progress=progress)
+
+            with self._lock, self._conn:
+                if self._generation != generation:
+                    return
+                self._conn.execute('DELETE FROM messages')
+                self._conn.execute('DELETE FROM pending_fetch')
+                self._store(details)
+                self._retry_failed(details)
+                self._set_state('history_id', profile['historyId'])
+                self._conn.execute("DELETE FROM state WHERE key = 'unread_count'")
+                self._clear_searches()
+
+                # The cache holds every inbox message from this date on, so
+                # inbox searches bounded to that range can be answered locally
+                self._conn.execute("DELETE FROM state WHERE key = 'inbox_since'")
+                if not any('error' in message for message in details):
+                    since = 0 if not page_token else min(
+                        (int(message.get('internalDate', 0)) for message in details), default=0)
+                    self._set_state('inbox_since', since)
+
+    def _apply_history(self, service, start_history_id, progress=None):
+        """Replay history records since start_history_id; return True if anything changed"""
+        to_fetch = set()
+        added = set()
+        deleted = set()
+        label_changes = []
+        latest_history_id = start_history_id
+        page_token = None
+
+        while True:
+            results = execute(service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                pageToken=page_token,
+                fields=HISTORY_FIELDS
+            ))
+            latest_history_id = results.get('historyId', latest_history_id)
+
+            for record in results.get('history', []):
+                for new in record.get('messagesAdded', []):
+                    added.add(new['message']['id'])
+                    if 'INBOX' in new['message'].get('labelIds', []):
+                        to_fetch.add(new['message']['id'])
+                for removed in record.get('messagesDeleted', []):
+                    deleted.add(removed['message']['id'])
+                for change in record.get('labelsAdded', []):
+                    label_changes.append((change['message']['id'], change.get('labelIds', []), []))
+                for change in record.get('labelsRemoved', []):
+                    label_changes.append((change['message']['id'], [], change.get('labelIds', [])))
+
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+        # Messages outside the inbox are not cached, but still change the
+        # unread count and can match stored searches
+        changed = bool(added or deleted or label_changes)
+
+        with self._lock:
+            # Lookups that failed on an earlier sync; history will not list them again
+            to_fetch.update(row['id'] for row in self._conn.execute('SELECT id FROM pending_fetch'))
+            for msg_id, added_labels, _ in label_changes:
+                # Message moved into the inbox that we have not cached yet
+                if 'INBOX' in added_labels and not self._conn.execute(
+                        'SELECT 1 FROM messages WHERE id = ?', (msg_id,)).fetchone():
+                    to_fetch.add(msg_id)
+        to_fetch -= deleted
+        details = []
+        if to_fetch:
+            details = fetch_message_metadata(service, sorted(to_fetch), progress=progress)
+
+        with self._lock, self._conn:
+            # clear() ran while the changes were being fetched
+            if self._get_state('history_id') != start_history_id:
+                return False
+
+            for msg_id, added_labels, removed_labels in label_changes:
+                row = self._conn.execute(
+                    'SELECT label_ids FROM messages WHERE id = ?', (msg_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                labels = [l for l in json.loads(row['label_ids']) if l not in removed_labels]
+                labels.extend(l for l in added_labels if l not in labels)
+                self._conn.execute(
+                    'UPDATE messages SET label_ids = ? WHERE id = ?', (json.dumps(labels), msg_id)
+                )
+
+            self._store(details)
+            self._retry_failed(details)
+            changed = changed or any('error' not in message for message in details)
+            for msg_id in deleted:
+                self._conn.execute('DELETE FROM messages WHERE id = ?', (msg_id,))
+                self._conn.execute('DELETE FROM pending_fetch WHERE id = ?', (msg_id,))
+
+            self._set_state('history_id', latest_history_id)
+            if changed:
+                self._conn.execute("DELETE FROM state WHERE key = 'unread_count'")
+                self._clear_searches()
+
+        if deleted and self.on_delete:
+            self.on_delete(sorted(deleted))
+        return changed
+
+    # ---------- storage ----------
+    def _store(self, messages):
+        for message in messages:
+            if 'error' in message:
+                continue
+            headers = message.get('payload', {}).get('headers', [])
+            self._conn.execute(
+                """INSERT INTO messages
+                   (id, thread_id, internal_date, label_ids, sender, subject, date, snippet)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(id) DO UPDATE SET
+                       thread_id = excluded.thread_id,
+                       internal_date = excluded.internal_date,
+                       label_ids = excluded.label_ids,
+                       sender = excluded.sender,
+                       subject = excluded.subject,
+                       date = excluded.date,
+                       snippet = excluded.snippet""",
+                (
+                    message['id'],
+                    message.get('threadId'),
+                    int(message.get('internalDate', 0)),
+                    json.dumps(message.get('labelIds', [])),
+                    get_header(headers, 'From', 'Unknown'),
+                    get_header(headers, 'Subject', 'No Subject'),
+                    get_header(headers, 'Date', 'Unknown'),
+                    message.get('snippet', '')
+                )
+            )
+
+    def _retry_failed(self, messages):
+        """Queue failed lookups for the next sync and drop the ones that succeeded"""
+        self._conn.executemany(
+            'DELETE FROM pending_fetch WHERE id = ?',
+            [(message['id'],) for message in messages if 'error' not in message]
+        )
+        self._conn.executemany(
+            """INSERT INTO pending_fetch (id, attempts) VALUES (?, 1)
+               ON CONFLICT(id) DO UPDATE SET attempts = attempts + 1""",
+            [(message['id'],) for message in messages if 'error' in message]
+        )
+        given_up = self._conn.execute(
+            'DELETE FROM pending_fetch WHERE attempts >= ?', (PENDING_FETCH_ATTEMPTS,)).rowcount
+        if given_up:
+            # Those messages stay missing, so the inbox is no longer known to be complete
+            self._conn.execute("DELETE FROM state WHERE key = 'inbox_since'")
+
+    def store_messages(self, messages):
+        """Add or refresh metadata message resources fetched elsewhere"""
+        with self._lock, self._conn:
+            self._store(messages)
+
+    @staticmethod
+    def _row_to_dict(row):
+        return {
+            'id': row['id'],
+            'thread_id': row['thread_id'],
+            'internal_date': row['internal_date'],
+            'labels': json.loads(row['label_ids']),
+            'from': row['sender'],
+            'subject': row['subject'],
+            'date': row['date'],
+            'snippet': row['snippet'],
+        }
+
+    # ---------- reads ----------
+    def list_messages(self, label='INBOX', limit=10):
+        """Return cached messages carrying a label, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT * FROM messages WHERE label_ids LIKE ?
+                   ORDER BY internal_date DESC LIMIT ?""",
+                (f'%"{label}"%', limit)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def list_inbox(self, limit):
+        """Newest inbox messages, or None if the cache may be missing some of them
+
+        The cache holds every inbox message from inbox_since on. Once mail
+        leaves the inbox, fewer than limit messages may be left in that
+        range while older inbox mail was never fetched.
+        """
+        with self._lock:
+            since = self._get_state('inbox_since')
+            pending = self._conn.execute('SELECT 1 FROM pending_fetch LIMIT 1').fetchone()
+            if since is None or pending:
+                return None
+            rows = self._conn.execute(
+                """SELECT * FROM messages WHERE label_ids LIKE '%"INBOX"%' AND internal_date >= ?
+                   ORDER BY internal_date DESC LIMIT ?""",
+                (int(since), limit)
+            ).fetchall()
+        if len(rows) < limit and int(since) != 0:
+            return None
+        return [self._row_to_dict(row) for row in rows]
+
+    def get_messages(self, message_ids):
+        """Return cached messages by id as a dict; ids not cached are left out"""
+        message_ids = list(message_ids)
+        if not message_ids:
+            return {}
+        with self._lock:
+            placeholders = ','.join('?' * len(message_ids))
+            rows = self._conn.execute(
+                f'SELECT * FROM messages WHERE id IN ({placeholders})', message_ids
+            ).fetchall()
+        return {row['id']: self._row_to_dict(row) for row in rows}
+
+    def get_body(self, message_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body FROM messages WHERE id = ?', (message_id,)
+            ).fetchone()
+        return row['body'] if row else None
+
+    def set_body(self, message_id, body):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE messages SET body = ? WHERE id = ?', (body, message_id))
+
+    def get_unread_count(self):
+        with self._lock:
+            value = self._get_state('unread_count')
+        return int(value) if value is not None else None
+
+    def set_unread_count(self, count):
+        with self._lock, self._conn:
+            self._set_state('unread_count', count)
+
+    # ---------- summaries ----------
+    def get_summaries(self, keys):
+        """Cached summaries for (message_id, content_hash) pairs
+
+        Returns:
+            {message_id: {'summary': ..., 'needs_reply': bool}} for pairs
+            that are cached
+        """
+        found = {}
+        with self._lock:
+            for message_id, content_hash in keys:
+                row = self._conn.execute(
+                    'SELECT summary, needs_reply FROM summaries WHERE message_id = ? AND content_hash = ?',
+                    (message_id, content_hash)
+                ).fetchone()
+                if row:
+                    found[message_id] = {'summary': row['summary'], 'needs_reply': bool(row['needs_reply'])}
+        return found
+
+    def store_summaries(self, entries):
+        """Store (message_id, content_hash, summary, needs_reply) tuples"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """INSERT OR REPLACE INTO summaries (message_id, content_hash, summary, needs_reply)
+                   VALUES (?, ?, ?, ?)""",
+                [(message_id, content_hash, summary, int(needs_reply))
+                 for message_id, content_hash, summary, needs_reply in entries]
+            )
+
+    # ---------- local search ----------
+    def _clear_searches(self):
+        # Any mailbox change may alter a stored result set; searches are
+        # not limited to the inbox, so that includes mail added elsewhere
+        self._conn.execute('DELETE FROM search_coverage')
+        self._conn.execute('DELETE FROM search_results')
+
+    def record_search(self, query, message_ids):
+        """Remember the complete server result of a search, newest first
+
+        Until the mailbox changes, the same query is answered from these
+        ids, and so are refinements of it that only add operators the
+        local index can evaluate.
+        """
+        parsed = parse_query(query)
+        key = normalize_query(query)
+        # Results only stay valid while time cannot add matches: an older_than:
+        # window gains messages as they age, and a newer_than: one must be
+        # re-checked against the index whenever the result is reused
+        if 'older_than:' in key or ('newer_than:' in key and (parsed is None or not self.fts)):
+            return
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM search_results WHERE query = ?', (key,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO search_coverage (query, tokens, created_at) VALUES (?, ?, ?)',
+                (key, json.dumps(sorted(parsed.tokens)) if parsed else None, time.time())
+            )
+            self._conn.executemany(
+                'INSERT INTO search_results (query, position, message_id) VALUES (?, ?, ?)',
+                [(key, position, msg_id) for position, msg_id in enumerate(message_ids)]
+            )
+            stale = self._conn.execute(
+                'SELECT query FROM search_coverage ORDER BY created_at DESC LIMIT -1 OFFSET ?',
+                (SEARCH_COVERAGE_LIMIT,)
+            ).fetchall()
+            for row in stale:
+                self._conn.execute('DELETE FROM search_coverage WHERE query = ?', (row['query'],))
+                self._conn.execute('DELETE FROM search_results WHERE query = ?', (row['query'],))
+
+    def _covering_search(self, parsed):
+        """Stored search whose result set contains every match of parsed, or None
+
+        A stored search covers a query if the query only adds evaluable
+        operators to it; free-text terms must be the same, since Gmail
+        matches them against bodies the cache may not hold.
+        """
+        best = None
+        best_size = -1
+        for row in self._conn.execute(
+                'SELECT query, tokens FROM search_coverage WHERE tokens IS NOT NULL'):
+            tokens = set(json.loads(row['tokens']))
+            text_terms = {token for token in tokens if token.startswith('text:')}
+            if tokens <= parsed.tokens and text_terms == parsed.text_terms and len(tokens) > best_size:
+                best, best_size = row['query'], len(tokens)
+        return best
+
+    def search(self, query, limit):
+        """Answer a Gmail search locally when the cache is known to hold every match
+
+        Returns:
+            Matching message ids newest first, or None if the query has
+            to go to the Gmail API.
+        """
+        key = normalize_query(query)
+        parsed = parse_query(query) if self.fts else None
+        with self._lock:
+            if self._conn.execute(
+                    'SELECT 1 FROM search_coverage WHERE query = ?', (key,)).fetchone():
+                # Filters run again, so relative dates are measured from now
+                where, params = parsed.where() if parsed else ('1', [])
+                rows = self._conn.execute(
+                    f"""SELECT r.message_id FROM search_results r JOIN messages m ON m.id = r.message_id
+                        WHERE r.query = ? AND {where}
+                        ORDER BY r.position LIMIT ?""",
+                    [key, *params, limit]
+                ).fetchall()
+                return [row['message_id'] for row in rows]
+
+            if parsed is None:
+                return None
+            where, params = parsed.where()
+
+            covering = self._covering_search(parsed)
+            if covering is not None:
+                rows = self._conn.execute(
+                    f"""SELECT m.id FROM search_results r JOIN messages m ON m.id = r.message_id
+                        WHERE r.query = ? AND {where}
+                        ORDER BY m.internal_date DESC LIMIT ?""",
+                    [covering, *params, limit]
+                ).fetchall()
+                return [row['id'] for row in rows]
+
+            inbox_since = self._get_state('inbox_since')
+            pending = self._conn.execute('SELECT 1 FROM pending_fetch LIMIT 1').fetchone()
+            if (parsed.inbox and not parsed.text_terms and inbox_since is not None and not pending
+                    and (int(inbox_since) == 0 or (parsed.since_ms or 0) >= int(inbox_since))):
+                rows = self._conn.execute(
+                    f"""SELECT m.id FROM messages m WHERE {where}
+                        ORDER BY m.internal_date DESC LIMIT ?""",
+                    [*params, limit]
+                ).fetchall()
+                return [row['id'] for row in rows]
+
+        return None
+
+    def clear(self):
+        """Forget everything, e.g. on logout"""
+        with self._lock, self._conn:
+            self._generation += 1
+            self._conn.execute('DELETE FROM messages')
+            self._conn.execute('DELETE FROM pending_fetch')
+            self._conn.execute('DELETE FROM state')
+            self._conn.execute('DELETE FROM summaries')
+            self._clear_searches()
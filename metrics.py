@@ -0,0 +1,200 @@
+# ==================== FILE 10: metrics.py ====================
+"""
+Performance instrumentation
+Latency histograms, call counts, bytes received and LLM token usage for
+tools, Gmail API calls and LLM calls, exportable as JSON lines or
+Prometheus text.
+"""
+
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf)
+
+
+class Series:
+    """Counters and a latency histogram for one (kind, name) pair"""
+
+    __slots__ = ("kind", "name", "count", "errors", "total_ms", "bytes_received",
+                 "input_tokens", "output_tokens", "buckets")
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.bytes_received = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def observe(self, elapsed_ms, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.total_ms += elapsed_ms
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "bytes_received": self.bytes_received,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "buckets": {
+                ("+Inf" if math.isinf(bound) else str(bound)): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)
+            },
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe collection of Series keyed by (kind, name)"""
+
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name):
+        key = (kind, name)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = Series(kind, name)
+        return series
+
+    def observe(self, kind, name, elapsed_ms, error=False):
+        with self._lock:
+            self._get(kind, name).observe(elapsed_ms, error)
+
+    def add_bytes(self, kind, name, size):
+        with self._lock:
+            self._get(kind, name).bytes_received += size
+
+    def add_tokens(self, name, input_tokens=0, output_tokens=0):
+        with self._lock:
+            series = self._get("llm", name)
+            series.input_tokens += input_tokens
+            series.output_tokens += output_tokens
+
+    @contextmanager
+    def timer(self, kind, name):
+        """Time a block; exceptions are counted as errors and re-raised"""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(kind, name, (time.perf_counter() - start) * 1000, error)
+
+    def snapshot(self):
+        with self._lock:
+            return [series.to_dict() for _, series in sorted(self._series.items())]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    # ---------- export ----------
+    def to_jsonl(self):
+        """One JSON object per series, with a timestamp"""
+        now = time.time()
+        return "".join(json.dumps({"ts": now, **entry}) + "\n" for entry in self.snapshot())
+
+    def to_prometheus(self, prefix="gmail_agent"):
+        """Prometheus text exposition format"""
+        entries = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_latency_ms Call latency in milliseconds",
+            f"# TYPE {prefix}_latency_ms histogram",
+        ]
+        for entry in entries:
+            labels = f'kind="{entry["kind"]}",name="{entry["name"]}"'
+            cumulative = 0
+            for bound, count in entry["buckets"].items():
+                cumulative += count
+                lines.append(f'{prefix}_latency_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{prefix}_latency_ms_sum{{{labels}}} {entry['total_ms']}")
+            lines.append(f"{prefix}_latency_ms_count{{{labels}}} {entry['count']}")
+
+        counters = [
+            ("errors_total", "errors", "Failed calls"),
+            ("bytes_received_total", "bytes_received", "Response bytes received"),
+            ("llm_input_tokens_total", "input_tokens", "LLM prompt tokens"),
+            ("llm_output_tokens_total", "output_tokens", "LLM completion tokens"),
+        ]
+        for metric, field, help_text in counters:
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for entry in entries:
+                labels = f'kind="{entry["kind"]}",name="{entry["name"]}"'
+                lines.append(f"{prefix}_{metric}{{{labels}}} {entry[field]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def instrument_tool(fn):
+    """Record latency and call counts for a tool function (apply under @LazyTool)
+
+    Tools report failures as "❌ ..." strings, so those count as errors too.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = fn(*args, **kwargs)
+            error = isinstance(result, str) and result.startswith("❌")
+            return result
+        finally:
+            registry.observe("tool", fn.__name__, (time.perf_counter() - start) * 1000, error)
+    return wrapper
+
+
+def count_response_bytes(request, name):
+    """Record the raw response size of a googleapiclient HttpRequest
+
+    Wraps the request's postproc hook, which receives the undecoded body
+    for plain and batched requests alike.
+    """
+    postproc = getattr(request, 'postproc', None)
+    if postproc is None:
+        return request
+
+    def counting_postproc(resp, content):
+        registry.add_bytes("gmail", name, len(content or b""))
+        return postproc(resp, content)
+
+    request.postproc = counting_postproc
+    return request
@@ -0,0 +1,98 @@
+# ==================== FILE 18: mime_body.py ====================
+"""
+Readable body extraction from Gmail message payloads
+Walks the whole MIME tree, prefers text/plain over text/html, decodes only
+as much base64 as the character cap needs and honours each part's
+charset.
+"""
+
+import base64
+import codecs
+import html
+import re
+
+# Characters of body text kept per message
+DEFAULT_MAX_CHARS = 4000
+
+# HTML carries markup, so more of it is decoded to yield the same text
+HTML_EXPANSION = 8
+
+NO_CONTENT = "No readable content"
+
+_DROP_BLOCKS = re.compile(r'<(script|style|head|title)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_LINE_BREAKS = re.compile(r'<(?:br|/p|/div|/li|/tr|/h[1-6])\b[^>]*>', re.IGNORECASE)
+_TAGS = re.compile(r'<[^>]+>')
+_COMMENTS = re.compile(r'<!--.*?-->', re.DOTALL)
+
+
+def _header(part, name):
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+
+def _charset(part):
+    match = re.search(r'charset="?([\w.:-]+)"?', _header(part, 'Content-Type'), re.IGNORECASE)
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return charset
+
+
+def is_attachment(part):
+    return bool(part.get('filename')) or _header(part, 'Content-Disposition').lower().startswith('attachment')
+
+
+def decode_part(part, max_bytes):
+    """Decode at most max_bytes of a part's base64url body into text"""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return None
+    # Every 4 base64 characters hold 3 bytes
+    chunk = data[:(max_bytes + 2) // 3 * 4]
+    raw = base64.urlsafe_b64decode(chunk + '=' * (-len(chunk) % 4))
+    # A non-final incremental decode drops a multi-byte character cut by the cap
+    decoder = codecs.getincrementaldecoder(_charset(part))(errors='replace')
+    return decoder.decode(raw, final=len(chunk) == len(data))
+
+
+def html_to_text(markup):
+    """Cheap HTML to plain text: drop scripts and styles, strip tags, unescape"""
+    markup = _COMMENTS.sub('', markup)
+    markup = _DROP_BLOCKS.sub('', markup)
+    markup = _LINE_BREAKS.sub('\n', markup)
+    text = html.unescape(_TAGS.sub('', markup))
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def iter_parts(payload):
+    """Yield every part of the MIME tree, depth first in document order"""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        yield part
+        stack.extend(reversed(part.get('parts', [])))
+
+
+def extract_body(payload, max_chars=DEFAULT_MAX_CHARS):
+    """Return up to max_chars of readable text from a message payload
+
+    The first inline text/plain part wins; failing that, the first
+    text/html part is converted to text.
+    """
+    html_part = None
+    for part in iter_parts(payload):
+        if is_attachment(part) or not part.get('body', {}).get('data'):
+            continue
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type == 'text/plain':
+            return decode_part(part, max_chars * 4)[:max_chars]
+        if mime_type == 'text/html' and html_part is None:
+            html_part = part
+
+    if html_part is not None:
+        text = html_to_text(decode_part(html_part, max_chars * 4 * HTML_EXPANSION))
+        return text[:max_chars] or NO_CONTENT
+    return NO_CONTENT
@@ -0,0 +1,340 @@
+# ==================== FILE 16: outbox.py ====================
+"""
+Persistent outbox for bulk and templated sending
+Queued emails live in SQLite so they survive restarts, and a small pool
+of worker threads drains the queue at a fixed pace under Gmail's sending
+limits. Each email carries an idempotency key, so queueing the same
+email to the same recipient twice only sends it once.
+"""
+
+import base64
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from email.mime.text import MIMEText
+
+from gmail_quota import execute, is_rate_limited
+
+DEFAULT_OUTBOX_PATH = 'outbox.db'
+
+# Consumer Gmail accounts may send about 500 emails per rolling 24 hours
+DEFAULT_DAILY_LIMIT = 500
+DEFAULT_SENDS_PER_MINUTE = 20
+DEFAULT_WORKERS = 2
+
+# Rate-limited sends are rescheduled with exponential backoff
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+
+# How often idle workers look for newly due emails
+POLL_SECONDS = 5
+
+# Longest stop() waits for each thread to finish its send
+STOP_TIMEOUT_SECONDS = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT UNIQUE NOT NULL,
+    batch_id TEXT,
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    body TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    message_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (sent_at);
+"""
+
+
+def encode_message(to, subject, body):
+    """Raw base64url MIME message for users().messages().send()"""
+    message = MIMEText(body)
+    message['to'] = to
+    message['subject'] = subject
+    return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+
+
+def idempotency_key(to, subject, body):
+    return hashlib.sha256(f"{to.lower()}\0{subject}\0{body}".encode('utf-8')).hexdigest()
+
+
+# ---------- mail merge ----------
+class _Row(dict):
+    def __missing__(self, key):
+        raise ValueError(f"no '{key}' column for {self.get('email', 'a recipient')}")
+
+
+def upload_path(name, upload_dir):
+    """Resolve a file name inside upload_dir
+
+    Raises:
+        ValueError: if uploads are disabled or the name points outside upload_dir
+    """
+    if not upload_dir:
+        raise ValueError("reading recipient files is disabled; paste the CSV text instead")
+    root = os.path.realpath(upload_dir)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"no file '{name}' in the upload directory")
+    return path
+
+
+def parse_recipients(text, upload_dir=None):
+    """Parse CSV text with an 'email' column, a plain address list, or the
+    name of such a .csv file in upload_dir
+
+    Returns:
+        A list of dicts, each with at least an 'email' key
+
+    Raises:
+        ValueError: for a file name when upload_dir is not set or does not hold it
+    """
+    text = text.strip()
+    if text.lower().endswith('.csv') and '\n' not in text:
+        with open(upload_path(text, upload_dir), newline='', encoding='utf-8') as f:
+            text = f.read()
+
+    first_line = text.splitlines()[0] if text else ''
+    if 'email' in [column.strip().lower() for column in first_line.split(',')]:
+        rows = []
+        for row in csv.DictReader(io.StringIO(text)):
+            row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            if row.get('email'):
+                rows.append(row)
+        return rows
+
+    addresses = text.replace(';', ',').replace('\n', ',').split(',')
+    return [{'email': address.strip()} for address in addresses if address.strip()]
+
+
+def render_merge(rows, subject_template, body_template):
+    """Fill {column} placeholders for each recipient
+
+    Returns:
+        A list of (to, subject, body), one per distinct address
+
+    Raises:
+        ValueError: for an invalid address or a placeholder with no column
+    """
+    emails = []
+    seen = set()
+    for row in rows:
+        address = row['email']
+        if '@' not in address:
+            raise ValueError(f"invalid email address '{address}'")
+        if address.lower() in seen:
+            continue
+        seen.add(address.lower())
+        values = _Row(row)
+        emails.append((address, subject_template.format_map(values), body_template.format_map(values)))
+    return emails
+
+
+# ---------- queue ----------
+class Outbox:
+    """SQLite-backed queue of emails waiting to be sent"""
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            # A crash mid-send leaves no way to tell whether Gmail accepted
+            # the email, so those are failed rather than risk a duplicate
+            self._conn.execute(
+                """UPDATE outbox SET status = 'failed',
+                       last_error = 'interrupted while sending; not resent to avoid a duplicate'
+                   WHERE status = 'sending'"""
+            )
+
+    def enqueue(self, emails, batch_id=None):
+        """Queue (to, subject, body) emails
+
+        Returns:
+            (queued, duplicates): emails already in the outbox are skipped
+        """
+        queued = 0
+        now = time.time()
+        with self._lock, self._conn:
+            for to, subject, body in emails:
+                cursor = self._conn.execute(
+                    """INSERT OR IGNORE INTO outbox
+                       (idempotency_key, batch_id, recipient, subject, body, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (idempotency_key(to, subject, body), batch_id, to, subject, body, now)
+                )
+                queued += cursor.rowcount
+        return queued, len(emails) - queued
+
+    def has_ready(self, now=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM outbox WHERE status = 'queued' AND next_attempt_at <= ? LIMIT 1",
+                (now or time.time(),)
+            ).fetchone()
+        return row is not None
+
+    def claim(self, now=None):
+        """Mark the oldest due email as sending and return it, or None"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                """SELECT * FROM outbox WHERE status = 'queued' AND next_attempt_at <= ?
+                   ORDER BY id LIMIT 1""",
+                (now or time.time(),)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+                (row['id'],)
+            )
+        item = dict(row)
+        item['attempts'] += 1
+        return item
+
+    def mark_sent(self, item_id, message_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """UPDATE outbox SET status = 'sent', message_id = ?, sent_at = ?, last_error = NULL
+                   WHERE id = ?""",
+                (message_id, time.time(), item_id)
+            )
+
+    def mark_retry(self, item_id, error, delay):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """UPDATE outbox SET status = 'queued', last_error = ?, next_attempt_at = ?
+                   WHERE id = ?""",
+                (error, time.time() + delay, item_id)
+            )
+
+    def mark_failed(self, item_id, error):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, item_id)
+            )
+
+    def sent_since(self, since):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS n FROM outbox WHERE sent_at >= ?", (since,)
+            ).fetchone()
+        return row['n']
+
+    def stats(self):
+        """Counts by status plus sends in the last 10 minutes and 24 hours"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM outbox GROUP BY status"
+            ).fetchall()
+            last_error = self._conn.execute(
+                "SELECT last_error FROM outbox WHERE status = 'failed' ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        counts = {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+        counts.update({row['status']: row['n'] for row in rows})
+        counts['sent_last_10_min'] = self.sent_since(now - 600)
+        counts['sent_last_24_h'] = self.sent_since(now - 86400)
+        counts['last_error'] = last_error['last_error'] if last_error else None
+        return counts
+
+
+# ---------- workers ----------
+class OutboxWorker:
+    """Pool of threads draining an Outbox at a fixed pace
+
+    Args:
+        outbox: The Outbox to drain
+        service_factory: Callable returning a new Gmail service; each
+            thread builds its own, since httplib2 clients are not thread-safe
+        workers: Number of sending threads
+        sends_per_minute: Pace shared by all threads
+        daily_limit: Stop sending once this many went out in the last 24 hours
+    """
+
+    def __init__(self, outbox, service_factory, workers=DEFAULT_WORKERS,
+                 sends_per_minute=DEFAULT_SENDS_PER_MINUTE, daily_limit=DEFAULT_DAILY_LIMIT):
+        self.outbox = outbox
+        self.service_factory = service_factory
+        self.workers = workers
+        self.interval = 60.0 / sends_per_minute
+        self.daily_limit = daily_limit
+        self._next_slot = 0.0
+        self._pace_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=STOP_TIMEOUT_SECONDS):
+        """Stop the threads and wait for sends in progress to finish"""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """Wake idle workers after new emails were queued"""
+        self._wake.set()
+
+    def _reserve_slot(self):
+        """Seconds to wait until this thread may send"""
+        with self._pace_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+    def _idle(self):
+        self._wake.wait(POLL_SECONDS)
+        self._wake.clear()
+
+    def _run(self):
+        service = None
+        while not self._stop.is_set():
+            if self.outbox.sent_since(time.time() - 86400) >= self.daily_limit:
+                self._stop.wait(60)
+                continue
+            if not self.outbox.has_ready():
+                self._idle()
+                continue
+            if self._stop.wait(self._reserve_slot()):
+                break
+            item = self.outbox.claim()
+            if item is None:
+                continue
+            try:
+                service = service or self.service_factory()
+                # Sending is not idempotent, so only quota rejections are retried
+                sent = execute(service.users().messages().send(
+                    userId='me',
+                    body={'raw': encode_message(item['recipient'], item['subject'], item['body'])},
+                    fields='id'
+                ), idempotent=False)
+                self.outbox.mark_sent(item['id'], sent['id'])
+            except Exception as e:
+                if is_rate_limited(e) and item['attempts'] < MAX_ATTEMPTS:
+                    delay = RETRY_BASE_SECONDS * 2 ** (item['attempts'] - 1)
+                    self.outbox.mark_retry(item['id'], str(e), delay)
+                else:
+                    self.outbox.mark_failed(item['id'], str(e))
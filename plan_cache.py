@@ -0,0 +1,209 @@
+# ==================== FILE 22: plan_cache.py ====================
+"""
+Cache of model decisions
+Remembers, per normalized prompt and compacted history, which tool calls
+the model made and what it answered. A repeat question replays the tool
+plan against current Gmail data without calling the model; the cached
+answer text is only reused while the mailbox is unchanged.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from intent_router import normalize
+from memory_cache import LRUCache
+from metrics import registry
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 86400
+
+# Tools without side effects whose output depends only on their arguments
+# and the mailbox; plans using any other tool are never cached
+READ_ONLY_TOOLS = frozenset({
+    'check_gmail_inbox', 'search_gmail', 'get_unread_count', 'read_email_content', 'summarize_emails',
+    'list_email_attachments', 'read_email_attachments',
+})
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    key TEXT PRIMARY KEY,
+    entry TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_plans_stored ON plans (stored_at);
+"""
+
+
+def history_digest(history):
+    """Stable digest of the (role, content) history sent to the model"""
+    return hashlib.sha256(json.dumps(list(history), ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def results_digest(results):
+    return hashlib.sha256("\0".join(results).encode('utf-8')).hexdigest()
+
+
+def _words(prompt):
+    return frozenset(re.findall(r"[\w@.:-]+", prompt))
+
+
+def cacheable(steps):
+    """True if every step of a plan only uses read-only tools"""
+    return all(call['name'] in READ_ONLY_TOOLS for calls in steps for call in calls)
+
+
+class PlanCache:
+    """LRU/TTL cache of tool plans and answers, optionally persisted to SQLite
+
+    Entries are dicts with:
+        steps: one list of {'name', 'args'} tool calls per model step
+        answer: the text the user was shown
+        account, history_id, results: the mailbox state the answer was
+            based on (history_id from the mailbox cache, results a digest
+            of the tool outputs)
+
+    Args:
+        path: SQLite file to persist entries in, or None for memory only
+        max_entries: Entries kept in memory (and on disk)
+        ttl_seconds: Age after which an entry is ignored
+        similarity: Token-set Jaccard threshold for near-duplicate
+            prompts, or None for exact matches only
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 similarity=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.hits = 0
+        self.answer_hits = 0
+        self.misses = 0
+        self._memory = LRUCache(max_entries, ttl_seconds=None)
+        self._lock = threading.RLock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            with self._lock, self._conn:
+                self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def key(prompt, history, salt=''):
+        """Cache key for a prompt asked after a given compacted history
+
+        salt should change whenever the account, model or system prompt does.
+        """
+        return hashlib.sha256(
+            f"{salt}\0{history_digest(history)}\0{normalize(prompt)}".encode('utf-8')
+        ).hexdigest()
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry['stored_at'] <= self.ttl_seconds
+
+    def _load(self, key):
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT entry FROM plans WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _similar(self, prompt, history, account=None):
+        """Best entry of the account for a near-duplicate prompt after the same history"""
+        words = _words(normalize(prompt))
+        digest = history_digest(history)
+        best, best_score = None, self.similarity
+        for entry in self._memory.values():
+            if entry.get('history') != digest or entry.get('account') != account or not self._fresh(entry):
+                continue
+            other = _words(entry['prompt'])
+            score = len(words & other) / len(words | other) if words | other else 0
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def get(self, key, prompt=None, history=(), account=None):
+        """Cached entry for key, falling back to a near-duplicate prompt of the
+        same account if enabled"""
+        start = time.perf_counter()
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                self._memory.set(key, entry)
+        if not self._fresh(entry) and self.similarity and prompt is not None:
+            entry = self._similar(prompt, history, account)
+        hit = self._fresh(entry)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        registry.observe("cache", "plan.hit" if hit else "plan.miss",
+                         (time.perf_counter() - start) * 1000)
+        return entry if hit else None
+
+    def put(self, key, prompt, history, steps, answer, account=None, history_id=None, results=()):
+        entry = {
+            'prompt': normalize(prompt),
+            'history': history_digest(history),
+            'steps': steps,
+            'answer': answer,
+            'account': account,
+            'history_id': history_id,
+            'results': results_digest(results),
+            'stored_at': time.time(),
+        }
+        self._memory.set(key, entry)
+        if self._conn is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO plans (key, entry, stored_at) VALUES (?, ?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False), entry['stored_at'])
+            )
+            # Keep the newest max_entries rows that are still within the TTL
+            self._conn.execute(
+                """DELETE FROM plans WHERE stored_at < ? OR key NOT IN
+                   (SELECT key FROM plans ORDER BY stored_at DESC LIMIT ?)""",
+                (time.time() - self.ttl_seconds, self.max_entries)
+            )
+
+    def answer_valid(self, entry, account, history_id, results):
+        """True if the cached answer still describes the mailbox
+
+        Requires the same account, an unchanged mailbox history id and
+        identical tool output.
+        """
+        # Answers without tool calls need no history check, but still
+        # belong to the account they were given to
+        valid = entry['account'] == account and (
+            not entry['steps']
+            or (history_id is not None
+                and entry['history_id'] == history_id
+                and entry['results'] == results_digest(results))
+        )
+        if valid:
+            with self._lock:
+                self.answer_hits += 1
+        return valid
+
+    def clear(self):
+        self._memory.clear()
+        if self._conn is not None:
+            with self._lock, self._conn:
+                self._conn.execute("DELETE FROM plans")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'answer_hits': self.answer_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._memory),
+            }
@@ -0,0 +1,137 @@
+# ==================== FILE 20: prefetch.py ====================
+"""
+Background inbox warm-up
+A thread outside the Streamlit rerun cycle keeps the mailbox cache synced
+with history().list, the unread count current and the bodies most likely
+to be opened next decoded in memory, so interactive tool calls rarely
+wait on Gmail.
+"""
+
+import threading
+import time
+from collections import deque
+
+from gmail_fetch import fetch_full_messages
+from gmail_quota import execute
+from mime_body import DEFAULT_MAX_CHARS, extract_body
+
+DEFAULT_INTERVAL_SECONDS = 60
+
+# Newest inbox messages whose bodies are kept warm, unread ones first
+DEFAULT_WARM_BODIES = 10
+
+# Bodies requested through hint() that are still waiting to be fetched
+MAX_HINTED = 50
+
+# Longest stop() waits for a pass in progress
+STOP_TIMEOUT_SECONDS = 30
+
+
+class PrefetchWorker:
+    """Keeps a MailboxCache and a body LRUCache warm for one account
+
+    Args:
+        cache: MailboxCache shared with the sessions of this account
+        body_cache: LRUCache of decoded bodies shared the same way
+        service_factory: Callable returning a new Gmail service for the
+            worker thread (httplib2 clients are not thread-safe)
+        interval: Seconds between history polls
+        warm_bodies: Number of recent inbox bodies to keep decoded
+        body_max_chars: Character cap passed to extract_body
+    """
+
+    def __init__(self, cache, body_cache, service_factory, interval=DEFAULT_INTERVAL_SECONDS,
+                 warm_bodies=DEFAULT_WARM_BODIES, body_max_chars=DEFAULT_MAX_CHARS):
+        self.cache = cache
+        self.body_cache = body_cache
+        self.service_factory = service_factory
+        self.interval = interval
+        self.warm_bodies = warm_bodies
+        self.body_max_chars = body_max_chars
+        self.runs = 0
+        self.last_run = None
+        self.last_error = None
+        self._hinted = deque(maxlen=MAX_HINTED)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=STOP_TIMEOUT_SECONDS):
+        """Stop the thread and wait for a running pass to finish"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def hint(self, message_ids):
+        """Ask for these bodies to be warmed soon, e.g. the listing the user just saw"""
+        self._hinted.extend(message_ids)
+        self._wake.set()
+
+    def _run(self):
+        service = None
+        while not self._stop.is_set():
+            try:
+                service = service or self.service_factory()
+                self.warm(service)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # ---------- warming ----------
+    def warm(self, service):
+        """One pass: sync headers, refresh the unread count, decode likely bodies"""
+        self.cache.sync(service)
+
+        if self.cache.get_unread_count() is None:
+            label = execute(service.users().labels().get(
+                userId='me', id='UNREAD', fields='messagesTotal'))
+            self.cache.set_unread_count(label.get('messagesTotal', 0))
+
+        recent = self.cache.list_messages('INBOX', self.warm_bodies)
+        recent.sort(key=lambda message: 'UNREAD' not in message['labels'])
+        wanted = []
+        while self._hinted:
+            wanted.append(self._hinted.popleft())
+        wanted.extend(message['id'] for message in recent)
+        self.warm_message_bodies(service, list(dict.fromkeys(wanted)))
+
+        self.runs += 1
+        self.last_run = time.time()
+
+    def warm_message_bodies(self, service, message_ids):
+        """Put decoded bodies into the LRU, downloading ones the cache lacks"""
+        missing = []
+        for msg_id in message_ids:
+            if self.body_cache.get(msg_id) is not None:
+                continue
+            body = self.cache.get_body(msg_id)
+            if body is None:
+                missing.append(msg_id)
+            else:
+                self.body_cache.set(msg_id, body)
+
+        if not missing:
+            return
+        fetched = [message for message in fetch_full_messages(service, missing)
+                   if 'error' not in message]
+        self.cache.store_messages(fetched)
+        for message in fetched:
+            body = extract_body(message['payload'], self.body_max_chars)
+            self.cache.set_body(message['id'], body)
+            self.body_cache.set(message['id'], body)
+
+    def status(self):
+        return {
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+            'warm_bodies': len(self.body_cache),
+        }
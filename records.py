@@ -0,0 +1,175 @@
+# ==================== FILE 28: records.py ====================
+"""
+Typed tool results
+Listing and email tools return these small records instead of markdown.
+A conversation stores each record once; the UI renders it (email lists
+as tables) and the model gets a terse text form of the same record.
+"""
+
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+# Body characters of one email shown to the user and the model
+BODY_PREVIEW_CHARS = 1000
+
+
+def _stamp(internal_date):
+    """Gmail internalDate (ms since the epoch) as YYYY-MM-DD HH:MM UTC"""
+    return datetime.fromtimestamp(internal_date / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+
+@dataclass(frozen=True, slots=True)
+class EmailRow:
+    """One listed email; error is set instead when it could not be loaded"""
+    number: int
+    id: str
+    sender: str = ''
+    subject: str = ''
+    date: str = ''
+    internal_date: int = 0
+    unread: bool = False
+    error: str = ''
+
+    def to_llm(self):
+        if self.error:
+            return f"{self.number}|error: {self.error}"
+        sent = _stamp(self.internal_date) if self.internal_date else self.date
+        return f"{self.number}|{'U' if self.unread else ''}|{self.sender}|{self.subject}|{sent}"
+
+
+@dataclass(frozen=True, slots=True)
+class EmailList:
+    """An inbox or search listing: the first rows in full, the rest as a summary
+
+    Args:
+        kind: 'inbox' or 'search'
+        query: The search query ('' for the inbox)
+        rows: EmailRow tuple, numbered as the user and model refer to them
+        total, unread, errors: Counts over the whole listing
+        oldest, newest: Date range of the whole listing (YYYY-MM-DD)
+        top_senders: (sender, count) pairs, most frequent first
+    """
+    kind: str
+    query: str
+    rows: tuple
+    total: int
+    unread: int = 0
+    oldest: str = ''
+    newest: str = ''
+    top_senders: tuple = ()
+    errors: int = 0
+
+    @property
+    def title(self):
+        if self.kind == 'inbox':
+            return "📧 **GMAIL INBOX**"
+        return f"🔍 **Search Results** for '{self.query}'"
+
+    @property
+    def hidden(self):
+        """Emails counted in the summary but not listed"""
+        return self.total - len(self.rows)
+
+    def summary_lines(self):
+        lines = [f"- Unread: {self.unread}"]
+        if self.oldest:
+            lines.append(f"- Dates: {self.oldest} to {self.newest}")
+        if self.top_senders:
+            lines.append("- Top senders: " + ", ".join(f"{sender} ({count})" for sender, count in self.top_senders))
+        if self.errors:
+            lines.append(f"- Could not load: {self.errors}")
+        return lines
+
+    def table(self):
+        """Rows for st.dataframe"""
+        return [
+            {"#": row.number, "Unread": row.unread,
+             "From": row.sender if not row.error else "⚠️ Could not load message",
+             "Subject": row.subject or row.error, "Date": row.date}
+            for row in self.rows
+        ]
+
+    def to_markdown(self):
+        lines = [f"{self.title} ({self.total} emails)\n"]
+        for row in self.rows:
+            if row.error:
+                lines.append(f"\n**{row.number}.** ⚠️ Could not load message: {row.error}")
+                continue
+            unread_marker = "🔵 " if row.unread else ""
+            lines.append(f"\n{unread_marker}**{row.number}. From:** {row.sender}")
+            lines.append(f"   **Subject:** {row.subject}")
+            lines.append(f"   **Date:** {row.date}")
+            lines.append("   " + "-" * 50)
+        if self.hidden:
+            lines.append(f"\n**Summary of all {self.total} emails** "
+                         f"(only the first {len(self.rows)} are listed):")
+            lines.extend(self.summary_lines())
+        return "\n".join(lines)
+
+    def to_llm(self):
+        head = "inbox" if self.kind == 'inbox' else f"search '{self.query}'"
+        lines = [f"[{head}: {self.total} emails, {self.unread} unread; #|U=unread|from|subject|date]"]
+        lines.extend(row.to_llm() for row in self.rows)
+        if self.hidden:
+            lines.append(f"[{self.hidden} more not listed]")
+            lines.extend(self.summary_lines()[1:])
+        return "\n".join(lines)
+
+
+@dataclass(frozen=True, slots=True)
+class EmailContent:
+    """One opened email; body holds at most BODY_PREVIEW_CHARS characters"""
+    number: int
+    id: str
+    sender: str
+    subject: str
+    date: str
+    body: str
+    truncated: bool = False
+
+    def to_markdown(self):
+        return f"""📧 **Email #{self.number}**
+
+**From:** {self.sender}
+**Subject:** {self.subject}
+**Date:** {self.date}
+
+**Content:**
+{self.body}{'...' if self.truncated else ''}"""
+
+    def to_llm(self):
+        return (f"[email #{self.number}] from: {self.sender} | subject: {self.subject} | date: {self.date}\n"
+                f"{self.body}{'…' if self.truncated else ''}")
+
+
+RECORD_TYPES = (EmailList, EmailContent)
+
+
+# ---------- replies ----------
+# A reply is a list of parts: text strings and records, in display order
+
+def append_part(parts, part):
+    """Add text or a record to a reply, merging consecutive text"""
+    if isinstance(part, str) and parts and isinstance(parts[-1], str):
+        parts[-1] += part
+    else:
+        parts.append(part)
+
+
+def _parts(content):
+    return content if isinstance(content, (list, tuple)) else [content]
+
+
+def to_llm(content):
+    """Terse text of a tool result, record, or reply for the model"""
+    return "".join(part if isinstance(part, str) else part.to_llm() for part in _parts(content))
+
+
+def to_markdown(content):
+    """Markdown of a tool result, record, or reply, for text-only front ends"""
+    return "".join(part if isinstance(part, str) else part.to_markdown() for part in _parts(content))
+
+
+def to_dict(record):
+    """JSON-ready form of a record"""
+    return {"type": type(record).__name__, **asdict(record)}
@@ -0,0 +1,160 @@
+# ==================== FILE 17: search_query.py ====================
+"""
+Gmail search query translation for the local index
+Parses the Gmail operators the mailbox cache can evaluate itself into SQL
+filters. Queries using any other operator return None and are sent to
+the API.
+"""
+
+import re
+import time
+from datetime import datetime, timezone
+
+_TOKEN = re.compile(r'(\w+):"([^"]*)"|(\w+):(\S+)|"([^"]*)"|(\S+)')
+
+# System labels addressable with in: and label:
+SYSTEM_LABELS = {'inbox', 'sent', 'starred', 'important', 'unread', 'draft', 'spam', 'trash'}
+
+# is:<value> -> (label, whether the label must be present)
+IS_LABELS = {
+    'unread': ('UNREAD', True),
+    'read': ('UNREAD', False),
+    'starred': ('STARRED', True),
+    'important': ('IMPORTANT', True),
+}
+
+# newer_than: / older_than: units in seconds
+RELATIVE_UNITS = {'d': 86400, 'm': 30 * 86400, 'y': 365 * 86400}
+
+DATE_FORMATS = ('%Y/%m/%d', '%Y-%m-%d', '%m/%d/%Y')
+
+# Words Gmail treats as operators rather than search terms
+RESERVED_WORDS = {'OR', 'AND', 'AROUND'}
+
+# FTS5 columns searched by from: and subject:
+FTS_COLUMNS = {'from': 'sender', 'subject': 'subject'}
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form used as a cache key"""
+    return ' '.join(query.lower().split())
+
+
+def _parse_date(value):
+    """Gmail after:/before: value as milliseconds since the epoch (UTC)"""
+    if value.isdigit():
+        return int(value) * 1000
+    for fmt in DATE_FORMATS:
+        try:
+            day = datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        return int(day.timestamp() * 1000)
+    return None
+
+
+def _relative_ms(value, now):
+    match = re.fullmatch(r'(\d+)([dmy])', value)
+    if not match:
+        return None
+    return int((now - int(match.group(1)) * RELATIVE_UNITS[match.group(2)]) * 1000)
+
+
+def _label_filter(label, present=True):
+    return (f"m.label_ids {'' if present else 'NOT '}LIKE ?", [f'%"{label}"%'])
+
+
+class ParsedQuery:
+    """A Gmail query the local index can evaluate
+
+    Attributes:
+        tokens: Normalized terms, e.g. {'from:bob', 'is:unread', 'text:report'}
+        text_terms: The free-text part of tokens, which the index cannot
+            match exactly (Gmail also searches bodies it has not seen)
+        filters: (sql, params) pairs over the messages table aliased as m
+        inbox: True if the query is restricted to the inbox
+        since_ms: Earliest internal date the query can match, if bounded
+    """
+
+    def __init__(self):
+        self.tokens = set()
+        self.text_terms = set()
+        self.filters = []
+        self.inbox = False
+        self.since_ms = None
+
+    def where(self):
+        """SQL condition and parameters for all filters"""
+        if not self.filters:
+            return '1', []
+        sql = ' AND '.join(f'({condition})' for condition, _ in self.filters)
+        params = [param for _, condition_params in self.filters for param in condition_params]
+        return sql, params
+
+    def narrow_since(self, ms):
+        self.since_ms = ms if self.since_ms is None else max(self.since_ms, ms)
+
+
+def parse_query(query, now=None):
+    """Translate a Gmail query into a ParsedQuery, or None if any part is unsupported"""
+    now = now or time.time()
+    parsed = ParsedQuery()
+
+    for match in _TOKEN.finditer(query):
+        quoted_key, quoted_value, key, value, phrase, word = match.groups()
+        if quoted_key:
+            key, value = quoted_key, quoted_value
+        if key:
+            key, value = key.lower(), value.lower().strip()
+            if not value or not _apply_operator(parsed, key, value, now):
+                return None
+            parsed.tokens.add(f'{key}:{value}')
+            continue
+
+        term = phrase if phrase is not None else word
+        if term in RESERVED_WORDS or term.startswith(('-', '(', '{', '+')):
+            return None
+        term = term.lower().strip()
+        if term:
+            parsed.text_terms.add(f'text:{term}')
+            parsed.tokens.add(f'text:{term}')
+
+    return parsed
+
+
+def _apply_operator(parsed, key, value, now):
+    """Add the filter for one key:value operator; False if it is unsupported"""
+    if key in FTS_COLUMNS:
+        words = re.findall(r'\w+', value)
+        if not words:
+            return False
+        parsed.filters.append((
+            'm.rowid IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)',
+            [f'{FTS_COLUMNS[key]} : "{" ".join(words)}"'],
+        ))
+    elif key == 'is' and value in IS_LABELS:
+        parsed.filters.append(_label_filter(*IS_LABELS[value]))
+    elif key in ('in', 'label') and value in SYSTEM_LABELS:
+        parsed.filters.append(_label_filter(value.upper()))
+        parsed.inbox = parsed.inbox or value == 'inbox'
+    elif key in ('after', 'before'):
+        ms = _parse_date(value)
+        if ms is None:
+            return False
+        if key == 'after':
+            parsed.filters.append(('m.internal_date >= ?', [ms]))
+            parsed.narrow_since(ms)
+        else:
+            parsed.filters.append(('m.internal_date < ?', [ms]))
+    elif key in ('newer_than', 'older_than'):
+        ms = _relative_ms(value, now)
+        if ms is None:
+            return False
+        if key == 'newer_than':
+            parsed.filters.append(('m.internal_date >= ?', [ms]))
+            parsed.narrow_since(ms)
+        else:
+            parsed.filters.append(('m.internal_date < ?', [ms]))
+    else:
+        return False
+    return True
@@ -0,0 +1,294 @@
+# ==================== FILE 25: server.py ====================
+"""
+Gmail agent over HTTP
+A small asyncio HTTP/1.1 server with a JSON API, using only the standard
+library. Each conversation keeps its AgentContext and history on the
+server; agent turns run in worker threads so one slow turn never blocks
+other requests.
+
+    python server.py --port 8080
+
+    POST /chat    {"message": "...", "session": "...", "account": "...", "grant": "...",
+                   "stream": false}
+                  -> {"session", "answer", "records", "timings", "tokens"}
+                  with "stream": true the reply is NDJSON, one event per line
+                  "grant" is the account's access key from `python cli.py --server-grant`
+                  and is needed on every request
+    GET  /healthz -> {"status": "ok", "sessions": n}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import time
+
+from agent_core import AgentContext, connect_account, run_agent_parts, run_agent_stream
+from memory_cache import LRUCache
+from records import append_part, to_dict, to_markdown
+
+SESSION_LIMIT = int(os.getenv("SESSION_LIMIT", "1000"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+# Idle keep-alive connections are closed after this long
+KEEP_ALIVE_SECONDS = 30
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+           500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    """One conversation: its agent context, history and a lock serializing its turns"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.context = AgentContext()
+        self.history = []
+        self.lock = asyncio.Lock()
+
+
+class AgentServer:
+    """Routes HTTP requests to agent turns
+
+    Args:
+        session_limit: Conversations kept in memory
+        session_ttl: Seconds of inactivity after which a conversation is forgotten
+    """
+
+    def __init__(self, session_limit=SESSION_LIMIT, session_ttl=SESSION_TTL):
+        # Reads refresh an entry's position but not its age, so sessions
+        # are stored again after every turn
+        self.sessions = LRUCache(session_limit, session_ttl)
+        self.started = time.time()
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id) if session_id else None
+        if session is None:
+            session = Session(session_id or secrets.token_urlsafe(16))
+            self.sessions.set(session.id, session)
+        return session
+
+    # ---------- HTTP ----------
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader), KEEP_ALIVE_SECONDS)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    keep_alive = await self.dispatch(writer, method, path, body, keep_alive)
+                except HTTPError as e:
+                    await send_json(writer, e.status, {"error": str(e)}, keep_alive)
+                except ConnectionError:
+                    break
+                except Exception as e:
+                    await send_json(writer, 500, {"error": str(e)}, keep_alive=False)
+                    break
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def dispatch(self, writer, method, path, body, keep_alive):
+        """Answer one request; returns whether the connection stays open"""
+        path = path.split("?", 1)[0]
+        if path == "/healthz":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            await send_json(writer, 200, {"status": "ok", "sessions": len(self.sessions),
+                                          "uptime_s": round(time.time() - self.started)}, keep_alive)
+            return keep_alive
+        if path == "/chat":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            return await self.chat(writer, parse_json(body), keep_alive)
+        raise HTTPError(404, f"no route for {path}")
+
+    # ---------- agent ----------
+    async def chat(self, writer, request, keep_alive):
+        message = str(request.get("message") or "").strip()
+        if not message:
+            raise HTTPError(400, "message is required")
+        session = self.session(request.get("session"))
+        if session.lock.locked():
+            raise HTTPError(409, "a turn is already running for this session")
+
+        async with session.lock:
+            await self.connect(session, request.get("account"), str(request.get("grant") or ""))
+            history = list(session.history)
+            if request.get("stream"):
+                parts = await self.stream_turn(writer, session, message, history)
+                keep_alive = False
+            else:
+                parts = await asyncio.to_thread(run_agent_parts, message, history, session.context)
+                await send_json(writer, 200, turn_result(session, parts), keep_alive)
+            # Records are kept as they are; the model gets their terse form
+            session.history += [("human", message), ("assistant", parts)]
+            self.sessions.set(session.id, session)
+        return keep_alive
+
+    async def connect(self, session, account, grant):
+        """Connect the session on its first turn, or to a different account when asked
+
+        Session ids are chosen by clients, so every turn must show the grant
+        the session was connected with.
+        """
+        context = session.context
+        if context.account and (not account or account.strip().lower() == context.account):
+            if not secrets.compare_digest(grant.encode(), context.grant.encode()):
+                raise HTTPError(401, "grant does not match the session's account")
+            return
+        if context.account:
+            # Listings and caches of the previous account must not leak into the new one
+            context.reset()
+        try:
+            connected = await asyncio.to_thread(connect_account, context, account, None, grant)
+        except PermissionError as e:
+            raise HTTPError(401, str(e))
+        if connected is None:
+            raise HTTPError(401, "login required")
+
+    async def stream_turn(self, writer, session, message, history):
+        """Send the turn's events as NDJSON while it runs; the reply ends when the connection closes"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def produce():
+            try:
+                for event in run_agent_stream(message, history, session.context):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            finally:
+                loop.call_soon_threadsafe(events.put_nowait, None)
+
+        writer.write(response_head(200, "application/x-ndjson", keep_alive=False))
+        worker = loop.run_in_executor(None, produce)
+        parts = []
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            kind, payload = event
+            if kind != "progress":
+                append_part(parts, payload)
+            writer.write(json_line({"type": kind, "data": to_dict(payload) if kind == "record" else payload}))
+            await writer.drain()
+        await worker
+        writer.write(json_line({"type": "done", **turn_result(session, parts)}))
+        await writer.drain()
+        return parts
+
+
+def turn_result(session, parts):
+    context = session.context
+    return {
+        "session": session.id,
+        "account": context.account,
+        "answer": to_markdown(parts),
+        "records": [to_dict(part) for part in parts if not isinstance(part, str)],
+        "timings": context.agent_timings,
+        "tokens": context.token_stats,
+    }
+
+
+# ---------- wire format ----------
+async def read_request(reader):
+    """Parse one request: (method, path, headers, body), or None at end of stream"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
+    except asyncio.LimitOverrunError:
+        raise HTTPError(413, "headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(400, "chunked request bodies are not supported")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(400, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"request body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def parse_json(body):
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "body is not valid JSON")
+    if not isinstance(request, dict):
+        raise HTTPError(400, "body must be a JSON object")
+    return request
+
+
+def response_head(status, content_type, length=None, keep_alive=True):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def json_line(payload):
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def send_json(writer, status, payload, keep_alive=True):
+    body = json_line(payload)
+    writer.write(response_head(status, "application/json", len(body), keep_alive) + body)
+    await writer.drain()
+
+
+async def serve(host, port):
+    app = AgentServer()
+    server = await asyncio.start_server(app.handle, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Gmail agent listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Gmail agent over HTTP")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8080")))
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
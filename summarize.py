@@ -0,0 +1,143 @@
+# ==================== FILE 19: summarize.py ====================
+"""
+Map-reduce email summarization and triage
+Emails are summarized in small chunks by concurrent LLM calls, bounded by
+a semaphore, and the per-email results are reduced into one digest.
+Summaries are keyed by message id and content hash, so re-running over an
+overlapping window only sends new mail to the model.
+"""
+
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import registry
+
+# Emails per LLM call
+CHUNK_SIZE = 5
+
+# Body characters sent to the model per email
+BODY_CHARS = 1500
+
+PROMPT = """For each email below, write a one-sentence summary and decide whether it needs a reply from the recipient.
+Answer with only a JSON array, one object per email: {"n": <email number>, "summary": "...", "needs_reply": true or false}
+
+"""
+
+
+def content_hash(subject, body):
+    return hashlib.sha256(f"{subject}\0{body}".encode('utf-8')).hexdigest()[:32]
+
+
+def build_prompt(emails):
+    parts = [PROMPT]
+    for n, email in enumerate(emails, 1):
+        parts.append(f"[{n}] From: {email['from']}\nSubject: {email['subject']}\n"
+                     f"Body: {email['body'][:BODY_CHARS]}\n")
+    return "\n".join(parts)
+
+
+def parse_summaries(text, count):
+    """Map email number (1-based) to {'summary', 'needs_reply'}; missing entries are left out"""
+    match = re.search(r'\[.*\]', text or '', re.DOTALL)
+    if not match:
+        return {}
+    try:
+        items = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    results = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            n = int(item.get('n'))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= n <= count and item.get('summary'):
+            results[n] = {'summary': str(item['summary']).strip(),
+                          'needs_reply': bool(item.get('needs_reply'))}
+    return results
+
+
+def summarize_batch(llm, emails, slots, cache=None, model_name='llm', progress=None):
+    """Summarize emails, reusing cached summaries
+
+    Args:
+        llm: Chat model without tools
+        emails: Dicts with id, from, subject, body and hash
+        slots: Semaphore bounding concurrent LLM calls (shared process-wide)
+        cache: Optional MailboxCache holding earlier summaries
+        model_name: Metrics series name for the LLM calls
+        progress: Optional callback(done, total) after each chunk
+
+    Returns:
+        (results, cached_count) where results maps message id to
+        {'summary', 'needs_reply'}
+    """
+    results = cache.get_summaries((email['id'], email['hash']) for email in emails) if cache else {}
+    cached_count = len(results)
+    pending = [email for email in emails if email['id'] not in results]
+    chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+    done = 0
+
+    def summarize_chunk(chunk):
+        with slots:
+            start = time.perf_counter()
+            error = True
+            try:
+                response = llm.invoke(build_prompt(chunk))
+                error = False
+            finally:
+                registry.observe("llm", model_name, (time.perf_counter() - start) * 1000, error)
+        usage = getattr(response, "usage_metadata", None) or {}
+        registry.add_tokens(model_name, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        parsed = parse_summaries(response.text, len(chunk))
+        return {chunk[n - 1]['id']: entry for n, entry in parsed.items()}
+
+    if chunks:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            futures = [pool.submit(summarize_chunk, chunk) for chunk in chunks]
+            for future in futures:
+                try:
+                    chunk_results = future.result()
+                except Exception:
+                    chunk_results = {}
+                results.update(chunk_results)
+                done += 1
+                if progress:
+                    progress(done, len(chunks))
+
+    if cache:
+        by_id = {email['id']: email for email in pending}
+        cache.store_summaries(
+            (msg_id, by_id[msg_id]['hash'], entry['summary'], entry['needs_reply'])
+            for msg_id, entry in results.items() if msg_id in by_id
+        )
+    return results, cached_count
+
+
+def render_digest(emails, results, title):
+    """Reduce per-email results into one digest: emails needing a reply first
+
+    Returns:
+        (digest, ordered_ids) where ordered_ids gives the message each
+        number in the digest refers to
+    """
+    needs_reply = [email for email in emails if results.get(email['id'], {}).get('needs_reply')]
+    others = [email for email in emails if not results.get(email['id'], {}).get('needs_reply')]
+    ordered = needs_reply + others
+
+    lines = [f"{title} ({len(emails)} emails, {len(needs_reply)} need a reply)\n"]
+    for i, email in enumerate(ordered, 1):
+        if i == 1 and needs_reply:
+            lines.append("**↩️ Needs a reply**")
+        if i == len(needs_reply) + 1:
+            lines.append("\n**📰 For your information**")
+        entry = results.get(email['id'])
+        summary = entry['summary'] if entry else f"(no summary) {email['subject']}"
+        lines.append(f"{i}. **{email['from']}** · {summary}")
+
+    return "\n".join(lines), [email['id'] for email in ordered]
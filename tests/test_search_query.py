@@ -0,0 +1,177 @@
+"""Gmail query to SQL translation used by the local mailbox index"""
+
+import pytest
+
+from mailbox_cache import MailboxCache
+from search_query import normalize_query, parse_query
+
+DAY_MS = 86400 * 1000
+NOW_MS = 1767225600000 + 30 * DAY_MS  # 2026-01-31T00:00:00Z
+NOW = NOW_MS / 1000
+
+
+def message(msg_id, days_ago, labels, sender='Alice <alice@example.com>', subject='Hello'):
+    return {
+        'id': msg_id,
+        'threadId': msg_id,
+        'internalDate': str(NOW_MS - days_ago * DAY_MS),
+        'labelIds': labels,
+        'snippet': '',
+        'payload': {'headers': [
+            {'name': 'From', 'value': sender},
+            {'name': 'Subject', 'value': subject},
+            {'name': 'Date', 'value': 'Mon, 1 Jan 2026 00:00:00 +0000'},
+        ]},
+    }
+
+
+MESSAGES = [
+    message('fresh', 0, ['INBOX', 'UNREAD']),
+    message('week', 7, ['INBOX', 'STARRED'], sender='Bob <bob@example.com>', subject='Weekly report'),
+    message('month', 40, ['INBOX', 'IMPORTANT', 'UNREAD'], sender='Bob <bob@example.com>'),
+    message('sent', 2, ['SENT'], subject='Weekly report draft'),
+    message('old', 400, ['TRASH']),
+]
+
+# query -> ids it matches among MESSAGES, newest first
+SUPPORTED = [
+    ('from:bob', ['week', 'month']),
+    ('from:bob@example.com', ['week', 'month']),
+    ('subject:"weekly report"', ['sent', 'week']),
+    ('subject:report from:bob', ['week']),
+    ('is:unread', ['fresh', 'month']),
+    ('is:read', ['sent', 'week', 'old']),
+    ('is:starred', ['week']),
+    ('is:important', ['month']),
+    ('in:inbox', ['fresh', 'week', 'month']),
+    ('label:sent', ['sent']),
+    ('in:trash', ['old']),
+    ('IN:INBOX IS:UNREAD', ['fresh', 'month']),
+    ('after:2026/01/20', ['fresh', 'sent', 'week']),
+    ('before:2026-01-20', ['month', 'old']),
+    ('after:01/20/2026 before:2026/01/30', ['sent', 'week']),
+    (f'after:{(NOW_MS - 3 * DAY_MS) // 1000}', ['fresh', 'sent']),
+    ('newer_than:3d', ['fresh', 'sent']),
+    ('older_than:1m', ['month', 'old']),
+    ('newer_than:1y in:inbox', ['fresh', 'week', 'month']),
+    ('older_than:1y', ['old']),
+]
+
+UNSUPPORTED = [
+    'to:alice@example.com',
+    'cc:bob',
+    'bcc:bob',
+    'has:attachment',
+    'filename:pdf',
+    'is:snoozed',
+    'label:work',
+    'in:anywhere',
+    'category:promotions',
+    'size:1M',
+    'after:yesterday',
+    'newer_than:2w',
+    'older_than:d',
+    'from:"!!!"',
+    'from:bob OR from:alice',
+    'report AND budget',
+    '-from:bob',
+    '(from:bob)',
+    '{from:bob from:alice}',
+    '+report',
+]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MailboxCache(str(tmp_path / 'cache.db'))
+    if not cache.fts:
+        pytest.skip('SQLite built without FTS5')
+    cache.store_messages(MESSAGES)
+    return cache
+
+
+def matching_ids(cache, query):
+    where, params = parse_query(query, now=NOW).where()
+    rows = cache._conn.execute(
+        f'SELECT m.id FROM messages m WHERE {where} ORDER BY m.internal_date DESC', params
+    ).fetchall()
+    return [row['id'] for row in rows]
+
+
+@pytest.mark.parametrize('query, expected', SUPPORTED)
+def test_supported_operator_matches(cache, query, expected):
+    assert matching_ids(cache, query) == expected
+
+
+@pytest.mark.parametrize('query', UNSUPPORTED)
+def test_unsupported_operator_is_left_to_gmail(query):
+    assert parse_query(query, now=NOW) is None
+
+
+@pytest.mark.parametrize('query, tokens, text_terms, inbox, since_ms', [
+    ('From:Bob  is:UNREAD', {'from:bob', 'is:unread'}, set(), False, None),
+    ('in:inbox weekly "status report"', {'in:inbox', 'text:weekly', 'text:status report'},
+     {'text:weekly', 'text:status report'}, True, None),
+    ('after:2026/01/20 newer_than:3d', {'after:2026/01/20', 'newer_than:3d'}, set(), False,
+     NOW_MS - 3 * DAY_MS),
+    ('older_than:1d before:2026/01/20', {'older_than:1d', 'before:2026/01/20'}, set(), False, None),
+])
+def test_parsed_attributes(query, tokens, text_terms, inbox, since_ms):
+    parsed = parse_query(query, now=NOW)
+    assert (parsed.tokens, parsed.text_terms, parsed.inbox, parsed.since_ms) == \
+        (tokens, text_terms, inbox, since_ms)
+
+
+def test_free_text_only_query_has_no_filters():
+    assert parse_query('quarterly budget', now=NOW).where() == ('1', [])
+
+
+def test_normalize_query():
+    assert normalize_query('  From:Bob   IS:unread ') == 'from:bob is:unread'
+
+
+def test_repeated_relative_search_drops_expired_results(cache, monkeypatch):
+    monkeypatch.setattr('search_query.time.time', lambda: NOW)
+    cache.record_search('newer_than:8d', ['fresh', 'sent', 'week'])
+    assert cache.search('newer_than:8d', 10) == ['fresh', 'sent', 'week']
+    # Two days later the week-old message falls out of the window
+    monkeypatch.setattr('search_query.time.time', lambda: NOW + 2 * 86400)
+    assert cache.search('newer_than:8d', 10) == ['fresh', 'sent']
+
+
+def test_older_than_search_is_not_stored(cache):
+    cache.record_search('older_than:1m', ['month', 'old'])
+    assert cache._conn.execute('SELECT query FROM search_coverage').fetchall() == []
+
+
+class _Request:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class _HistoryService:
+    """Just enough of the Gmail service to replay one page of history"""
+
+    def __init__(self, history):
+        self.history_page = {'historyId': '200', 'history': history}
+
+    def users(self):
+        return self
+
+    def history(self):
+        return self
+
+    def list(self, **kwargs):
+        return _Request(self.history_page)
+
+
+def test_search_is_dropped_when_a_message_is_added_outside_the_inbox(cache):
+    cache.record_search('subject:"weekly report"', ['sent', 'week'])
+    assert cache.search('subject:"weekly report"', 10) == ['sent', 'week']
+    cache._set_state('history_id', '100')
+    service = _HistoryService([{'messagesAdded': [{'message': {'id': 'reply', 'labelIds': ['SENT']}}]}])
+    assert cache.sync(service) == 'delta'
+    assert cache.search('subject:"weekly report"', 10) is None